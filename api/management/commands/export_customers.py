@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.v1.customers.exporter import CustomerExporter, CustomerLogExporter, EXPORT_FORMATS, EXPORT_FORMAT_CSV
+from api.v1.customers.filters import CustomerFilter
+from customers.models import Customer
+from customers.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Export customers (or their logs) as CSV or NDJSON, with the same fields and filters as the API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Path to the file. By default, the standard output')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default=EXPORT_FORMAT_CSV)
+        parser.add_argument('--fields', help='Comma separated fields (the names of the API)')
+        parser.add_argument('--logs', action='store_true', help='Export the logs of the customers')
+        parser.add_argument('--search', help='Export only the customers that match this search')
+        parser.add_argument('--created-since', help='Export only the customers created since this date (ISO 8601)')
+        parser.add_argument('--updated-since', help='Export only the customers updated since this date (ISO 8601)')
+        parser.add_argument(
+            '--include-deleted', action='store_true', help='Export the deleted customers as tombstones as well')
+
+    def handle(self, *args, **options):
+        exporter_class = CustomerLogExporter if options['logs'] else CustomerExporter
+        fields = [field.strip() for field in (options['fields'] or '').split(',') if field.strip()]
+        try:
+            exporter = exporter_class(
+                file_format=options['format'], fields=fields, include_deleted=options['include_deleted'])
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        queryset = Customer.objects.all() if options['include_deleted'] else Customer.objects_not_deleted.all()
+        filterset = CustomerFilter(
+            {name: options[name] for name in ('created_since', 'updated_since') if options[name]}, queryset=queryset)
+        if not filterset.is_valid():
+            raise CommandError(', '.join(
+                '{}: {}'.format(name, ' '.join(errors)) for name, errors in filterset.errors.items()))
+        queryset = filterset.qs
+
+        if options['search']:
+            queryset = get_search_backend().search(queryset, options['search'].split())
+
+        output = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else self.stdout
+        try:
+            for line in exporter.export(queryset):
+                output.write(line)
+        finally:
+            if output is not self.stdout:
+                output.close()
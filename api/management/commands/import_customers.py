@@ -0,0 +1,35 @@
+import os
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from api.v1.customers.importer import CustomerImporter, IMPORT_FORMATS
+
+
+class Command(BaseCommand):
+    help = 'Import customers from a CSV or JSONL file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path to the file')
+        parser.add_argument('--username', required=True, help='User that creates the customers')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='File format. By default, the file extension')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Number of rows inserted in each transaction')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'], is_active=True)
+        except User.DoesNotExist:
+            raise CommandError('User "{}" does not exist'.format(options['username']))
+
+        file_format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if file_format not in IMPORT_FORMATS:
+            raise CommandError('Invalid format "{}"'.format(file_format))
+
+        importer = CustomerImporter(user=user, file_format=file_format, chunk_size=options['chunk_size'])
+        with open(options['path'], 'rb') as import_file:
+            result = importer.run(import_file)
+
+        for error in result['errors']:
+            self.stderr.write('Row {}: {}'.format(error['row'], error['errors']))
+        self.stdout.write(self.style.SUCCESS(
+            '{} customers have been created, {} rows have errors'.format(result['created'], result['error_count'])))
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from api.v1.auth_crm.authentication import basic_credentials_cache, token_cache
+
+
+@receiver([post_save, post_delete], sender=Token)
+def invalidate_cached_token(sender, instance=None, **kwargs):
+    """ A deleted or rotated token mustn't be used from the authentication cache """
+    token_cache.invalidate([instance.key])
+
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user_credentials(sender, instance=None, created=False, **kwargs):
+    """
+    The cached credentials have a copy of the user, so they are invalidated when the user changes (e.g. deactivation
+    or a new password with 'set_password')
+    """
+    if created:
+        return
+
+    token_cache.invalidate_tag(instance.pk)
+    basic_credentials_cache.invalidate_tag(instance.pk)
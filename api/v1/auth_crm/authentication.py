@@ -0,0 +1,231 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.crypto import salted_hmac
+
+from rest_framework import exceptions
+from rest_framework.authentication import BasicAuthentication, TokenAuthentication
+
+
+class AuthCache:
+    """
+    LRU cache with TTL to store verified credentials in the process. Optionally, it can be backed by a shared cache
+    (a Django cache alias), so the workers share the entries.
+
+    Each entry has a tag (the user id), so all the entries of a user can be invalidated at once. When there is an
+    invalidation, a counter (epoch) is incremented in the shared cache. Each process checks the epoch before reading
+    its local entries, and it clears them if it has changed. The shared entries store the version of their tag, so
+    they are discarded if the tag has been invalidated. So, revoked credentials stop working in all workers
+    immediately. Without shared cache, the invalidation only affects the current process, so the entries only live
+    'local_ttl' seconds (the other workers could use revoked credentials during that time).
+
+    Each 'get' returns a copy of the value, so the objects of a request (e.g. the permission caches of a user) aren't
+    shared with other requests.
+    """
+
+    def __init__(self, prefix, ttl=60, max_size=10000, cache_alias=None, local_ttl=5):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.max_size = max_size
+        self.cache_alias = cache_alias
+        self.local_ttl = local_ttl  # Max TTL without shared cache
+
+        self._entries = OrderedDict()  # key -> (value, tag, expires_at)
+        self._keys_by_tag = {}
+        self._lock = threading.Lock()
+        self._epoch = None
+        self._generation = 0  # It changes with each invalidation
+
+    @classmethod
+    def from_settings(cls, prefix, setting_name):
+        options = getattr(settings, setting_name, {})
+        return cls(
+            prefix=prefix,
+            ttl=options.get('TTL', 60),
+            max_size=options.get('MAX_SIZE', 10000),
+            cache_alias=options.get('CACHE_ALIAS'),
+            local_ttl=options.get('LOCAL_TTL', 5),
+        )
+
+    @property
+    def shared_cache(self):
+        return caches[self.cache_alias] if self.cache_alias else None
+
+    @property
+    def entry_ttl(self):
+        """ :return: Seconds of the local entries. Without shared cache, other processes can't invalidate them """
+        return self.ttl if self.cache_alias else min(self.ttl, self.local_ttl)
+
+    @property
+    def epoch_key(self):
+        return '{}:epoch'.format(self.prefix)
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def get(self, key):
+        shared_cache = self.shared_cache
+        if shared_cache is not None:
+            epoch = shared_cache.get(self.epoch_key, 0)
+            with self._lock:
+                if epoch != self._epoch:
+                    self._clear_local()
+                    self._epoch = epoch
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, tag, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    return copy.deepcopy(value)
+                self._remove_local(key)
+
+        if shared_cache is not None:
+            shared_entry = shared_cache.get(self._get_shared_key(key))
+            if shared_entry is not None:
+                value, tag, tag_version = shared_entry
+                if tag_version == shared_cache.get(self._get_tag_key(tag), 0):
+                    self._set_local(key, value, tag)
+                    return copy.deepcopy(value)
+
+        return None
+
+    def set(self, key, value, tag, generation=None):
+        """
+        :param key:
+        :param value:
+        :param tag: Tag to invalidate the entry with other entries (e.g. user id)
+        :param generation: Generation read before getting the value from the database. If there has been an
+        invalidation since then, the value could be revoked and it isn't stored
+        """
+        if generation is not None and generation != self._generation:
+            return
+
+        # The value is copied, because the caller keeps using it (e.g. the user of the request)
+        self._set_local(key, copy.deepcopy(value), tag)
+
+        shared_cache = self.shared_cache
+        if shared_cache is not None:
+            tag_version = shared_cache.get(self._get_tag_key(tag), 0)
+            shared_cache.set(self._get_shared_key(key), (value, tag, tag_version), timeout=self.ttl)
+
+    def invalidate(self, keys):
+        keys = list(keys)
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._remove_local(key)
+
+        shared_cache = self.shared_cache
+        if shared_cache is not None:
+            shared_cache.delete_many([self._get_shared_key(key) for key in keys])
+            self._increment(shared_cache, self.epoch_key)
+
+    def invalidate_tag(self, tag):
+        with self._lock:
+            self._generation += 1
+            for key in list(self._keys_by_tag.get(tag, ())):
+                self._remove_local(key)
+
+        shared_cache = self.shared_cache
+        if shared_cache is not None:
+            self._increment(shared_cache, self._get_tag_key(tag))
+            self._increment(shared_cache, self.epoch_key)
+
+    def clear(self):
+        with self._lock:
+            self._clear_local()
+
+    def _set_local(self, key, value, tag):
+        with self._lock:
+            self._remove_local(key)
+            self._entries[key] = (value, tag, time.monotonic() + self.entry_ttl)
+            self._keys_by_tag.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove_local(next(iter(self._entries)))
+
+    def _remove_local(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            tag_keys = self._keys_by_tag.get(entry[1])
+            if tag_keys is not None:
+                tag_keys.discard(key)
+                if not tag_keys:
+                    del self._keys_by_tag[entry[1]]
+
+    def _clear_local(self):
+        self._generation += 1
+        self._entries.clear()
+        self._keys_by_tag.clear()
+
+    def _get_shared_key(self, key):
+        return '{}:{}'.format(self.prefix, key)
+
+    def _get_tag_key(self, tag):
+        return '{}:tag:{}'.format(self.prefix, tag)
+
+    @staticmethod
+    def _increment(shared_cache, key):
+        try:
+            shared_cache.incr(key)
+        except ValueError:
+            shared_cache.set(key, 1, timeout=None)
+
+
+token_cache = AuthCache.from_settings(prefix='auth-token', setting_name='TOKEN_AUTH_CACHE')
+basic_credentials_cache = AuthCache.from_settings(prefix='auth-basic', setting_name='BASIC_AUTH_CACHE')
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that caches each token with its user (see AuthCache), so the database is only queried when
+    the token isn't in the cache. The cache is invalidated when a token is deleted or changed and when its user is
+    saved (e.g. deactivated), see the receivers in api.signals.
+    """
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is None:
+            generation = token_cache.generation
+            user, token = super(CachedTokenAuthentication, self).authenticate_credentials(key)
+            token_cache.set(key, token, tag=user.pk, generation=generation)
+            return user, token
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+        return token.user, token
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    """
+    Basic authentication that remembers the verified credentials for a short time (see AuthCache), so the password
+    hash (PBKDF2) isn't calculated in each request. The key of the cache is a HMAC of the credentials with the
+    SECRET_KEY, so the password is never stored. The cache of a user is invalidated when the user is saved (e.g. the
+    password is changed or the user is deactivated), see the receivers in api.signals.
+    """
+    hmac_salt = 'api.v1.auth_crm.authentication.CachedBasicAuthentication'
+
+    def authenticate_credentials(self, userid, password, request=None):
+        key = self.get_cache_key(userid, password)
+        user = basic_credentials_cache.get(key)
+        if user is None:
+            generation = basic_credentials_cache.generation
+            user, auth = super(CachedBasicAuthentication, self).authenticate_credentials(userid, password, request)
+            basic_credentials_cache.set(key, user, tag=user.pk, generation=generation)
+            return user, auth
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+        return user, None
+
+    def get_cache_key(self, userid, password):
+        return salted_hmac(self.hmac_salt, '{}\0{}'.format(userid, password)).hexdigest()
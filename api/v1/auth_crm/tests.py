@@ -1,9 +1,21 @@
+import base64
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
 from django.contrib.auth.models import User
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework import status
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIRequestFactory, APITransactionTestCase, force_authenticate
 
 from api.v1.auth_crm import views as auth_crm_api_v1_views
+from api.v1.auth_crm.authentication import AuthCache
 
 
 class ApiV1UsersTest(APITransactionTestCase):
@@ -14,6 +26,13 @@ class ApiV1UsersTest(APITransactionTestCase):
         self.super_user = User.objects.create_superuser(username="super_user", password="TestPassword-20")
         self.not_super_user = User.objects.create_user(username="not_super_user", password="TestPassword-20")
 
+        # The counters are kept in a temporary store, so the real one of the host isn't touched
+        store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_dir)
+        throttle_settings = override_settings(THROTTLE_STORE_PATH=os.path.join(store_dir, 'throttle.sqlite3'))
+        throttle_settings.enable()
+        self.addCleanup(throttle_settings.disable)
+
     def test_can_not_create_a_user_with_an_existing_username(self):
         """ Usernames are unique in DB, so we have to control it in API """
         self._create_a_user(self.super_user, 'duplicated_username')
@@ -40,6 +59,80 @@ class ApiV1UsersTest(APITransactionTestCase):
         # The function check_password checks if a raw password matches with hashed password in DB
         self.assertTrue(new_user.check_password("TestPassword-20"))
 
+    def test_token_authentication_is_cached_and_invalidated(self):
+        """ The token is read from DB only once, and it stops working when it's deleted or its user is removed """
+        token = Token.objects.get(user=self.super_user)
+
+        self._list_users_with_token(token.key, status.HTTP_200_OK)
+        with CaptureQueriesContext(connection) as context:
+            self._list_users_with_token(token.key, status.HTTP_200_OK)
+        self.assertFalse([query for query in context.captured_queries if 'authtoken_token' in query['sql']])
+
+        # Token rotation
+        token.delete()
+        self._list_users_with_token(token.key, status.HTTP_401_UNAUTHORIZED)
+        new_token = Token.objects.create(user=self.super_user)
+        self._list_users_with_token(new_token.key, status.HTTP_200_OK)
+
+        # User deactivation
+        other_super_user = self._create_a_user(self.super_user, 'other_super_user', is_superuser=True)
+        other_token = Token.objects.get(user=other_super_user)
+        self._list_users_with_token(other_token.key, status.HTTP_200_OK)
+        self._delete_a_customer(self.super_user, other_super_user)
+        self._list_users_with_token(other_token.key, status.HTTP_401_UNAUTHORIZED)
+
+    def test_basic_authentication_is_cached_and_invalidated(self):
+        """ The password is verified only once, and the cache is invalidated when the password changes """
+        credentials = base64.b64encode(b'super_user:TestPassword-20').decode('ascii')
+        self._list_users_with_credentials('Basic ' + credentials, status.HTTP_200_OK)
+
+        with mock.patch('django.contrib.auth.backends.ModelBackend.authenticate') as authenticate:
+            self._list_users_with_credentials('Basic ' + credentials, status.HTTP_200_OK)
+        authenticate.assert_not_called()
+
+        wrong_credentials = base64.b64encode(b'super_user:WrongPassword-20').decode('ascii')
+        self._list_users_with_credentials('Basic ' + wrong_credentials, status.HTTP_401_UNAUTHORIZED)
+
+        # New password with the user endpoint
+        request_data = {'first_name': 'Name', 'password': 'NewPassword-21', 'is_superuser': True}
+        request = self.factory.put('/users/{}/'.format(self.super_user.id), request_data, format='json')
+        view = auth_crm_api_v1_views.UserViewSet.as_view({'put': 'update'})
+        force_authenticate(request, user=self.super_user)
+        self.assertEqual(view(request, pk=self.super_user.id).status_code, status.HTTP_200_OK)
+
+        self._list_users_with_credentials('Basic ' + credentials, status.HTTP_401_UNAUTHORIZED)
+        new_credentials = base64.b64encode(b'super_user:NewPassword-21').decode('ascii')
+        self._list_users_with_credentials('Basic ' + new_credentials, status.HTTP_200_OK)
+
+    def test_authentication_cache_returns_a_copy_for_each_request(self):
+        """ The requests don't share the cached user, and the local entries are short lived without shared cache """
+        cache = AuthCache(prefix='test', ttl=300, local_ttl=5)
+        self.assertEqual(cache.entry_ttl, 5)
+
+        user = User.objects.get(id=self.super_user.id)
+        cache.set('key', user, tag=user.pk)
+        user.first_name = 'Changed by the request'
+
+        first_user, second_user = cache.get('key'), cache.get('key')
+        self.assertEqual((first_user.pk, first_user.first_name), (user.pk, ''))
+        self.assertIsNot(first_user, second_user)
+        first_user._perm_cache = {'customers.delete_customer'}
+        self.assertFalse(hasattr(second_user, '_perm_cache'))
+
+        with mock.patch('api.v1.auth_crm.authentication.time.monotonic', return_value=time.monotonic() + 6):
+            self.assertIsNone(cache.get('key'))
+
+    def _list_users_with_token(self, key, expected_status):
+        return self._list_users_with_credentials('Token {}'.format(key), expected_status)
+
+    def _list_users_with_credentials(self, authorization, expected_status):
+        request = self.factory.get('/users/', format='json', HTTP_AUTHORIZATION=authorization)
+        view = auth_crm_api_v1_views.UserViewSet.as_view({'get': 'list'})
+        response = view(request)
+
+        self.assertEqual(response.status_code, expected_status)
+        return response
+
     def _create_a_user(self, action_user, username, password=None, is_superuser=True, check_existing_username=False):
         if not password:
             password = "TestPassword-20"
@@ -1,9 +1,9 @@
 from django.contrib.auth.models import User
 
 from rest_framework import filters, status, viewsets
-from rest_framework.authentication import TokenAuthentication, BasicAuthentication
 from rest_framework.response import Response
 
+from api.v1.auth_crm.authentication import CachedBasicAuthentication, CachedTokenAuthentication
 from api.v1.base import DefaultPagination
 from api.v1.auth_crm.permissions import IsSuperuserPermission
 from api.v1.auth_crm.serializers import UserSerializer, UserEditionSerializer
@@ -26,7 +26,7 @@ class UserViewSet(viewsets.ModelViewSet):
     filter_backends = [filters.SearchFilter]
     search_fields = ['username', 'email', 'first_name', 'last_name']
 
-    authentication_classes = [BasicAuthentication, TokenAuthentication]
+    authentication_classes = [CachedBasicAuthentication, CachedTokenAuthentication]
 
     def get_queryset(self):
         return User.objects.filter(is_active=True)
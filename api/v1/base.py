@@ -1,7 +1,632 @@
+import base64
+import binascii
+import copy
+import hashlib
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils.cache import get_conditional_response
+from django.utils.encoding import force_str
+from django.utils.http import http_date, parse_etags
+
+from rest_framework import serializers, status
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def get_serializer_select_related(serializer_class, prefix=''):
+    """
+    Function to get the relations that a serializer renders with nested serializers, so the queryset can join them
+    with 'select_related' and it won't do a query for each element.
+    :param serializer_class: Serializer class (or instance) used by the view
+    :param prefix: Path to the relation in nested serializers
+    :return: list of relations, e.g. ['created_by', 'updated_by']
+    """
+    serializer = serializer_class() if isinstance(serializer_class, type) else serializer_class
+    model = getattr(getattr(serializer, 'Meta', None), 'model', None)
+    if model is None:
+        return []
+
+    relations = []
+    for field in serializer.fields.values():
+        if not isinstance(field, serializers.BaseSerializer) or isinstance(field, serializers.ListSerializer):
+            continue
+
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            continue
+
+        if model_field.many_to_one or model_field.one_to_one:
+            relation = prefix + field.source
+            relations.append(relation)
+            relations.extend(get_serializer_select_related(field, prefix=relation + '__'))
+
+    return relations
+
+
+def get_serializer_only_fields(serializer_class, prefix=''):
+    """
+    Function to get the model fields that a serializer reads, so the queryset can read only their columns with
+    'only'. The fields of nested serializers are included with the path of their relation.
+    :param serializer_class: Serializer class (or instance) used by the view
+    :param prefix: Path to the relation in nested serializers
+    :return: list of fields, e.g. ['first_name', 'created_by__username'], or None if some field isn't a column (e.g.
+    a property or a method), because then all the columns could be needed
+    """
+    serializer = serializer_class() if isinstance(serializer_class, type) else serializer_class
+    model = getattr(getattr(serializer, 'Meta', None), 'model', None)
+    if model is None:
+        return None
+
+    only_fields = []
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if field.source == '*' or '.' in field.source:
+            return None
+
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            return None
+
+        if isinstance(field, serializers.BaseSerializer):
+            if isinstance(field, serializers.ListSerializer) or not (model_field.many_to_one or model_field.one_to_one):
+                return None
+            nested_fields = get_serializer_only_fields(field, prefix=prefix + field.source + '__')
+            if nested_fields is None:
+                return None
+            only_fields.extend(nested_fields)
+        elif model_field.concrete:
+            only_fields.append(prefix + field.source)
+        else:
+            return None
+
+    return only_fields
+
+
+class SparseFieldsMixin:
+    """
+    Mixin for views to select the fields of the response with the parameters 'fields' or 'exclude' (names separated
+    by commas), e.g. '?fields=id,first_name,phone'. It's applied in the actions of 'sparse_fields_actions'.
+
+    The serializer only has the selected fields, and the queryset only reads their columns ('only') and joins the
+    relations of the selected nested serializers ('select_related'), so the unneeded data isn't fetched.
+    """
+    fields_query_param = 'fields'
+    exclude_query_param = 'exclude'
+    sparse_fields_actions = ('list', 'retrieve')
+
+    def get_sparse_field_names(self, serializer_class):
+        """
+        :param serializer_class: Serializer class (or instance) of the response
+        :return: list of the selected field names, or None if all the fields are returned
+        """
+        if self.action not in self.sparse_fields_actions:
+            return None
+
+        query_params = self.request.query_params
+        if self.fields_query_param not in query_params and self.exclude_query_param not in query_params:
+            return None
+
+        serializer = serializer_class() if isinstance(serializer_class, type) else serializer_class
+        field_names = list(serializer.fields)
+
+        selected = {}
+        for param in (self.fields_query_param, self.exclude_query_param):
+            names = [name.strip() for name in query_params.get(param, '').split(',') if name.strip()]
+            invalid_names = [name for name in names if name not in field_names]
+            if invalid_names:
+                raise ValidationError({param: ['Invalid fields: {}'.format(', '.join(invalid_names))]})
+            selected[param] = names
+
+        if selected[self.fields_query_param]:
+            field_names = [name for name in field_names if name in selected[self.fields_query_param]]
+        return [name for name in field_names if name not in selected[self.exclude_query_param]]
+
+    def prune_serializer(self, serializer):
+        """ It removes the fields that aren't selected from the serializer (or the child of a list serializer) """
+        fields_serializer = serializer.child if isinstance(serializer, serializers.ListSerializer) else serializer
+        field_names = self.get_sparse_field_names(fields_serializer)
+        if field_names is not None:
+            for name in list(fields_serializer.fields):
+                if name not in field_names:
+                    fields_serializer.fields.pop(name)
+        return serializer
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super(SparseFieldsMixin, self).get_serializer(*args, **kwargs)
+        return self.prune_serializer(serializer)
+
+    def select_serializer_fields(self, queryset, serializer_class, required_fields=()):
+        """
+        :param queryset:
+        :param serializer_class: Serializer class of the response
+        :param required_fields: Fields that the view needs besides the serializer (e.g. ordering fields)
+        :return: queryset with the relations of the selected fields and, if there are selected fields, only their
+        columns
+        """
+        serializer = self.prune_serializer(serializer_class())
+        select_related = get_serializer_select_related(serializer)
+        if select_related:
+            queryset = queryset.select_related(*select_related)  # Without arguments, it would join all the relations
+
+        if self.get_sparse_field_names(serializer_class) is not None:
+            only_fields = get_serializer_only_fields(serializer)
+            if only_fields is not None:
+                queryset = queryset.only(*only_fields, *required_fields)
+        return queryset
+
+
+class ValuesSerializer:
+    """
+    Read-only serializer of a list that produces the same data as a serializer class, but from the rows of
+    'queryset.values()' instead of model instances. The converter of each field is prepared once (e.g. 'str' for
+    CharField and 'int' for IntegerField), so each row is serialized without creating model instances, bound fields
+    or OrderedDicts. It's used for list pages, where the serializer is the main cost of the request.
+
+    Only the fields whose value is a column of the model are supported (no nested serializers, related fields, method
+    fields or files), because the rows don't have the related objects.
+    """
+    builtin_converters = (
+        (serializers.CharField, str),
+        (serializers.IntegerField, int),
+    )
+    unsupported_fields = (
+        serializers.BaseSerializer, serializers.RelatedField, serializers.ManyRelatedField,
+        serializers.SerializerMethodField, serializers.FileField, serializers.HiddenField, serializers.ModelField,
+    )
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self.fields = []  # (name, source, converter)
+
+        for name, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, self.unsupported_fields) or field.source == '*' or '.' in field.source:
+                raise ValueError("The field '{}' of {} isn't supported".format(name, serializer_class.__name__))
+            self.fields.append((name, field.source, self._get_converter(field)))
+
+    @property
+    def sources(self):
+        return [source for _, source, _ in self.fields]
+
+    def restrict(self, field_names):
+        """
+        :param field_names: Names of the fields to keep (e.g. from SparseFieldsMixin) or None to keep all of them
+        :return: ValuesSerializer with only those fields
+        """
+        if field_names is None:
+            return self
+        values_serializer = copy.copy(self)
+        values_serializer.fields = [field for field in self.fields if field[0] in field_names]
+        return values_serializer
+
+    def _get_converter(self, field):
+        for field_class, converter in self.builtin_converters:
+            # The builtin is only used if the field has the same 'to_representation' (not overridden)
+            if type(field).to_representation is field_class.to_representation:
+                return converter
+        return field.to_representation
+
+    def to_representation(self, rows):
+        """
+        :param rows: dicts with (at least) the sources of the fields, e.g. queryset.values(*serializer.sources)
+        :return: list of dicts as the 'data' of the serializer class with many=True
+        """
+        fields = self.fields
+        return [
+            {name: None if row[source] is None else converter(row[source]) for name, source, converter in fields}
+            for row in rows
+        ]
+
+
+class ConditionalGetMixin:
+    """
+    Mixin for views to answer conditional GET requests (If-None-Match and If-Modified-Since headers) with a 304
+    response without body. The validators are calculated from values that change when the data changes (e.g. id and
+    updated_at), so the serializer isn't used to know if the data has changed.
+
+    Usage, in an action:
+
+        not_modified = self.check_not_modified(request, etag_values=[obj.pk, obj.updated_at], last_modified=...)
+        if not_modified is not None:
+            return not_modified
+
+    The ETag and Last-Modified headers are added to the response of the action.
+
+    For objects with a version (see BaseModel.save), the ETag starts with the version, and it can be sent back in
+    If-Match to write the object only if it hasn't changed (see check_version_precondition).
+    """
+    conditional_headers = None
+
+    def check_not_modified(self, request, etag_values, last_modified=None, version=None):
+        """
+        :param request:
+        :param etag_values: list of values that identify the version of the response. The format of the response and
+        the query params are added to them
+        :param last_modified: datetime of the last modification or None
+        :param version: version of the object or None
+        :return: Response 304 if the client has the current version, else None
+        """
+        self.conditional_headers = {'ETag': self.get_etag(request, etag_values, version)}
+        last_modified_timestamp = None
+        if last_modified is not None:
+            last_modified_timestamp = int(last_modified.timestamp())
+            self.conditional_headers['Last-Modified'] = http_date(last_modified_timestamp)
+
+        conditional_response = get_conditional_response(
+            request, etag=self.conditional_headers['ETag'], last_modified=last_modified_timestamp)
+        if conditional_response is None:
+            return None
+        return Response(status=conditional_response.status_code)  # 304 (or 412 with If-Match)
+
+    @staticmethod
+    def get_etag(request, etag_values, version=None):
+        """
+        :return: weak ETag of the values, because the representation is equivalent but it could be different byte by
+        byte. With a version, it's a strong ETag that starts with the version (e.g. '"3.d41d8cd9..."'), so it can be
+        used in If-Match
+        """
+        etag_values = [request.accepted_renderer.format, sorted(request.query_params.lists())] + list(etag_values)
+        digest = hashlib.md5(json.dumps(etag_values, cls=DjangoJSONEncoder).encode('utf-8')).hexdigest()
+        if version is None:
+            return 'W/"{}"'.format(digest)
+        return '"{}.{}"'.format(version, digest)
+
+    @staticmethod
+    def get_etag_version(etag):
+        """ :return: version of a strong ETag (e.g. '"3.d41d8cd9..."' -> '3') or None if it's weak """
+        if etag.startswith('W/'):
+            return None
+        return etag.strip('"').partition('.')[0]
+
+    def check_version_precondition(self, request, version):
+        """
+        Conditional writes: with If-Match, the request is only applied if the client has the current version of the
+        object. Only the version of the ETags is compared, so an ETag of any representation of the object is valid.
+        :param request:
+        :param version: current version of the object
+        :return: Response 412 if the client hasn't the current version, else None
+        """
+        if_match = request.META.get('HTTP_IF_MATCH')
+        if if_match is None:
+            return None
+
+        etags = parse_etags(if_match)
+        if '*' in etags or str(version) in [self.get_etag_version(etag) for etag in etags]:
+            return None
+        return self.get_precondition_failed_response()
+
+    @staticmethod
+    def get_precondition_failed_response():
+        return Response(
+            {'detail': 'The object has been modified since you read it. Read it again and retry.'},
+            status=status.HTTP_412_PRECONDITION_FAILED)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(ConditionalGetMixin, self).finalize_response(request, response, *args, **kwargs)
+        if self.conditional_headers and response.status_code in (200, 304):
+            for header, value in self.conditional_headers.items():
+                response[header] = value
+        return response
+
+
+def sort_rows(rows, ordering):
+    """
+    Function to sort model instances in Python as a queryset with an ordering (each field with its direction)
+    :param rows: list of model instances
+    :param ordering: e.g. ('-created_at', '-id')
+    :return: sorted list
+    """
+    rows = list(rows)
+    for field in reversed(ordering):  # The sort is stable, so the first field is sorted last
+        field_name = field.lstrip('-')
+        rows.sort(key=lambda row: getattr(row, 'pk' if field_name == 'pk' else field_name),
+                  reverse=field.startswith('-'))
+    return rows
+
+
+class MergedRows:
+    """
+    Rows of a queryset and extra rows that aren't in the table (e.g. archived rows), sorted together by the ordering
+    of the queryset. It can be paginated by DefaultPagination and KeysetPagination as a queryset.
+
+    The extra rows are read from a source with the same ordering that only reads the rows of the requested page (e.g.
+    customers.log_archive.ArchivedLogs). The source has these methods:
+    - count(): Number of rows.
+    - get_rows(position, reverse, limit): Rows after a keyset position (the values of the ordering fields).
+    - get_slice(start, stop): Rows by offset.
+    - is_older_than(value): True if all the rows are after a row with that value of the first ordering field.
+    """
+
+    def __init__(self, queryset, extra_rows):
+        self.ordering = KeysetPagination.get_ordering(queryset)
+        self.queryset = queryset.order_by(*self.ordering)
+        self.extra_rows = extra_rows
+        self._queryset_count = None
+
+    def count(self):
+        return self.get_queryset_count() + self.extra_rows.count()
+
+    def get_queryset_count(self):
+        if self._queryset_count is None:
+            self._queryset_count = self.queryset.count()
+        return self._queryset_count
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+
+        start, stop = index.start or 0, index.stop
+        if self._extra_rows_are_last():
+            # The rows of the page are read by offset from the queryset and from the extra rows
+            queryset_count = self.get_queryset_count()
+            rows = list(self.queryset[start:stop]) if start < queryset_count else []
+            if stop is None or stop > queryset_count:
+                rows.extend(self.extra_rows.get_slice(
+                    max(start - queryset_count, 0), None if stop is None else stop - queryset_count))
+            return rows
+
+        # The rows are mixed, so the first 'stop' rows of the merge are in the first 'stop' rows of both
+        queryset = self.queryset if stop is None else self.queryset[:stop]
+        extra_rows = self.extra_rows.get_rows(limit=stop)
+        return sort_rows(list(queryset) + extra_rows, self.ordering)[index]
+
+    def _extra_rows_are_last(self):
+        """ :return: True if the extra rows are after the last row of the queryset (e.g. archived rows are older) """
+        field = self.ordering[0]
+        last_value = self.queryset.order_by(KeysetPagination.reverse_field(field)).values_list(
+            field.lstrip('-'), flat=True).first()
+        return last_value is None or self.extra_rows.is_older_than(last_value)
 
 
 class DefaultPagination(PageNumberPagination):
     page_size = 100  # Default number of elements in each page
     page_size_query_param = 'page_size'
     max_page_size = 150  # Max number of elements in each page
+
+
+class KeysetPagination(DefaultPagination):
+    """
+    Pagination that works as DefaultPagination unless the parameter 'cursor' is in the request. In that case, the
+    pages are fetched by keyset: the last key of the page is sent in an opaque cursor, and the next page is filtered
+    with 'WHERE key < cursor' instead of using OFFSET. So, the cost of a page doesn't depend on its depth, and the
+    pages don't shift when new rows are inserted.
+
+    The key is the ordering of the queryset (or the model ordering) plus the primary key as tie breaker,
+    e.g. ('-id', ) for customers and ('-created_at', '-id') for customer logs.
+
+    The total count is returned by default, but it can be skipped with 'count=false'.
+    """
+    cursor_query_param = 'cursor'  # An empty value returns the first page
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.is_keyset = False
+        self.ordering = None
+        self.has_next = False
+        self.has_previous = False
+        self.first_key = None
+        self.last_key = None
+        self.total_count = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            return super(KeysetPagination, self).paginate_queryset(queryset, request, view)
+
+        self.is_keyset = True
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        extra_rows = None
+        if isinstance(queryset, MergedRows):
+            queryset, extra_rows = queryset.queryset, queryset.extra_rows
+
+        self.ordering = self.get_ordering(queryset)
+        position, reverse = self.decode_cursor(request)
+
+        if self.include_count(request):
+            self.total_count = queryset.count() + (extra_rows.count() if extra_rows is not None else 0)
+
+        ordering = [self.reverse_field(field) for field in self.ordering] if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._get_keyset_filter(queryset, position, reverse))
+
+        # We fetch one more element to know if there are more pages in this direction
+        results = list(queryset[:page_size + 1])
+        if extra_rows is not None:
+            if position is not None:
+                position = [
+                    self._to_python(queryset, field.lstrip('-'), value)
+                    for field, value in zip(self.ordering, position)
+                ]
+            # Only the extra rows after the position are read
+            results = sort_rows(
+                results + extra_rows.get_rows(position, reverse=reverse, limit=page_size + 1), ordering
+            )[:page_size + 1]
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+            self.has_previous, self.has_next = has_more, position is not None
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        if results:
+            self.first_key = self._get_key(results[0])
+            self.last_key = self._get_key(results[-1])
+
+        return results
+
+    def get_paginated_response(self, data):
+        if not self.is_keyset:
+            return super(KeysetPagination, self).get_paginated_response(data)
+
+        response_data = OrderedDict()
+        if self.total_count is not None:
+            response_data['count'] = self.total_count
+        response_data['next'] = self.get_next_link()
+        response_data['previous'] = self.get_previous_link()
+        response_data['results'] = data
+        return Response(response_data)
+
+    def get_next_link(self):
+        if not self.is_keyset:
+            return super(KeysetPagination, self).get_next_link()
+        if not self.has_next or self.last_key is None:
+            return None
+        return self._build_link(self.last_key, reverse=False)
+
+    def get_previous_link(self):
+        if not self.is_keyset:
+            return super(KeysetPagination, self).get_previous_link()
+        if not self.has_previous or self.first_key is None:
+            return None
+        return self._build_link(self.first_key, reverse=True)
+
+    def include_count(self, request):
+        return request.query_params.get(self.count_query_param, 'true').lower() not in ('false', '0', 'no')
+
+    def get_page_validators(self):
+        """ :return: values of the last page that aren't in its rows (count and links), e.g. for its ETag """
+        if self.is_keyset:
+            return [self.total_count, self.has_next, self.has_previous]
+        return [self.page.paginator.count, self.page.number, self.page.has_next()]
+
+    @staticmethod
+    def get_ordering(queryset):
+        """
+        The keyset is the ordering of the queryset. The primary key is added at the end, because the key must be
+        unique to avoid skipping or repeating elements between pages.
+        :param queryset:
+        :return: tuple with the ordering fields, e.g. ('-created_at', '-id')
+        """
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        pk_name = queryset.model._meta.pk.name
+        if not any(field.lstrip('-') in ('pk', pk_name) for field in ordering):
+            descending = ordering[-1].startswith('-') if ordering else True
+            ordering.append('-' + pk_name if descending else pk_name)
+        return tuple(ordering)
+
+    def decode_cursor(self, request):
+        """
+        The cursor is an url-safe base64 of a JSON with the key values ('p') and the direction ('r').
+        :param request:
+        :return: tuple (position, reverse). The position is None for the first page
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+
+        try:
+            padding = '=' * (-len(encoded) % 4)
+            data = json.loads(base64.urlsafe_b64decode(encoded + padding).decode('ascii'))
+            position = data['p']
+            reverse = bool(data.get('r', False))
+        except (TypeError, ValueError, KeyError, binascii.Error, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        return position, reverse
+
+    def encode_cursor(self, position, reverse):
+        data = {'p': position}
+        if reverse:
+            data['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode('ascii'))
+        return encoded.decode('ascii').rstrip('=')
+
+    def _build_link(self, position, reverse):
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(position, reverse))
+
+    def _get_key(self, instance):
+        return [self._get_value(instance, field.lstrip('-')) for field in self.ordering]
+
+    @staticmethod
+    def _get_value(instance, field_name):
+        if isinstance(instance, dict):
+            value = instance[field_name]  # Row of 'queryset.values()' with the ordering fields
+        else:
+            value = getattr(instance, 'pk' if field_name == 'pk' else field_name)
+        return value.isoformat() if hasattr(value, 'isoformat') else value
+
+    @staticmethod
+    def reverse_field(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    def _get_keyset_filter(self, queryset, position, reverse):
+        """
+        Build the condition '(a, b) < (x, y)' as 'a < x OR (a = x AND b < y)' taking into account the direction
+        of each field, so the database can use the index on the ordering fields.
+        """
+        condition = Q()
+        equal_condition = Q()
+        for field, value in zip(self.ordering, position):
+            field_name = field.lstrip('-')
+            value = self._to_python(queryset, field_name, value)
+            descending = field.startswith('-') != reverse
+            lookup = '{}__{}'.format(field_name, 'lt' if descending else 'gt')
+            condition |= equal_condition & Q(**{lookup: value})
+            equal_condition &= Q(**{field_name: value})
+        return condition
+
+    def _to_python(self, queryset, field_name, value):
+        if field_name in queryset.query.annotations:
+            # Annotations (e.g. search rank) are numbers, so they are the same in JSON
+            return value
+
+        model = queryset.model
+        try:
+            field = model._meta.pk if field_name == 'pk' else model._meta.get_field(field_name)
+            return field.to_python(value)
+        except (FieldDoesNotExist, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_schema_fields(self, view):
+        fields = super(KeysetPagination, self).get_schema_fields(view)
+        try:
+            import coreapi
+            import coreschema
+        except ImportError:
+            return fields
+        return fields + [
+            coreapi.Field(
+                name=self.cursor_query_param,
+                required=False,
+                location='query',
+                schema=coreschema.String(
+                    title='Cursor',
+                    description=force_str('The pagination cursor value. Send it empty to get the first page.')
+                )
+            ),
+            coreapi.Field(
+                name=self.count_query_param,
+                required=False,
+                location='query',
+                schema=coreschema.Boolean(
+                    title='Count',
+                    description=force_str("Set it to 'false' to skip the total count in cursor mode.")
+                )
+            ),
+        ]
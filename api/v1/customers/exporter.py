@@ -0,0 +1,243 @@
+import csv
+import json
+from itertools import groupby
+from operator import attrgetter, itemgetter
+
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+
+from rest_framework import serializers
+
+from customers.log_archive import CustomerLogArchive
+from customers.models import CustomerLog, CustomerLogArchiveBlock
+from customers.thumbnails import get_thumbnail_urls
+
+EXPORT_FORMAT_CSV = 'csv'
+EXPORT_FORMAT_NDJSON = 'ndjson'
+EXPORT_FORMATS = (EXPORT_FORMAT_CSV, EXPORT_FORMAT_NDJSON)
+
+EXPORT_CONTENT_TYPES = {
+    EXPORT_FORMAT_CSV: 'text/csv',
+    EXPORT_FORMAT_NDJSON: 'application/x-ndjson',
+}
+
+
+class _LineBuffer:
+    """ File-like object for csv.writer that returns the written line instead of storing it """
+
+    @staticmethod
+    def write(value):
+        return value
+
+
+class BaseExporter:
+    """
+    Base class to export a queryset as CSV or NDJSON (a JSON object per line). The rows are read with a chunked
+    iterator of 'values_list' (no model instances), and they are returned as a generator of lines, so it can be used
+    in a StreamingHttpResponse and the memory doesn't depend on the number of rows.
+
+    'export_fields' maps each field of the export with its path in the queryset. The fields have the names of the
+    fields of the API (see api.v1.customers.serializers), so the same 'fields' can be used in the API and the export.
+    """
+    export_fields = {}
+    default_fields = ()
+    chunk_size = 2000
+
+    datetime_field = serializers.DateTimeField()
+
+    def __init__(self, file_format, fields=None, include_deleted=False):
+        """
+        :param file_format: 'csv' or 'ndjson'
+        :param fields: Names of the exported fields (default_fields by default)
+        :param include_deleted: If it's True, the queryset has the deleted customers (see CustomerExporter)
+        """
+        if file_format not in EXPORT_FORMATS:
+            raise ValueError('Invalid format: {}'.format(file_format))
+
+        fields = list(fields or self.default_fields)
+        invalid_fields = [field for field in fields if field not in self.export_fields]
+        if invalid_fields:
+            raise ValueError('Invalid fields: {}'.format(', '.join(invalid_fields)))
+
+        self.file_format = file_format
+        self.fields = fields
+        self.include_deleted = include_deleted
+
+    @property
+    def content_type(self):
+        return EXPORT_CONTENT_TYPES[self.file_format]
+
+    def get_queryset(self, queryset):
+        return queryset
+
+    def format_value(self, field_name, value):
+        if hasattr(value, 'isoformat'):
+            return self.datetime_field.to_representation(value)
+        return value
+
+    def get_rows(self, queryset):
+        """ :return: iterator of tuples with the values of the fields of the export """
+        paths = [self.export_fields[field] for field in self.fields]
+        return self.get_queryset(queryset).values_list(*paths).iterator(chunk_size=self.chunk_size)
+
+    def get_row_data(self, row):
+        """ :return: dict with the formatted values of the fields of a row """
+        return {field: self.format_value(field, value) for field, value in zip(self.fields, row)}
+
+    def get_columns(self):
+        return self.fields
+
+    def export(self, queryset):
+        rows = self.get_rows(queryset)
+
+        if self.file_format == EXPORT_FORMAT_CSV:
+            columns = self.get_columns()
+            writer = csv.writer(_LineBuffer())
+            yield writer.writerow(columns)
+            for row in rows:
+                data = self.get_row_data(row)
+                yield writer.writerow([self._to_csv_value(data.get(column)) for column in columns])
+        else:
+            for row in rows:
+                yield json.dumps(self.get_row_data(row), cls=DjangoJSONEncoder) + '\n'
+
+    @staticmethod
+    def _to_csv_value(value):
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, cls=DjangoJSONEncoder)
+        return '' if value is None else value
+
+
+class CustomerExporter(BaseExporter):
+    """
+    It exports the fields of FullCustomerSerializer (the users are their usernames). With 'include_deleted', the deleted
+    customers are tombstones with 'id' and 'is_deleted', and all the rows have 'id' and 'is_deleted', as in the list.
+    """
+    export_fields = {
+        'id': 'id',
+        'first_name': 'first_name',
+        'last_name': 'last_name',
+        'phone': 'phone',
+        'email': 'email',
+        'photo': 'photo',
+        'thumbnails': 'photo',
+        'country': 'country',
+        'postal_code': 'postal_code',
+        'region': 'region',
+        'locality': 'locality',
+        'address': 'address',
+        'created_by': 'created_by__username',
+        'updated_by': 'updated_by__username',
+        'created_at': 'created_at',
+        'updated_at': 'updated_at',
+    }
+    default_fields = ('id', 'first_name', 'last_name', 'phone', 'email', 'thumbnails')  # Same fields as the list
+    deleted_field = 'is_deleted'
+
+    def get_rows(self, queryset):
+        if not self.include_deleted:
+            return super(CustomerExporter, self).get_rows(queryset)
+
+        # Each row ends with the id and whether the customer is deleted
+        paths = [self.export_fields[field] for field in self.fields]
+        return self.get_queryset(queryset).values_list(*paths, 'id', self.deleted_field).iterator(
+            chunk_size=self.chunk_size)
+
+    def get_row_data(self, row):
+        if not self.include_deleted:
+            return super(CustomerExporter, self).get_row_data(row)
+
+        # The id is always exported, so the tombstones can be matched with the customers
+        *row, customer_id, is_deleted = row
+        if is_deleted:
+            return {'id': customer_id, self.deleted_field: True}
+        data = {'id': customer_id}
+        data.update(super(CustomerExporter, self).get_row_data(row))
+        data[self.deleted_field] = False
+        return data
+
+    def get_columns(self):
+        columns = super(CustomerExporter, self).get_columns()
+        if self.include_deleted:
+            columns = list(dict.fromkeys(['id'] + columns + [self.deleted_field]))
+        return columns
+
+    def format_value(self, field_name, value):
+        if field_name == 'photo':
+            return default_storage.url(value) if value else None
+        if field_name == 'thumbnails':
+            return get_thumbnail_urls(value)
+        return super(CustomerExporter, self).format_value(field_name, value)
+
+
+class CustomerLogExporter(BaseExporter):
+    """
+    It exports the logs of the customers of the queryset, by customer and from the newest, including the archived logs
+    (see CustomerLogArchive). The table and the archive blocks are read in order of customer at the same time, so
+    only the logs of one customer are kept in memory to merge them.
+    """
+    export_fields = {
+        'id': 'id',
+        'customer': 'customer_id',
+        'created_at': 'created_at',
+        'log_type': 'log_type',
+        'user': 'user__username',
+        'fields_changed': 'fields_changed',
+    }
+    default_fields = ('id', 'customer', 'created_at', 'log_type', 'user', 'fields_changed')
+
+    def get_queryset(self, queryset):
+        return CustomerLog.objects.filter(
+            customer__in=queryset.values('id')).order_by('customer_id', '-created_at', '-id')
+
+    def get_rows(self, queryset):
+        paths = [self.export_fields[field] for field in self.fields]
+        # Each row starts with the customer and the sort key of its logs
+        rows = self.get_queryset(queryset).values_list(
+            'customer_id', 'created_at', 'id', *paths).iterator(chunk_size=self.chunk_size)
+        blocks = CustomerLogArchiveBlock.objects.filter(
+            customer__in=queryset.values('id')).order_by('customer_id', 'id').iterator(chunk_size=self.chunk_size)
+        archive = CustomerLogArchive.from_settings()
+
+        for customer_rows, customer_blocks in _merge_groups(
+                groupby(rows, key=itemgetter(0)), groupby(blocks, key=attrgetter('customer_id'))):
+            if customer_blocks:
+                customer_rows.extend(
+                    (log.customer_id, log.created_at, log.id, *[self._get_log_value(log, path) for path in paths])
+                    for log in archive.read_logs(customer_blocks)
+                )
+                customer_rows.sort(key=itemgetter(1, 2), reverse=True)
+            for row in customer_rows:
+                yield row[3:]
+
+    @staticmethod
+    def _get_log_value(log, path):
+        """ :return: Value of a path of export_fields in an archived log """
+        if path == 'user__username':
+            return log.user.username if log.user is not None else None
+        return getattr(log, path)
+
+
+def _merge_groups(first_groups, second_groups):
+    """
+    Function to merge two iterators of groups (as 'groupby') sorted by their key
+    :return: iterator of tuples (list of items of the first iterator, list of items of the second iterator) by key
+    """
+    first = _next_group(first_groups)
+    second = _next_group(second_groups)
+    while first is not None or second is not None:
+        if second is None or (first is not None and first[0] < second[0]):
+            yield first[1], []
+            first = _next_group(first_groups)
+        elif first is None or second[0] < first[0]:
+            yield [], second[1]
+            second = _next_group(second_groups)
+        else:
+            yield first[1], second[1]
+            first = _next_group(first_groups)
+            second = _next_group(second_groups)
+
+
+def _next_group(groups):
+    group = next(groups, None)
+    return None if group is None else (group[0], list(group[1]))
@@ -0,0 +1,79 @@
+from django_filters import rest_framework as django_filters
+from rest_framework import filters
+from rest_framework.exceptions import ValidationError
+
+from customers.models import Customer, CustomerLogField, normalize_email, normalize_phone
+from customers.search import get_search_backend
+
+
+class CustomerFilter(django_filters.FilterSet):
+    """
+    Exact filters by phone and email. The values are normalized like in the customer, so the filter is a lookup in
+    the normalized (and indexed) fields, e.g. '?phone=+34 600 123 456' matches the phone '0034600123456'.
+    """
+    phone = django_filters.CharFilter(method='filter_phone')
+    email = django_filters.CharFilter(method='filter_email')
+
+    # Delta filters: the customers created or updated since a date (ISO 8601), ordered by that date and id, so the
+    # pages are stable and a customer updated while a client reads the pages is moved to the end. If both are sent,
+    # the order is the order of 'updated_since' (it's applied after 'created_since')
+    created_since = django_filters.IsoDateTimeFilter(method='filter_created_since')
+    updated_since = django_filters.IsoDateTimeFilter(method='filter_updated_since')
+
+    class Meta:
+        model = Customer
+        fields = ['phone', 'email', 'created_since', 'updated_since']
+
+    @staticmethod
+    def filter_phone(queryset, name, value):
+        return queryset.filter(phone_normalized=normalize_phone(value))
+
+    @staticmethod
+    def filter_email(queryset, name, value):
+        return queryset.filter(email_normalized=normalize_email(value))
+
+    @staticmethod
+    def filter_created_since(queryset, name, value):
+        return queryset.filter(created_at__gte=value).order_by('created_at', 'id')
+
+    @staticmethod
+    def filter_updated_since(queryset, name, value):
+        return queryset.filter(updated_at__gte=value).order_by('updated_at', 'id')
+
+
+class CustomerLogFieldFilter(django_filters.FilterSet):
+    """
+    Filters of the changed fields of the logs of all the customers: field name ('field'), user id ('user') and date
+    ('since' and 'until', ISO 8601), e.g. '?field=email&since=2020-01-01T00:00:00Z'. The filters by field and user are
+    answered with the indexes of CustomerLogField, so one of them is required.
+    """
+    field = django_filters.CharFilter(field_name='name')
+    user = django_filters.NumberFilter(field_name='user_id')
+    since = django_filters.IsoDateTimeFilter(field_name='created_at', lookup_expr='gte')
+    until = django_filters.IsoDateTimeFilter(field_name='created_at', lookup_expr='lt')
+
+    class Meta:
+        model = CustomerLogField
+        fields = ['field', 'user', 'since', 'until']
+
+
+class CustomerSearchFilter(filters.SearchFilter):
+    """
+    Search filter that uses the customer search backend (full text index) instead of 'icontains' in each field.
+    If the parameter 'rank' is 'true', the results are ordered by relevance. It can't be used with the delta filters
+    (see CustomerFilter), because a sync client resumes the pages by their order of date.
+    """
+    rank_param = 'rank'
+    ordered_filter_params = ('created_since', 'updated_since')
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if not search_terms:
+            return queryset
+
+        ranked = request.query_params.get(self.rank_param, '').lower() == 'true'
+        if ranked and any(request.query_params.get(param) for param in self.ordered_filter_params):
+            raise ValidationError({self.rank_param: [
+                'The results of {} are ordered by date, so they can\'t be ranked.'.format(
+                    ' or '.join(self.ordered_filter_params))]})
+        return get_search_backend().search(queryset, search_terms, ranked=ranked)
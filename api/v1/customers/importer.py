@@ -0,0 +1,120 @@
+import codecs
+import csv
+import json
+
+from django.db import transaction
+
+from api.v1.customers.serializers import FullCustomerSerializer
+from customers import choices as customer_choices
+from customers.log_manager import CustomerLogManager
+from customers.models import Customer, CustomerLog
+from customers.search import get_search_backend
+
+IMPORT_FORMAT_CSV = 'csv'
+IMPORT_FORMAT_JSONL = 'jsonl'
+IMPORT_FORMATS = (IMPORT_FORMAT_CSV, IMPORT_FORMAT_JSONL)
+
+
+class CustomerImporter:
+    """
+    Class to import customers from a CSV or JSONL (a JSON object per line) file.
+
+    The file is read line by line and the rows are validated with FullCustomerSerializer in chunks of 'chunk_size'.
+    The valid customers of each chunk and their creation logs are inserted with 'bulk_create' in one transaction.
+    So, the memory doesn't depend on the file size. The invalid rows are reported with their row number and errors
+    (up to 'max_errors').
+    """
+    chunk_size = 1000
+    max_errors = 1000
+    excluded_fields = ('photo', )  # Files can't be imported
+
+    def __init__(self, user, file_format, chunk_size=None):
+        if file_format not in IMPORT_FORMATS:
+            raise ValueError('Invalid format: {}'.format(file_format))
+
+        self.user = user
+        self.file_format = file_format
+        self.chunk_size = chunk_size or self.chunk_size
+
+        self.created = 0
+        self.error_count = 0
+        self.errors = []
+
+    def run(self, stream):
+        """
+        :param stream: iterable of lines in bytes (e.g. an uploaded file or a file opened in binary mode)
+        :return: dict with the number of created customers and the errors
+        """
+        lines = codecs.iterdecode(stream, 'utf-8-sig')
+        rows = self._read_csv(lines) if self.file_format == IMPORT_FORMAT_CSV else self._read_jsonl(lines)
+
+        chunk = []
+        for row_number, data in rows:
+            chunk.append((row_number, data))
+            if len(chunk) >= self.chunk_size:
+                self._import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self._import_chunk(chunk)
+
+        return {'created': self.created, 'error_count': self.error_count, 'errors': self.errors}
+
+    @staticmethod
+    def _read_csv(lines):
+        reader = csv.DictReader(lines)
+        for row in reader:
+            # Empty values are the same as not sending the field
+            yield reader.line_num, {key: value for key, value in row.items() if key and value not in ('', None)}
+
+    @staticmethod
+    def _read_jsonl(lines):
+        for line_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError:
+                data = None
+            yield line_number, data
+
+    def _import_chunk(self, chunk):
+        customers = []
+        logs_data = []
+        for row_number, data in chunk:
+            if not isinstance(data, dict):
+                self._add_error(row_number, {'non_field_errors': ['Invalid row']})
+                continue
+
+            for field_name in self.excluded_fields:
+                data.pop(field_name, None)
+
+            serializer = FullCustomerSerializer(data=data)
+            if not serializer.is_valid():
+                self._add_error(row_number, serializer.errors)
+                continue
+
+            customer = Customer(created_by=self.user, updated_by=self.user, **serializer.validated_data)
+            customer.set_normalized_fields()
+            customers.append(customer)
+            logs_data.append(Customer.get_changed_fields(new_data=serializer.validated_data))
+
+        if not customers:
+            return
+
+        with transaction.atomic():
+            customers = Customer.objects.bulk_create_with_pks(customers)
+            CustomerLogManager.save_logs([
+                CustomerLog(
+                    user=self.user, customer=customer, log_type=customer_choices.LOG_CREATION_TYPE,
+                    fields_changed=fields_changed
+                )
+                for customer, fields_changed in zip(customers, logs_data)
+            ])
+            get_search_backend().update_many(customers)
+
+        self.created += len(customers)
+
+    def _add_error(self, row_number, errors):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'row': row_number, 'errors': errors})
@@ -2,7 +2,23 @@ from rest_framework import serializers
 
 from django.contrib.auth.models import User
 
-from customers.models import Customer, CustomerLog
+from customers.models import Customer, CustomerLog, CustomerLogField
+from customers.thumbnails import get_thumbnail_urls
+
+
+class PhotoThumbnailsField(serializers.Field):
+    """
+    Read only field with the urls of the photo renditions (see customers.thumbnails), e.g. {'small': '/media/...'}.
+    The value can be the photo of an instance or its name (from 'values()'), so it's supported by ValuesSerializer.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = 'photo'
+        kwargs['read_only'] = True
+        super(PhotoThumbnailsField, self).__init__(**kwargs)
+
+    def to_representation(self, value):
+        return get_thumbnail_urls(getattr(value, 'name', value))
 
 
 class CustomerUserSerializer(serializers.ModelSerializer):
@@ -15,11 +31,12 @@ class CustomerUserSerializer(serializers.ModelSerializer):
 class CustomerSerializer(serializers.ModelSerializer):
 
     id = serializers.IntegerField(read_only=True)  # This field is autoincremental and its value isn't mutable.
+    thumbnails = PhotoThumbnailsField()
 
     class Meta:
         model = Customer
         fields = [
-            'id', 'first_name', 'last_name', 'phone', 'email'
+            'id', 'first_name', 'last_name', 'phone', 'email', 'thumbnails'
         ]
 
 
@@ -31,7 +48,7 @@ class FullCustomerSerializer(CustomerSerializer):
     class Meta:
         model = Customer
         fields = [
-            'id', 'first_name', 'last_name', 'phone', 'email', 'photo',
+            'id', 'first_name', 'last_name', 'phone', 'email', 'photo', 'thumbnails',
             'country', 'postal_code', 'region', 'locality', 'address',
             'created_by', 'updated_by', 'created_at', 'updated_at'
         ]
@@ -44,3 +61,12 @@ class CustomerLogSerializer(serializers.ModelSerializer):
     class Meta:
         model = CustomerLog
         fields = ['id', 'created_at', 'log_type', 'user', 'fields_changed']
+
+
+class CustomerLogFieldSerializer(serializers.ModelSerializer):
+
+    user = CustomerUserSerializer()
+
+    class Meta:
+        model = CustomerLogField
+        fields = ['id', 'log', 'customer', 'created_at', 'user', 'name', 'old_value', 'new_value']
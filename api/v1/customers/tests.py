@@ -1,11 +1,43 @@
+import datetime
+import hashlib
+import importlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+from urllib.parse import urlencode
+
+from django.apps import apps
 from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, NotSupportedError, connection, transaction
+from django.db.models import F
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from PIL import Image
 
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIRequestFactory, APITransactionTestCase, force_authenticate
 
+from api.v1 import throttles
 from api.v1.customers import views as customer_api_v1_views
-from customers import choices as customer_choices
-from customers.models import Customer
+from api.v1.customers.exporter import CustomerExporter, CustomerLogExporter
+from api.v1.customers.serializers import CustomerLogSerializer, CustomerSerializer, FullCustomerSerializer
+from customers import bulk_operations, choices as customer_choices
+from customers.change_feed import CustomerChangeFeed
+from customers.log_archive import ARCHIVED_FIELDS, CustomerLogArchive
+from customers.log_manager import CustomerLogManager
+from customers.log_writer import CustomerLogWriter
+from customers.models import Customer, CustomerLog, CustomerLogArchiveBlock, CustomerLogField
+from customers.thumbnails import generate_thumbnails, get_thumbnail_name, get_thumbnail_pool
 
 
 class ApiV1CustomersTest(APITransactionTestCase):
@@ -16,6 +48,13 @@ class ApiV1CustomersTest(APITransactionTestCase):
         self.first_user = User.objects.create_user(username="first_user", password="TestPassword-20")
         self.second_user = User.objects.create_user(username="second_user", password="TestPassword-20")
 
+        # The counters are kept in a temporary store, so the real one of the host isn't touched
+        store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_dir)
+        throttle_settings = override_settings(THROTTLE_STORE_PATH=os.path.join(store_dir, 'throttle.sqlite3'))
+        throttle_settings.enable()
+        self.addCleanup(throttle_settings.disable)
+
     def test_created_and_updated_by_in_customer_creation(self):
         """ When a customer is created by an user, this is the value in created_by and updated_by """
         new_customer = self._create_a_customer(self.first_user)
@@ -56,13 +95,1098 @@ class ApiV1CustomersTest(APITransactionTestCase):
 
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
-    def _create_a_customer(self, user):
+    def test_cursor_pagination_is_stable_with_new_customers(self):
+        """ With 'cursor' parameter the pages are fetched by keyset, so new customers don't shift the next pages """
+        customers = [self._create_a_customer(self.first_user) for _ in range(5)]
+
+        response = self._list_customers(self.first_user, {'cursor': '', 'page_size': 2})
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual([item['id'] for item in response.data['results']], [customers[4].id, customers[3].id])
+        self.assertIsNone(response.data['previous'])
+
+        # A customer created between two requests doesn't appear in the next page
+        self._create_a_customer(self.first_user)
+        next_cursor = response.data['next'].split('cursor=')[1].split('&')[0]
+        response = self._list_customers(self.first_user, {'cursor': next_cursor, 'page_size': 2, 'count': 'false'})
+        self.assertNotIn('count', response.data)
+        self.assertEqual([item['id'] for item in response.data['results']], [customers[2].id, customers[1].id])
+
+        previous_cursor = response.data['previous'].split('cursor=')[1].split('&')[0]
+        response = self._list_customers(self.first_user, {'cursor': previous_cursor, 'page_size': 2})
+        self.assertEqual([item['id'] for item in response.data['results']], [customers[4].id, customers[3].id])
+
+    def test_query_budget_of_read_endpoints(self):
+        """ The number of queries of list, retrieve and logs endpoints can't exceed the declared budget """
+        for index in range(10):
+            customer = self._create_a_customer(self.first_user if index % 2 else self.second_user)
+            self._update_a_customer(self.second_user if index % 2 else self.first_user, customer)
+
+        budget = customer_api_v1_views.CustomerViewSet.query_budget
+        requests = [
+            ('list', '/customers/', {}),
+            ('list', '/customers/', {'cursor': ''}),
+            ('retrieve', '/customers/{}/'.format(customer.id), {'pk': customer.id}),
+            ('customer_logs', '/customers/{}/logs/'.format(customer.id), {'pk': customer.id}),
+            ('changes', '/customers/changes/', {}),
+        ]
+        for action, url, kwargs in requests:
+            request = self.factory.get(url, format='json')
+            view = customer_api_v1_views.CustomerViewSet.as_view({'get': action})
+            force_authenticate(request, user=self.first_user)
+
+            with CaptureQueriesContext(connection) as context:
+                response = view(request, **kwargs)
+                response.render()
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(
+                len(context.captured_queries), budget[action],
+                msg="Query budget exceeded in '{}': {}".format(
+                    action, [query['sql'] for query in context.captured_queries]))
+
+    def test_conditional_get_of_read_endpoints(self):
+        """ If the data hasn't changed since the version of the client, the response is 304 without body """
+        customer = self._create_a_customer(self.first_user)
+
+        requests = [
+            ('list', '/customers/', {}),
+            ('retrieve', '/customers/{}/'.format(customer.id), {'pk': customer.id}),
+            ('customer_logs', '/customers/{}/logs/'.format(customer.id), {'pk': customer.id}),
+        ]
+        etags = {}
+        for action, url, kwargs in requests:
+            response = self._conditional_get(action, url, kwargs)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            etags[action] = response['ETag']
+
+            with CaptureQueriesContext(connection) as context:
+                response = self._conditional_get(action, url, kwargs, HTTP_IF_NONE_MATCH=etags[action])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response.content, b'')
+            self.assertEqual(response['ETag'], etags[action])
+            self.assertLessEqual(len(context.captured_queries), 3)  # Customer, archived blocks (logs) and validators
+
+        response = self._conditional_get(
+            'retrieve', '/customers/{}/'.format(customer.id), {'pk': customer.id},
+            HTTP_IF_MODIFIED_SINCE=self._conditional_get(
+                'retrieve', '/customers/{}/'.format(customer.id), {'pk': customer.id})['Last-Modified']
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # After an update, all the validators change
+        self._update_a_customer(self.second_user, customer)
+        for action, url, kwargs in requests:
+            response = self._conditional_get(action, url, kwargs, HTTP_IF_NONE_MATCH=etags[action])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response['ETag'], etags[action])
+
+        # The ETag of the list depends on the filters
+        response = self._conditional_get('list', '/customers/?search=other', {}, HTTP_IF_NONE_MATCH=etags['list'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # The ETag of a keyset page without count only reads the page, without counting the filtered customers
+        url = '/customers/?cursor=&count=false'
+        etag = self._conditional_get('list', url, {})['ETag']
+        with CaptureQueriesContext(connection) as context:
+            response = self._conditional_get('list', url, {}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertNotIn('COUNT(', context.captured_queries[0]['sql'])
+        self.assertNotIn('MAX(', context.captured_queries[0]['sql'])
+
+        # A new customer in the page changes it
+        self._create_a_customer(self.first_user)
+        self.assertNotEqual(self._conditional_get('list', url, {})['ETag'], etag)
+
+    def test_fast_list_serialization_is_identical_to_serializer(self):
+        """ The list serialized from 'values()' rows has the same bytes as the list serialized with the serializer """
+        self._create_a_customer(self.first_user, first_name='José Ñandú', email='jose@example.com')
+        for index in range(5):
+            self._create_a_customer(self.second_user, first_name='Name {}'.format(index), last_name='"Quoted" \\')
+
+        values_serializer = customer_api_v1_views.CustomerViewSet.list_values_serializer
+        queryset = Customer.objects_not_deleted.all()
+        self.assertEqual(
+            JSONRenderer().render(values_serializer.to_representation(queryset.values(*values_serializer.sources))),
+            JSONRenderer().render(CustomerSerializer(queryset, many=True).data)
+        )
+
+        requests_params = [
+            {}, {'page_size': 2, 'page': 2}, {'cursor': '', 'page_size': 4}, {'search': 'name', 'rank': 'true'}]
+        for params in requests_params:
+            request = self.factory.get('/customers/', params)
+            view = customer_api_v1_views.CustomerViewSet.as_view({'get': 'list'})
+            force_authenticate(request, user=self.first_user)
+            fast_content = view(request).render().content
+
+            with mock.patch.object(customer_api_v1_views.CustomerViewSet, 'list_values_serializer', None):
+                request = self.factory.get('/customers/', params)
+                force_authenticate(request, user=self.first_user)
+                content = view(request).render().content
+
+            self.assertEqual(fast_content, content)
+
+    def test_sparse_fieldsets_narrow_response_and_query(self):
+        """ With 'fields' or 'exclude', the response only has the selected fields and only their columns are read """
+        customer = self._create_a_customer(self.first_user)
+
+        requests = [
+            ('list', '/customers/', {}, {'fields': 'id,phone'}, ['id', 'phone']),
+            ('list', '/customers/', {}, {'exclude': 'email,last_name,thumbnails', 'cursor': ''},
+             ['id', 'first_name', 'phone']),
+            ('retrieve', '/customers/{}/'.format(customer.id), {'pk': customer.id}, {'fields': 'id,first_name,phone'},
+             ['id', 'first_name', 'phone']),
+            ('retrieve', '/customers/{}/'.format(customer.id), {'pk': customer.id},
+             {'fields': 'id,created_by', 'exclude': 'id'}, ['created_by']),
+            ('customer_logs', '/customers/{}/logs/'.format(customer.id), {'pk': customer.id},
+             {'fields': 'log_type,fields_changed'}, ['log_type', 'fields_changed']),
+        ]
+        for action, url, kwargs, params, expected_fields in requests:
+            request = self.factory.get(url, params)
+            view = customer_api_v1_views.CustomerViewSet.as_view({'get': action})
+            force_authenticate(request, user=self.first_user)
+            with CaptureQueriesContext(connection) as context:
+                response = view(request, **kwargs).render()
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            data = response.data['results'][0] if 'results' in response.data else response.data
+            self.assertEqual(list(data), expected_fields)
+
+            query = context.captured_queries[-1]['sql']
+            if 'created_by' not in expected_fields:
+                self.assertNotIn('JOIN', query)
+            self.assertNotIn('"address"', query)
+
+        request = self.factory.get('/customers/', {'fields': 'id,unknown'})
+        view = customer_api_v1_views.CustomerViewSet.as_view({'get': 'list'})
+        force_authenticate(request, user=self.first_user)
+        response = view(request)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('fields', response.data)
+
+    def test_photo_thumbnails_are_generated_in_background(self):
+        """ The renditions of an uploaded photo are generated by the pool, and they can be generated by command """
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+
+        photo = io.BytesIO()
+        Image.new('RGBA', (1000, 500), (255, 0, 0, 128)).save(photo, format='PNG')
+        sizes = {'small': (80, 80), 'medium': (400, 400)}
+
+        with self.settings(MEDIA_ROOT=media_root, CUSTOMER_PHOTO_THUMBNAIL_SIZES=sizes):
+            request = self.factory.post('/customers/', {
+                'first_name': 'Name', 'last_name': 'Surname', 'email': 'mail@nomail.com', 'phone': '600 123 456',
+                'photo': SimpleUploadedFile('photo.png', photo.getvalue(), content_type='image/png'),
+            }, format='multipart')
+            view = customer_api_v1_views.CustomerViewSet.as_view({'post': 'create'})
+            force_authenticate(request, user=self.first_user)
+            response = view(request)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+            get_thumbnail_pool().join()
+
+            customer = Customer.objects.get(id=response.data['id'])
+            response = self._conditional_get('retrieve', '/customers/{}/'.format(customer.id), {'pk': customer.id})
+            self.assertEqual(set(response.data['thumbnails']), {'small', 'medium'})
+            for size_name, expected_size in [('small', (80, 40)), ('medium', (400, 200))]:
+                thumbnail_path = os.path.join(media_root, get_thumbnail_name(customer.photo.name, size_name))
+                with Image.open(thumbnail_path) as thumbnail:
+                    self.assertEqual((thumbnail.format, thumbnail.size), ('JPEG', expected_size))
+                self.assertTrue(response.data['thumbnails'][size_name].endswith(
+                    get_thumbnail_name(customer.photo.name, size_name)))
+
+                os.remove(thumbnail_path)
+
+            # The urls don't depend on the generated renditions, so the ETag of the customer is still valid
+            with mock.patch('customers.thumbnails.default_storage.exists') as exists:
+                second_response = self._conditional_get(
+                    'retrieve', '/customers/{}/'.format(customer.id), {'pk': customer.id})
+            exists.assert_not_called()
+            self.assertEqual(second_response.data['thumbnails'], response.data['thumbnails'])
+            self.assertEqual(second_response['ETag'], response['ETag'])
+
+            call_command('generate_customer_thumbnails', workers=2, stdout=io.StringIO())
+            self.assertTrue(os.path.exists(
+                os.path.join(media_root, get_thumbnail_name(customer.photo.name, 'small'))))
+
+            # The existing renditions are replaced, without temporary files left
+            self.assertEqual(
+                generate_thumbnails(customer.photo.name),
+                [get_thumbnail_name(customer.photo.name, size_name) for size_name in sizes])
+            photo_names = os.listdir(os.path.join(media_root, os.path.dirname(customer.photo.name)))
+            self.assertEqual(len(photo_names), 3)
+
+    def test_same_photo_is_stored_once(self):
+        """ The photos are stored by their hash, so the same photo is stored once and it isn't a change in the logs """
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+
+        photo = io.BytesIO()
+        Image.new('RGB', (300, 200), (0, 128, 255)).save(photo, format='JPEG')
+
+        def upload_photo(method, url, view_action, **kwargs):
+            request = getattr(self.factory, method)(url, {
+                'first_name': 'Name', 'last_name': 'Surname', 'email': 'mail@nomail.com', 'phone': '600 123 456',
+                'photo': SimpleUploadedFile('Photo.JPG', photo.getvalue(), content_type='image/jpeg'),
+            }, format='multipart')
+            view = customer_api_v1_views.CustomerViewSet.as_view({method: view_action})
+            force_authenticate(request, user=self.first_user)
+            response = view(request, **kwargs)
+            self.assertIn(response.status_code, (status.HTTP_200_OK, status.HTTP_201_CREATED))
+            return Customer.objects.get(id=response.data['id'])
+
+        with self.settings(MEDIA_ROOT=media_root, CUSTOMER_PHOTO_THUMBNAIL_WORKERS=0):
+            customer = upload_photo('post', '/customers/', 'create')
+
+            # Big files are spooled to a temporary file
+            with self.settings(FILE_UPLOAD_MAX_MEMORY_SIZE=0):
+                other_customer = upload_photo('post', '/customers/', 'create')
+                customer = upload_photo('put', '/customers/{}/'.format(customer.id), 'update', pk=customer.id)
+
+            expected_name = 'customers/photo/customer-{}.jpg'.format(hashlib.sha256(photo.getvalue()).hexdigest())
+            self.assertEqual(customer.photo.name, expected_name)
+            self.assertEqual(other_customer.photo.name, expected_name)
+            photo_names = os.listdir(os.path.join(media_root, 'customers', 'photo'))
+            self.assertEqual(len([name for name in photo_names if name.count('.') == 1]), 1)  # Without thumbnails
+
+            # The same photo isn't a change, so the customer isn't updated and there isn't edition log
+            self.assertFalse(customer.customerlog_set.filter(log_type=customer_choices.LOG_EDITION_TYPE).exists())
+
+    def test_archived_logs_are_merged_with_recent_logs(self):
+        """ The old logs are moved to segments and the logs endpoint returns them with the recent ones """
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir)
+
+        customer = self._create_a_customer(self.first_user)
+        other_customer = self._create_a_customer(self.second_user)
+        for index in range(3):
+            self._update_a_customer(self.second_user, customer, first_name='Name {}'.format(index))
+
+        # The creation logs and two edition logs of the customer are old
+        old_date = timezone.now() - datetime.timedelta(days=400)
+        old_log_ids = list(CustomerLog.objects.order_by('id').values_list('id', flat=True)[:4])
+        for index, log_id in enumerate(old_log_ids):
+            CustomerLog.objects.filter(id=log_id).update(created_at=old_date + datetime.timedelta(hours=index))
+        expected_log_ids = list(customer.customerlog_set.order_by('-created_at', '-id').values_list('id', flat=True))
+
+        with self.settings(CUSTOMER_LOG_ARCHIVE_DIR=archive_dir, CUSTOMER_LOG_ARCHIVE_SEGMENT_SIZE=2):
+            call_command('archive_customer_logs', days=365, stdout=io.StringIO())
+
+            self.assertEqual(CustomerLog.objects.filter(id__in=old_log_ids).count(), 0)
+            self.assertEqual(len(os.listdir(archive_dir)), 2)
+            self.assertEqual(CustomerLogArchiveBlock.objects.filter(customer=other_customer).count(), 1)
+
+            for params in [{'page_size': 3}, {'cursor': '', 'page_size': 3}]:
+                log_ids = []
+                url = '/customers/{}/logs/'.format(customer.id)
+                while url:
+                    request = self.factory.get(url, params)
+                    view = customer_api_v1_views.CustomerViewSet.as_view({'get': 'customer_logs'})
+                    force_authenticate(request, user=self.first_user)
+                    response = view(request, pk=customer.id)
+                    self.assertEqual(response.status_code, status.HTTP_200_OK)
+                    self.assertEqual(response.data['count'], 4)
+                    log_ids.extend(log['id'] for log in response.data['results'])
+                    url, params = response.data['next'], {}
+
+                self.assertEqual(log_ids, expected_log_ids)
+
+            # A page only decompresses the blocks of its logs: the first page with one log is in the table, and the
+            # keyset page reads one more log (from the newest block) to know if there are more
+            read_logs = CustomerLogArchive.read_logs
+            for params, expected_blocks in [({'page_size': 1}, 0), ({'cursor': '', 'page_size': 1}, 1)]:
+                with mock.patch.object(CustomerLogArchive, 'read_logs', autospec=True, side_effect=read_logs) as mocked:
+                    request = self.factory.get('/customers/{}/logs/'.format(customer.id), params)
+                    view = customer_api_v1_views.CustomerViewSet.as_view({'get': 'customer_logs'})
+                    force_authenticate(request, user=self.first_user)
+                    response = view(request, pk=customer.id)
+                self.assertEqual([log['id'] for log in response.data['results']], expected_log_ids[:1])
+                self.assertEqual(sum(len(call[0][1]) for call in mocked.call_args_list), expected_blocks)
+
+            # The export of the logs has the archived logs
+            request = self.factory.get('/customers/export/', {'type': 'logs', 'export_format': 'ndjson'})
+            view = customer_api_v1_views.CustomerViewSet.as_view({'get': 'export'})
+            force_authenticate(request, user=self.first_user)
+            content = b''.join(view(request).streaming_content).decode('utf-8')
+            logs = [json.loads(line) for line in content.splitlines()]
+            self.assertEqual([log['id'] for log in logs], expected_log_ids + [old_log_ids[1]])  # Creation of the other
+            self.assertEqual(logs[-1]['user'], self.second_user.username)
+
+            # The index of the segments can be rebuilt from the segment files
+            blocks = list(CustomerLogArchiveBlock.objects.values_list('customer_id', 'segment', 'offset', 'log_count'))
+            call_command('archive_customer_logs', reindex=True, stdout=io.StringIO())
+            self.assertEqual(
+                sorted(CustomerLogArchiveBlock.objects.values_list('customer_id', 'segment', 'offset', 'log_count')),
+                sorted(blocks)
+            )
+
+            # The changed fields are deleted with their logs, and the older ones that are left aren't returned either
+            CustomerLogField.objects.filter(customer=customer).update(created_at=old_date)
+            self.assertEqual(self._get_log_fields({'field': 'first_name'}).data['results'], [])
+
+            # If the archive fails after writing a segment, the segment is removed and the logs stay in the table
+            customer.customerlog_set.update(created_at=old_date)
+            recent_logs = list(customer.customerlog_set.order_by('-created_at', '-id').values(*ARCHIVED_FIELDS))
+            archive = CustomerLogArchive.from_settings()
+            with mock.patch.object(CustomerLogArchiveBlock.objects, 'bulk_create', side_effect=DatabaseError):
+                with self.assertRaises(DatabaseError):
+                    archive.archive(older_than=timezone.now())
+            self.assertEqual(len(os.listdir(archive_dir)), 2)
+            self.assertEqual(customer.customerlog_set.count(), len(recent_logs))
+
+            # A segment left by a process that died isn't indexed, because its logs are still in the table
+            archive.write_segment(recent_logs)
+            with self.assertLogs('customers.log_archive', level='WARNING'):
+                self.assertEqual(archive.reindex(), 2)
+            self.assertEqual(CustomerLogArchiveBlock.objects.count(), len(blocks))
+
+            # A log of the table older than the archived ones is merged in its place
+            customer.customerlog_set.update(created_at=old_date - datetime.timedelta(hours=1))
+            for params in [{'page_size': 3}, {'cursor': '', 'page_size': 3}]:
+                log_ids = []
+                url = '/customers/{}/logs/'.format(customer.id)
+                while url:
+                    request = self.factory.get(url, params)
+                    view = customer_api_v1_views.CustomerViewSet.as_view({'get': 'customer_logs'})
+                    force_authenticate(request, user=self.first_user)
+                    response = view(request, pk=customer.id)
+                    log_ids.extend(log['id'] for log in response.data['results'])
+                    url, params = response.data['next'], {}
+                self.assertEqual(log_ids, expected_log_ids[1:] + expected_log_ids[:1])
+
+    def test_filter_changed_fields_of_all_customers(self):
+        """ The changed fields of the logs are filtered by field name, user and date in the database """
+        first_customer = self._create_a_customer(self.first_user, email='old@nomail.com')
+        second_customer = self._create_a_customer(self.first_user, email='old@nomail.com')
+        self._update_a_customer(self.second_user, first_customer)
+        self._update_a_customer(self.first_user, second_customer)
+        CustomerLogField.objects.filter(log__customer=second_customer).update(
+            created_at=timezone.now() - datetime.timedelta(days=10))
+
+        # Who has set the email of a customer in the last week (the edition and the creation of the first customer)
+        since = (timezone.now() - datetime.timedelta(days=7)).isoformat()
+        response = self._get_log_fields({'field': 'email', 'since': since})
+        self.assertEqual(
+            [(change['customer'], change['user']['username'], change['old_value'], change['new_value'])
+             for change in response.data['results']],
+            [(first_customer.id, self.second_user.username, 'old@nomail.com', 'mail@nomail.com'),
+             (first_customer.id, self.first_user.username, None, 'old@nomail.com')]
+        )
+
+        response = self._get_log_fields({'user': self.first_user.id, 'cursor': ''})
+        self.assertEqual(response.data['count'], 2 * 4 + 3)  # Two creation logs (4 fields) and an edition (3 fields)
+        self.assertEqual(
+            [change['log'] for change in response.data['results']],
+            list(CustomerLogField.objects.filter(user=self.first_user).values_list('log_id', flat=True))
+        )
+
+        user_id = self.first_user.id
+        for params in [{'field': 'email'}, {'field': 'email', 'user': user_id}, {'user': user_id, 'since': since}]:
+            request = self.factory.get('/customers/logs/fields/', params)
+            view = customer_api_v1_views.CustomerViewSet.as_view({'get': 'log_fields'})
+            force_authenticate(request, user=self.first_user)
+            with CaptureQueriesContext(connection) as context:
+                view(request).render()
+            for query in context.captured_queries:
+                self._check_query_uses_indexes(query['sql'])
+
+        # The changes of the deleted customers aren't returned
+        self._delete_a_customer(self.second_user, first_customer)
+        response = self._get_log_fields({'field': 'email'})
+        self.assertEqual({change['customer'] for change in response.data['results']}, {second_customer.id})
+
+        self._get_log_fields({'since': since}, expected_status=status.HTTP_400_BAD_REQUEST)
+        self._get_log_fields({'field': 'email', 'since': 'yesterday'}, expected_status=status.HTTP_400_BAD_REQUEST)
+
+    def test_retrieve_customer_as_of_a_date(self):
+        """ With 'as_of', the customer is rebuilt as it was at that date from its snapshots and logs """
+        customer = self._create_a_customer(self.first_user, email='old@nomail.com')
+        created_at = timezone.now()
+        self._update_a_customer(self.second_user, customer)
+        updated_at = timezone.now()
+
+        # The customer has 2 logs since its creation, so a snapshot is taken only once
+        call_command('snapshot_customers', interval=2, stdout=io.StringIO())
+        call_command('snapshot_customers', interval=2, stdout=io.StringIO())
+        self.assertEqual(customer.snapshots.count(), 1)
+        self._bulk_request('patch', {'ids': [customer.id], 'data': {'phone': '611 222 333'}})
+
+        response = self._retrieve_customer_as_of(customer, created_at.isoformat())
+        self.assertEqual(
+            (response.data['first_name'], response.data['email'], response.data['updated_by']['username']),
+            ('Name', 'old@nomail.com', self.first_user.username)
+        )
+
+        # After the snapshot, only the later logs are replayed
+        customer.customerlog_set.filter(log_type=customer_choices.LOG_CREATION_TYPE).delete()
+        response = self._retrieve_customer_as_of(customer, updated_at.isoformat())
+        self.assertEqual(
+            (response.data['first_name'], response.data['email'], response.data['phone']),
+            ('New Name', 'mail@nomail.com', '600 123 456')
+        )
+        self.assertEqual(response.data['updated_by']['username'], self.second_user.username)
+
+        response = self._retrieve_customer_as_of(customer, timezone.now().date().isoformat())
+        self.assertEqual(response.data['phone'], '611 222 333')
+
+        self._retrieve_customer_as_of(customer, '2000-01-01', expected_status=status.HTTP_404_NOT_FOUND)
+        self._retrieve_customer_as_of(customer, 'yesterday', expected_status=status.HTTP_400_BAD_REQUEST)
+
+    def test_retrieve_deleted_customer_as_of_a_date(self):
+        """ The history of a deleted customer can be read with 'as_of' before its deletion """
+        customer = self._create_a_customer(self.first_user, email='old@nomail.com')
+        self._update_a_customer(self.second_user, customer)
+        updated_at = timezone.now()
+        self._delete_a_customer(self.second_user, customer)
+
+        response = self._retrieve_customer_as_of(customer, updated_at.isoformat())
+        self.assertEqual(
+            (response.data['first_name'], response.data['email'], response.data['updated_by']['username']),
+            ('New Name', 'mail@nomail.com', self.second_user.username)
+        )
+
+        self._retrieve_customer_as_of(customer, timezone.now().isoformat(), expected_status=status.HTTP_404_NOT_FOUND)
+        # Without 'as_of', the deleted customer isn't found
+        response = self._conditional_get('retrieve', '/customers/{}/'.format(customer.id), {'pk': customer.id})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_change_feed_returns_changes_after_cursor(self):
+        """ The change feed returns the customers changed after the cursor once, and the deleted ones as tombstones """
+        first_customer = self._create_a_customer(self.first_user)
+        second_customer = self._create_a_customer(self.first_user)
+
+        response = self._get_changes({})
+        self.assertEqual(
+            [(change['id'], change['type']) for change in response.data['changes']],
+            [(first_customer.id, 'created'), (second_customer.id, 'created')]
+        )
+        self.assertEqual(response.data['changes'][0]['customer']['first_name'], 'Name')
+
+        self._update_a_customer(self.second_user, first_customer)
+        self._update_a_customer(self.second_user, first_customer, phone='611 222 333')
+        self._delete_a_customer(self.second_user, second_customer)
+        response = self._get_changes({'cursor': response.data['cursor'], 'fields': 'id,first_name'})
+        self.assertEqual(
+            [(change['id'], change['type'], change['customer']) for change in response.data['changes']],
+            [(first_customer.id, 'updated', {'id': first_customer.id, 'first_name': 'New Name'}),
+             (second_customer.id, 'deleted', None)]
+        )
+        cursor = response.data['cursor']
+        self.assertEqual(self._get_changes({'latest': 'true'}).data['cursor'], cursor)
+
+        response = self._get_changes({'cursor': cursor})
+        self.assertEqual((response.data['changes'], response.data['cursor']), ([], cursor))
+
+        # A waiting request returns as soon as there is a change
+        def add_change():
+            CustomerLogManager.add_edition_log(self.first_user, first_customer, [{'name': 'phone', 'new_value': '1'}])
+            connection.close()
+
+        timer = threading.Timer(0.2, add_change)
+        timer.start()
+        started_at = time.monotonic()
+        response = self._get_changes({'cursor': cursor, 'wait': 10})
+        timer.join()
+        self.assertLess(time.monotonic() - started_at, 5)
+        self.assertEqual([change['id'] for change in response.data['changes']], [first_customer.id])
+
+        # When all the waiting slots are taken, the request returns at once
+        change_feed = CustomerChangeFeed(poll_interval=0.1, max_waiters=1)
+        last_id = change_feed.get_last_id()
+        waiter = threading.Thread(target=change_feed.wait_for_changes, args=(last_id, 10, 0.5))
+        waiter.start()
+        time.sleep(0.1)
+        started_at = time.monotonic()
+        self.assertEqual(change_feed.wait_for_changes(last_id, 10, 10), ([], False))
+        self.assertLess(time.monotonic() - started_at, 0.3)
+        waiter.join()
+
+        self._get_changes({'cursor': 'invalid'}, expected_status=status.HTTP_404_NOT_FOUND)
+        for log_id in (True, '1', 1.0):
+            invalid_cursor = customer_api_v1_views.CustomerViewSet.encode_changes_cursor(log_id)
+            self._get_changes({'cursor': invalid_cursor}, expected_status=status.HTTP_404_NOT_FOUND)
+
+        # The cursor needs the log ids in order of commit, which isn't guaranteed with other databases
+        with mock.patch('customers.change_feed.connection') as mocked_connection:
+            mocked_connection.vendor = 'postgresql'
+            self._get_changes({'cursor': cursor}, expected_status=status.HTTP_501_NOT_IMPLEMENTED)
+
+        for wait in ('nan', 'inf', 'seconds'):
+            self._get_changes({'cursor': cursor, 'wait': wait}, expected_status=status.HTTP_400_BAD_REQUEST)
+
+    def test_change_feed_asks_for_resync_after_archived_changes(self):
+        """ A client whose next changes have been archived gets 410, so it doesn't skip them """
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir)
+
+        customer = self._create_a_customer(self.first_user)
+        first_cursor = self._get_changes({}).data['cursor']
+        self._update_a_customer(self.second_user, customer)
+        second_cursor = self._get_changes({'cursor': first_cursor}).data['cursor']
+        self._update_a_customer(self.second_user, customer, first_name='Other name')
+
+        # The creation log and the first edition log are archived
+        old_log_ids = list(CustomerLog.objects.order_by('id').values_list('id', flat=True)[:2])
+        CustomerLog.objects.filter(id__in=old_log_ids).update(created_at=timezone.now() - datetime.timedelta(days=400))
+        with self.settings(CUSTOMER_LOG_ARCHIVE_DIR=archive_dir):
+            call_command('archive_customer_logs', days=365, stdout=io.StringIO())
+
+        for cursor in ('', first_cursor):
+            response = self._get_changes({'cursor': cursor}, expected_status=status.HTTP_410_GONE)
+            self.assertTrue(response.data['resync'])
+
+        # The changes after the archived logs are still in the feed
+        response = self._get_changes({'cursor': second_cursor})
+        self.assertEqual([change['customer']['first_name'] for change in response.data['changes']], ['Other name'])
+
+        # The blocks archived without the id of their last log could have any log until it's read from the segment
+        CustomerLogArchiveBlock.objects.update(last_log_id=None)
+        self._get_changes({'cursor': second_cursor}, expected_status=status.HTTP_410_GONE)
+        migration = importlib.import_module('customers.migrations.0012_fill_customerlogarchiveblock_last_log_id')
+        with self.settings(CUSTOMER_LOG_ARCHIVE_DIR=archive_dir):
+            migration.fill_last_log_id(apps, None)
+        self.assertEqual(list(CustomerLogArchiveBlock.objects.values_list('last_log_id', flat=True)), [old_log_ids[1]])
+        self._get_changes({'cursor': second_cursor})
+
+    def test_delta_filters_of_customer_list(self):
+        """ The customers changed since a date are listed by date, with tombstones of the deleted ones if asked """
+        first_customer = self._create_a_customer(self.first_user)
+        second_customer = self._create_a_customer(self.first_user)
+        third_customer = self._create_a_customer(self.first_user)
+        since = timezone.now().isoformat()
+        self._update_a_customer(self.second_user, first_customer)
+        self._delete_a_customer(self.second_user, second_customer)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self._list_customers(self.first_user, {'updated_since': since})
+        self.assertEqual([item['id'] for item in response.data['results']], [first_customer.id])
+        for query in context.captured_queries:
+            self._check_query_uses_indexes(query['sql'])
+
+        pages = []
+        params = {'updated_since': since, 'include_deleted': 'true', 'page_size': 1}
+        cursor = ''
+        while cursor is not None:
+            with CaptureQueriesContext(connection) as context:
+                response = self._list_customers(self.first_user, dict(params, cursor=cursor))
+            for query in context.captured_queries:
+                self._check_query_uses_indexes(query['sql'])
+            pages.append(response.data['results'])
+            cursor = response.data['next'].split('cursor=')[1].split('&')[0] if response.data['next'] else None
+        self.assertEqual(pages[0][0]['id'], first_customer.id)
+        self.assertEqual(pages[0][0]['first_name'], 'New Name')
+        self.assertFalse(pages[0][0]['is_deleted'])
+        self.assertEqual(pages[1], [{'id': second_customer.id, 'is_deleted': True}])
+        self.assertEqual(len(pages), 2)
+
+        response = self._list_customers(self.first_user, {'created_since': '2000-01-01T00:00:00Z'})
+        self.assertEqual([item['id'] for item in response.data['results']], [first_customer.id, third_customer.id])
+        response = self._list_customers(self.first_user, {'created_since': since})
+        self.assertEqual(response.data['results'], [])
+
+    def test_update_only_writes_changed_fields(self):
+        """ The update reads the customer once, writes only the changed columns and skips the write without changes """
+        customer = self._create_a_customer(self.first_user)
+
+        def update(data):
+            request = self.factory.patch('/customers/{}/'.format(customer.id), data, format='json')
+            view = customer_api_v1_views.CustomerViewSet.as_view({'patch': 'partial_update'})
+            force_authenticate(request, user=self.second_user)
+            with CaptureQueriesContext(connection) as context:
+                response = view(request, pk=customer.id)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return response, [query['sql'] for query in context.captured_queries]
+
+        response, queries = update({'phone': '611 222 333', 'first_name': 'Name'})
+        self.assertEqual(response.data['phone'], '611 222 333')
+        self.assertEqual(len([sql for sql in queries if sql.startswith('SELECT') and 'customers_customer"' in sql]), 1)
+        update_sql = [sql for sql in queries if sql.startswith('UPDATE "customers_customer"')]
+        self.assertEqual(len(update_sql), 1)
+        self.assertIn('"phone_normalized"', update_sql[0])
+        self.assertNotIn('"first_name"', update_sql[0])
+        self.assertNotIn('"address"', update_sql[0])
+
+        customer.refresh_from_db()
+        self.assertEqual((customer.phone_normalized, customer.updated_by), ('611222333', self.second_user))
+        edition_log = customer.customerlog_set.filter(log_type=customer_choices.LOG_EDITION_TYPE).get()
+        self.assertEqual([field_data['name'] for field_data in edition_log.fields_changed], ['phone'])
+
+        # Without changes, there isn't UPDATE or log
+        response, queries = update({'phone': '611 222 333'})
+        self.assertEqual(response.data['phone'], '611 222 333')
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(customer.customerlog_set.count(), 2)
+
+    def test_update_with_the_version_of_the_client(self):
+        """ With If-Match, a stale update gets 412. Without it, a concurrent change is read again before the write """
+        customer = self._create_a_customer(self.first_user)
+
+        def write(method, data=None, **headers):
+            url = '/customers/{}/'.format(customer.id)
+            request = getattr(self.factory, method)(url, data, format='json', **headers)
+            view = customer_api_v1_views.CustomerViewSet.as_view({'patch': 'partial_update', 'delete': 'destroy'})
+            force_authenticate(request, user=self.second_user)
+            return view(request, pk=customer.id)
+
+        etag = self._conditional_get('retrieve', '/customers/{}/'.format(customer.id), {'pk': customer.id})['ETag']
+        self.assertTrue(etag.startswith('"1.'))
+
+        response = write('patch', {'first_name': 'New name'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['ETag'].startswith('"2.'))
+        customer.refresh_from_db()
+        self.assertEqual((customer.first_name, customer.version), ('New name', 2))
+
+        # The ETag of the client is stale, so the customer and its logs aren't changed
+        for stale_etag in (etag, 'W/{}'.format(response['ETag'])):
+            response = write('patch', {'first_name': 'Other name'}, HTTP_IF_MATCH=stale_etag)
+            self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = write('delete', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        customer.refresh_from_db()
+        self.assertEqual((customer.first_name, customer.version, customer.is_deleted), ('New name', 2, False))
+        self.assertEqual(customer.customerlog_set.count(), 2)
+
+        # Other request updates the customer between the read and the write of this request
+        get_changed_fields = Customer.get_changed_fields
+
+        def concurrent_update(*args, **kwargs):
+            Customer.objects.filter(id=customer.id).update(last_name='Concurrent', version=F('version') + 1)
+            return get_changed_fields(*args, **kwargs)
+
+        with mock.patch.object(Customer, 'get_changed_fields', side_effect=concurrent_update):
+            response = write('patch', {'first_name': 'Other name'}, HTTP_IF_MATCH='"2"')
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        customer.refresh_from_db()
+        self.assertEqual((customer.first_name, customer.last_name, customer.version), ('New name', 'Concurrent', 3))
+
+        # Without If-Match, it's read again and written in the next attempt
+        calls = []
+
+        def concurrent_update_once(*args, **kwargs):
+            calls.append(1)
+            return concurrent_update(*args, **kwargs) if len(calls) == 1 else get_changed_fields(*args, **kwargs)
+
+        with mock.patch.object(Customer, 'get_changed_fields', side_effect=concurrent_update_once):
+            response = write('patch', {'first_name': 'Other name'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(calls), 2)
+        customer.refresh_from_db()
+        self.assertEqual((customer.first_name, customer.last_name, customer.version), ('Other name', 'Concurrent', 5))
+        self.assertEqual(customer.customerlog_set.count(), 3)
+
+    def test_search_customers_with_full_text_index(self):
+        """ The search matches words by prefix, phones without spaces and it doesn't return deleted customers """
+        customer = self._create_a_customer(self.first_user, first_name='José', phone='+34 611 222 333')
+        other_customer = self._create_a_customer(self.first_user, first_name='Peter', email='peter@example.com')
+
+        searches = [
+            ('jos', [customer.id]),
+            ('jose surname', [customer.id]),
+            ('34611222', [customer.id]),
+            ('peter@exa', [other_customer.id]),
+            ('surn', [other_customer.id, customer.id]),
+            ('unknown', []),
+        ]
+        for search, expected_ids in searches:
+            response = self._list_customers(self.first_user, {'search': search})
+            self.assertEqual([item['id'] for item in response.data['results']], expected_ids, msg=search)
+
+        self._delete_a_customer(self.first_user, customer)
+        response = self._list_customers(self.first_user, {'search': 'surname', 'rank': 'true'})
+        self.assertEqual([item['id'] for item in response.data['results']], [other_customer.id])
+
+        # The delta filters are resumed by date, so their results can't be ranked
+        since = (timezone.now() - datetime.timedelta(days=1)).isoformat()
+        response = self._conditional_get(
+            'list', '/customers/?' + urlencode({'search': 'surname', 'rank': 'true', 'updated_since': since}), {})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('rank', response.data)
+
+    def test_filter_customers_by_normalized_phone_and_email(self):
+        """ Phone and email filters are exact, but they don't depend on the format of the phone or email case """
+        customer = self._create_a_customer(self.first_user, phone='+34 611-222-333', email='John.Doe@Example.com')
+        self._create_a_customer(self.first_user, phone='611 222 333', email='john@example.com')
+
+        self.assertEqual(customer.phone_normalized, '34611222333')
+        self.assertEqual(customer.email_normalized, 'john.doe@example.com')
+
+        for params in [{'phone': '0034611222333'}, {'email': 'JOHN.DOE@example.com'}]:
+            response = self._list_customers(self.first_user, params)
+            self.assertEqual([item['id'] for item in response.data['results']], [customer.id], msg=params)
+
+    def test_read_endpoints_use_indexes(self):
+        """ The queries of list, retrieve and logs endpoints don't scan tables or sort in temporary B-trees """
+        for index in range(10):
+            customer = self._create_a_customer(self.first_user)
+            self._update_a_customer(self.second_user, customer)
+        self._delete_a_customer(self.first_user, customer)
+        customer = Customer.objects_not_deleted.first()
+
+        requests = [
+            ('list', '/customers/', {}, {}),
+            ('list', '/customers/', {'cursor': '', 'page_size': 2}, {}),
+            ('retrieve', '/customers/{}/'.format(customer.id), {}, {'pk': customer.id}),
+            ('customer_logs', '/customers/{}/logs/'.format(customer.id), {}, {'pk': customer.id}),
+            ('customer_logs', '/customers/{}/logs/'.format(customer.id), {'cursor': ''}, {'pk': customer.id}),
+        ]
+        for action, url, params, kwargs in requests:
+            request = self.factory.get(url, params, format='json')
+            view = customer_api_v1_views.CustomerViewSet.as_view({'get': action})
+            force_authenticate(request, user=self.first_user)
+
+            with CaptureQueriesContext(connection) as context:
+                response = view(request, **kwargs)
+                response.render()
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            for query in context.captured_queries:
+                self._check_query_uses_indexes(query['sql'])
+
+    def test_async_log_writer_does_not_lose_logs(self):
+        """ In write-behind mode the logs are inserted in batches, and the logs of a dead worker are recovered """
+        customer = self._create_a_customer(self.first_user)
+        journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, journal_dir)
+
+        log_writer = CustomerLogWriter(journal_dir=journal_dir, batch_size=10)
+        with mock.patch('customers.log_writer.os.fsync', wraps=os.fsync) as fsync:
+            log_writer.add(self.first_user, customer, customer_choices.LOG_EDITION_TYPE, [{'name': 'phone'}])
+        fsync.assert_any_call(log_writer._journal.fileno())  # The log is on disk before it's queued
+        self.assertEqual(customer.customerlog_set.count(), 1)  # Only the creation log
+        log_writer.flush()
+        self.assertEqual(customer.customerlog_set.count(), 2)
+
+        # The log of a change that is rolled back isn't written
+        with self.assertRaises(ValueError), transaction.atomic():
+            log_writer.add(self.first_user, customer, customer_choices.LOG_EDITION_TYPE, [{'name': 'region'}])
+            raise ValueError
+        log_writer.flush()
+        self.assertEqual(customer.customerlog_set.count(), 2)
+
+        # The worker dies before flushing the logs, so its journal is left with a pid that doesn't exist
+        log_writer.add(self.first_user, customer, customer_choices.LOG_EDITION_TYPE, [{'name': 'email'}])
+        log_writer.add(self.second_user, customer, customer_choices.LOG_DELETION_TYPE)
+        log_writer._journal.close()
+        os.rename(os.path.join(journal_dir, 'customer-logs-{}.journal'.format(os.getpid())),
+                  os.path.join(journal_dir, 'customer-logs-999999999.journal'))
+
+        CustomerLogWriter(journal_dir=journal_dir).recover()
+        self.assertEqual(customer.customerlog_set.count(), 4)
+        self.assertEqual(customer.customerlog_set.first().log_type, customer_choices.LOG_DELETION_TYPE)
+        self.assertEqual(os.listdir(journal_dir), [])
+
+        # The logs of dead workers are recovered by 'flush_customer_logs', not by the first request of a worker
+        log_writer = CustomerLogWriter(journal_dir=journal_dir, flush_interval=0.1)
+        with mock.patch.object(CustomerLogWriter, 'recover') as recover:
+            log_writer.start()
+        log_writer.close()
+        recover.assert_not_called()
+
+        # A batch that can't be inserted is moved aside, so the next batches are inserted
+        log_writer = CustomerLogWriter(journal_dir=journal_dir, batch_size=10)
+        log_writer.add(self.first_user, Customer(id=customer.id + 1000), customer_choices.LOG_EDITION_TYPE)
+        with self.assertLogs('customers.log_writer', level='ERROR'):
+            log_writer.flush()
+        log_writer.add(self.first_user, customer, customer_choices.LOG_EDITION_TYPE, [{'name': 'region'}])
+        log_writer.flush()
+        self.assertEqual(customer.customerlog_set.count(), 5)
+        self.assertEqual([os.path.splitext(name)[1] for name in os.listdir(journal_dir)], ['.failed'])
+
+    def test_import_customers_from_csv_and_jsonl(self):
+        """ The valid rows are created with their logs and the invalid rows are reported """
+        files = [
+            SimpleUploadedFile('customers.csv', (
+                'first_name,last_name,phone,email,country\n'
+                'Anna,Smith,+34 611 222 333,anna@example.com,Spain\n'
+                ',Without Name,,,\n'
+                'Bob,Brown,,,\n'
+            ).encode('utf-8')),
+            SimpleUploadedFile('customers.jsonl', (
+                '{"first_name": "Carol", "last_name": "White", "email": "Carol@Example.com"}\n'
+                'not json\n'
+            ).encode('utf-8')),
+        ]
+        results = []
+        for import_file in files:
+            request = self.factory.post('/customers/import/', {'file': import_file}, format='multipart')
+            view = customer_api_v1_views.CustomerViewSet.as_view({'post': 'import_customers'})
+            force_authenticate(request, user=self.first_user)
+            response = view(request)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            results.append(response.data)
+
+        self.assertEqual([result['created'] for result in results], [2, 1])
+        self.assertEqual([error['row'] for error in results[0]['errors']], [3])
+        self.assertIn('first_name', results[0]['errors'][0]['errors'])
+        self.assertEqual([error['row'] for error in results[1]['errors']], [2])
+
+        customer = Customer.objects_not_deleted.get(phone_normalized='34611222333')
+        self.assertEqual(
+            (customer.first_name, customer.country, customer.created_by), ('Anna', 'Spain', self.first_user))
+        self.assertEqual(list(customer.customerlog_set.values_list('log_type', flat=True)),
+                         [customer_choices.LOG_CREATION_TYPE])
+
+        customers = Customer.objects_not_deleted.order_by('id')
+        self.assertEqual([customer.first_name for customer in customers], ['Anna', 'Bob', 'Carol'])
+        for customer in customers:
+            self.assertEqual(customer.customerlog_set.count(), 1)
+
+        response = self._list_customers(self.first_user, {'search': 'carol'})
+        self.assertEqual([item['first_name'] for item in response.data['results']], ['Carol'])
+
+        # The last ids of the table are only the inserted ones in SQLite (a single writer), so the other databases
+        # must return the ids of the inserted rows
+        with mock.patch.object(connection, 'vendor', 'mysql'), transaction.atomic():
+            with self.assertRaises(NotSupportedError):
+                Customer.objects.bulk_create_with_pks([Customer(first_name='Dave', created_by=self.first_user)])
+        self.assertFalse(Customer.objects.filter(first_name='Dave').exists())
+
+    def test_bulk_update_and_delete_customers(self):
+        """ Bulk actions update the customers selected by ids or filters and add their logs """
+        customers = [self._create_a_customer(self.first_user, first_name='Anna') for _ in range(3)]
+        customers[0].country = 'Spain'
+        customers[0].save()
+        other_customer = self._create_a_customer(self.first_user, first_name='Bob')
+
+        # Only the customers with different values are updated
+        response = self._bulk_request(
+            'patch', {'ids': [customer.id for customer in customers], 'data': {'country': 'Spain', 'region': 'Madrid'}})
+        self.assertEqual(response.data, {'updated': 3})
+        response = self._bulk_request('patch', {'ids': [customers[0].id], 'data': {'country': 'Spain'}})
+        self.assertEqual(response.data, {'updated': 0})
+
+        customers[1].refresh_from_db()
+        self.assertEqual((customers[1].country, customers[1].region), ('Spain', 'Madrid'))
+        self.assertEqual(customers[1].updated_by, self.second_user)
+        new_log = customers[1].customerlog_set.first()
+        self.assertEqual(new_log.log_type, customer_choices.LOG_EDITION_TYPE)
+        self.assertEqual(new_log.fields_changed, [
+            {'name': 'country', 'new_value': 'Spain', 'old_value': ''},
+            {'name': 'region', 'new_value': 'Madrid', 'old_value': ''},
+        ])
+        self.assertEqual(len(customers[0].customerlog_set.first().fields_changed), 1)
+
+        # The search index is updated, so a filter by the new name doesn't select the old customers
+        response = self._bulk_request('patch', {'data': {'first_name': 'Anne'}}, params={'search': 'anna'})
+        self.assertEqual(response.data, {'updated': 3})
+        response = self._bulk_request('delete', {}, params={'search': 'anne'})
+        self.assertEqual(response.data, {'deleted': 3})
+
+        self.assertEqual(list(Customer.objects_not_deleted.all()), [other_customer])
+        for customer in customers:
+            self.assertEqual(customer.customerlog_set.first().log_type, customer_choices.LOG_DELETION_TYPE)
+
+        # Without ids or filters nothing is changed
+        response = self._bulk_request('delete', {}, expected_status=status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ids', response.data)
+
+    def test_bulk_update_date_is_taken_when_the_customers_are_written(self):
+        """ An edit done while a bulk update reads the customers doesn't get a later date than the bulk update """
+        customers = [self._create_a_customer(self.first_user) for _ in range(3)]
+        other_customer = self._create_a_customer(self.first_user)
+
+        get_chunks = bulk_operations._get_chunks
+
+        def get_chunks_after_edit(customer_ids):
+            # Other request edits a customer after the ids have been read and before the first chunk is written
+            self._update_a_customer(self.second_user, other_customer)
+            return get_chunks(customer_ids)
+
+        with mock.patch.object(bulk_operations, '_get_chunks', side_effect=get_chunks_after_edit):
+            response = self._bulk_request(
+                'patch', {'ids': [customer.id for customer in customers], 'data': {'country': 'Spain'}})
+        self.assertEqual(response.data, {'updated': 3})
+
+        # A client that has synced the edit doesn't skip the customers of the bulk update
+        other_customer.refresh_from_db()
+        response = self._list_customers(self.first_user, {'updated_since': other_customer.updated_at.isoformat()})
+        self.assertEqual(
+            {item['id'] for item in response.data['results']},
+            {customer.id for customer in customers + [other_customer]}
+        )
+
+    def test_export_customers_and_logs(self):
+        """ The export is a stream with the filtered customers (or their logs) and the selected fields """
+        customer = self._create_a_customer(self.first_user, first_name='Anna')
+        other_customer = self._create_a_customer(self.first_user, first_name='Bob')
+        self._update_a_customer(self.second_user, customer)
+
+        exports = [
+            ({'export_format': 'csv', 'search': 'surname'},
+             'id,first_name,last_name,phone,email,thumbnails\r\n'),
+            ({'export_format': 'ndjson', 'search': 'new', 'fields': 'id,first_name,updated_by'},
+             json.dumps({'id': customer.id, 'first_name': 'New Name', 'updated_by': 'second_user'}) + '\n'),
+        ]
+        responses = []
+        for params, expected_start in exports:
+            request = self.factory.get('/customers/export/', params)
+            view = customer_api_v1_views.CustomerViewSet.as_view({'get': 'export'})
+            force_authenticate(request, user=self.first_user)
+            response = view(request)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.streaming)
+            content = b''.join(response.streaming_content).decode('utf-8')
+            self.assertTrue(content.startswith(expected_start), msg=content)
+            responses.append(content)
+
+        self.assertEqual(len(responses[0].splitlines()), 3)
+
+        request = self.factory.get('/customers/export/', {'type': 'logs', 'export_format': 'ndjson', 'search': 'new'})
+        view = customer_api_v1_views.CustomerViewSet.as_view({'get': 'export'})
+        force_authenticate(request, user=self.first_user)
+        logs = [json.loads(line) for line in b''.join(view(request).streaming_content).decode('utf-8').splitlines()]
+        self.assertEqual([(log['customer'], log['log_type']) for log in logs], [
+            (customer.id, customer_choices.LOG_EDITION_TYPE), (customer.id, customer_choices.LOG_CREATION_TYPE)])
+
+        # The fields have the names of the API
+        self.assertEqual(set(CustomerExporter.export_fields), set(FullCustomerSerializer().fields))
+        self.assertEqual(CustomerExporter.default_fields, tuple(CustomerSerializer().fields))
+        self.assertEqual(set(CustomerLogExporter.export_fields), set(CustomerLogSerializer().fields) | {'customer'})
+
+        # The delta filters of the list, and the deleted customers as tombstones
+        since = timezone.now()
+        self._update_a_customer(self.second_user, customer, first_name='Other name')
+        self._delete_a_customer(self.second_user, other_customer)
+        params = {'export_format': 'ndjson', 'fields': 'first_name', 'updated_since': since.isoformat()}
+        expected_rows = [{'id': customer.id, 'first_name': 'Other name', 'is_deleted': False},
+                         {'id': other_customer.id, 'is_deleted': True}]
+        request = self.factory.get('/customers/export/', dict(params, include_deleted='true'))
+        view = customer_api_v1_views.CustomerViewSet.as_view({'get': 'export'})
+        force_authenticate(request, user=self.first_user)
+        content = b''.join(view(request).streaming_content).decode('utf-8')
+        self.assertEqual([json.loads(line) for line in content.splitlines()], expected_rows)
+
+        # The command has the same filters
+        output = io.StringIO()
+        call_command(
+            'export_customers', format='ndjson', fields='first_name', updated_since=since.isoformat(),
+            include_deleted=True, stdout=output)
+        self.assertEqual([json.loads(line) for line in output.getvalue().splitlines()], expected_rows)
+
+    def test_rate_limit_is_shared_and_depends_on_action_type(self):
+        """ The counters are shared by the processes that use the same file, and each action type has its limit """
+        store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_dir)
+        store_path = os.path.join(store_dir, 'throttle.sqlite3')
+
+        # Two stores with the same file are like two workers
+        first_worker_store = throttles.RateLimitStore(store_path)
+        second_worker_store = throttles.RateLimitStore(store_path)
+        self.assertEqual(first_worker_store.hit('user_1', 2, 60, now=600)[0], True)
+        self.assertEqual(second_worker_store.hit('user_1', 2, 60, now=610)[0], True)
+        allowed, wait = first_worker_store.hit('user_1', 2, 60, now=620)
+        self.assertEqual((allowed, wait), (False, 70))  # At 690 there is room for one request
+        self.assertEqual(second_worker_store.hit('user_2', 2, 60, now=620)[0], True)
+
+        # In the next window, the previous requests have the weight of the part of the previous window in the sliding
+        # window (at 690 it's 0.5 * 2 requests)
+        self.assertEqual(second_worker_store.hit('user_1', 2, 60, now=690)[0], True)
+        self.assertEqual(first_worker_store.hit('user_1', 2, 60, now=695)[0], False)
+
+        rates = {'burst': '3/min', 'burst_bulk': '1/min'}
+        with mock.patch.object(throttles.BurstRateThrottle, 'THROTTLE_RATES', rates):
+            self._bulk_request('delete', {'ids': [0]})
+            self._bulk_request('delete', {'ids': [0]}, expected_status=status.HTTP_429_TOO_MANY_REQUESTS)
+
+            # Reads and writes share the default rate, without the bulk requests
+            self._list_customers(self.second_user, {})
+            self._create_a_customer(self.second_user)
+            self._list_customers(self.second_user, {})
+
+            request = self.factory.get('/customers/')
+            view = customer_api_v1_views.CustomerViewSet.as_view({'get': 'list'})
+            force_authenticate(request, user=self.second_user)
+            response = view(request)
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertIn('Retry-After', response)
+
+        # A rate of 0 blocks all the requests of the type
+        self.assertEqual(first_worker_store.hit('user_3', 0, 60, now=700), (False, 60))
+        rates = {'burst': '3/min', 'burst_bulk': '0/min'}
+        with mock.patch.object(throttles.BurstRateThrottle, 'THROTTLE_RATES', rates):
+            response = self._bulk_request(
+                'delete', {'ids': [0]}, expected_status=status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(response['Retry-After'], '60')
+
+    def _conditional_get(self, action, url, kwargs, **headers):
+        request = self.factory.get(url, **headers)
+        view = customer_api_v1_views.CustomerViewSet.as_view({'get': action})
+        force_authenticate(request, user=self.first_user)
+        return view(request, **kwargs).render()
+
+    def _retrieve_customer_as_of(self, customer, as_of, expected_status=status.HTTP_200_OK):
+        request = self.factory.get('/customers/{}/'.format(customer.id), {'as_of': as_of})
+        view = customer_api_v1_views.CustomerViewSet.as_view({'get': 'retrieve'})
+        force_authenticate(request, user=self.first_user)
+        response = view(request, pk=customer.id)
+
+        self.assertEqual(response.status_code, expected_status)
+        return response
+
+    def _get_changes(self, params, expected_status=status.HTTP_200_OK):
+        request = self.factory.get('/customers/changes/', params)
+        view = customer_api_v1_views.CustomerViewSet.as_view({'get': 'changes'})
+        force_authenticate(request, user=self.first_user)
+        response = view(request)
+
+        self.assertEqual(response.status_code, expected_status)
+        return response
+
+    def _get_log_fields(self, params, expected_status=status.HTTP_200_OK):
+        request = self.factory.get('/customers/logs/fields/', params)
+        view = customer_api_v1_views.CustomerViewSet.as_view({'get': 'log_fields'})
+        force_authenticate(request, user=self.first_user)
+        response = view(request)
+
+        self.assertEqual(response.status_code, expected_status)
+        return response
+
+    def _bulk_request(self, method, data, params=None, expected_status=status.HTTP_200_OK):
+        url = '/customers/bulk/'
+        if params:
+            url += '?' + '&'.join('{}={}'.format(key, value) for key, value in params.items())
+        request = getattr(self.factory, method)(url, data, format='json')
+        view = customer_api_v1_views.CustomerViewSet.as_view({method: 'bulk'})
+        force_authenticate(request, user=self.second_user)
+        response = view(request)
+
+        self.assertEqual(response.status_code, expected_status)
+        return response
+
+    def _check_query_uses_indexes(self, sql):
+        """ It checks the query plan of a query (only in SQLite) """
+        if connection.vendor != 'sqlite' or not sql.startswith('SELECT'):
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            plan = [row[-1] for row in cursor.fetchall()]
+
+        for step in plan:
+            self.assertNotIn('TEMP B-TREE', step, msg='{}\n{}'.format(sql, plan))
+            if step.startswith('SCAN'):
+                self.assertIn('INDEX', step, msg='{}\n{}'.format(sql, plan))
+
+    def _list_customers(self, user, params):
+        request = self.factory.get('/customers/', params, format='json')
+        view = customer_api_v1_views.CustomerViewSet.as_view({'get': 'list'})
+        force_authenticate(request, user=user)
+        response = view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def _create_a_customer(self, user, **data):
         request_data = {
             'first_name': 'Name',
             'last_name': 'Surname',
             'email': 'mail@nomail.com',
             'phone': '600 123 456'
         }
+        request_data.update(data)
         request = self.factory.post('/customers/', request_data, format='json')
         view = customer_api_v1_views.CustomerViewSet.as_view({'post': 'create'})
         force_authenticate(request, user=user)
@@ -78,7 +1202,7 @@ class ApiV1CustomersTest(APITransactionTestCase):
 
         return new_customer
 
-    def _update_a_customer(self, user, customer):
+    def _update_a_customer(self, user, customer, **data):
         old_number_of_logs, new_log = self._get_number_of_logs(customer=customer)
 
         request_data = {
@@ -87,6 +1211,7 @@ class ApiV1CustomersTest(APITransactionTestCase):
             'email': 'mail@nomail.com',
             'phone': '600 123 456'
         }
+        request_data.update(data)
 
         request = self.factory.put('/customers/{}/'.format(customer.id), request_data, format='json')
         view = customer_api_v1_views.CustomerViewSet.as_view({'put': 'update'})
@@ -1,31 +1,116 @@
+import base64
+import binascii
+import datetime
+import json
+import math
+import os
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
-from rest_framework import filters
+from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status
 from rest_framework import viewsets
-from rest_framework.authentication import TokenAuthentication, BasicAuthentication
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from api.v1.base import DefaultPagination
-from api.v1.customers.serializers import CustomerSerializer, FullCustomerSerializer, CustomerLogSerializer
-from customers.models import Customer
+from api.v1.auth_crm.authentication import CachedBasicAuthentication, CachedTokenAuthentication
+from api.v1.base import ConditionalGetMixin, KeysetPagination, MergedRows, SparseFieldsMixin, ValuesSerializer
+from api.v1.customers.exporter import CustomerExporter, CustomerLogExporter, EXPORT_FORMAT_CSV
+from api.v1.customers.filters import CustomerFilter, CustomerLogFieldFilter, CustomerSearchFilter
+from api.v1.customers.importer import CustomerImporter, IMPORT_FORMATS
+from api.v1.customers.serializers import (
+    CustomerSerializer, FullCustomerSerializer, CustomerLogSerializer, CustomerLogFieldSerializer
+)
+from crm_example.models import VersionConflict
+from customers import choices as customer_choices
+from customers.bulk_operations import bulk_delete_customers, bulk_update_customers
+from customers.change_feed import get_change_feed
+from customers.log_archive import CustomerLogArchive
+from customers.models import Customer, CustomerLogField
+from customers.snapshots import get_customer_as_of
 from customers.log_manager import CustomerLogManager
 
 
-class CustomerViewSet(viewsets.ModelViewSet):
+class CustomerViewSet(ConditionalGetMixin, SparseFieldsMixin, viewsets.ModelViewSet):
     """
     <h2>Enpoints for viewing and editing customers.</h2>
     """
     queryset = Customer.objects_not_deleted.all()
     serializer_class = FullCustomerSerializer
     permission_classes = [IsAuthenticated]
-    pagination_class = DefaultPagination
-    filter_backends = [filters.SearchFilter]
-    search_fields = ['first_name', 'last_name', 'phone', 'email']
+    pagination_class = KeysetPagination
+    filter_backends = [DjangoFilterBackend, CustomerSearchFilter]
+    filterset_class = CustomerFilter
+    search_fields = ['first_name', 'last_name', 'phone', 'email']  # Fields in the search index
+
+    authentication_classes = [CachedBasicAuthentication, CachedTokenAuthentication]
+
+    bulk_filter_params = ['search', 'phone', 'email']  # Filters that can select the customers of bulk actions
+    bulk_max_ids = 10000
+
+    as_of_query_param = 'as_of'  # Date to rebuild a customer in retrieve
+    include_deleted_query_param = 'include_deleted'  # Tombstones of the deleted customers in the list
+
+    # Types of the changes of the change feed
+    change_type_created = 'created'
+    change_type_updated = 'updated'
+    change_type_deleted = 'deleted'
+
+    # Reads of a customer to apply an update (without If-Match) when other requests change it before it's written
+    write_attempts = 3
+
+    log_fields_filter_params = ['field', 'user']  # Indexed filters of the changed fields, one of them is required
+
+    # Serializer of the list pages from the rows of 'values()', with the same output as CustomerSerializer. With None,
+    # the pages are serialized with CustomerSerializer
+    list_values_serializer = ValuesSerializer(CustomerSerializer)
+
+    # Actions where the fields of the response can be selected with 'fields' or 'exclude' (see SparseFieldsMixin)
+    sparse_fields_actions = ['list', 'retrieve', 'customer_logs', 'log_fields', 'changes']
+
+    # Actions limited with the rate of bulk requests (see BurstRateThrottle)
+    throttle_bulk_actions = ['import_customers', 'bulk', 'export']
+
+    # Max number of queries for each action. The tests check that these numbers don't depend on the number of elements
+    query_budget = {
+        'list': 2,  # Count and page
+        'retrieve': 1,
+        'customer_logs': 5,  # Customer, archived blocks, validators, count and page
+        'log_fields': 3,  # Last archived date, count and page
+        'changes': 3,  # Last archived log, logs and customers
+    }
+
+    def get_queryset(self):
+        """
+        The related objects rendered by the serializer of the action are joined in the same query. If only some fields
+        are requested, only their columns are read (and 'updated_at' and 'version' for the ETag).
+        In the list, the deleted customers are included with 'include_deleted=true', and in the retrieve with 'as_of'
+        (the history of a deleted customer can still be read).
+        """
+        queryset = super(CustomerViewSet, self).get_queryset()
+        required_fields = ['updated_at', 'version']
+        if self.include_deleted() or self.is_history():
+            queryset = Customer.objects.all()
+            required_fields.append('is_deleted')
+        return self.select_serializer_fields(queryset, self.get_serializer_class(), required_fields=required_fields)
+
+    def include_deleted(self):
+        """ The deleted customers are in the list and the export (as tombstones) with 'include_deleted=true' """
+        return (self.action in ('list', 'export') and
+                self.request.query_params.get(self.include_deleted_query_param) == 'true')
 
-    authentication_classes = [BasicAuthentication, TokenAuthentication]
+    def is_history(self):
+        """ A customer is retrieved as it was at a past date with 'as_of', even if it has been deleted since """
+        return self.action == 'retrieve' and self.as_of_query_param in self.request.query_params
 
     def get_serializer_class(self):
         """
@@ -36,6 +121,120 @@ class CustomerViewSet(viewsets.ModelViewSet):
             return CustomerSerializer
         return FullCustomerSerializer
 
+    def list(self, request, *args, **kwargs):
+        """
+        The list is answered with 304 if the customers of the page haven't changed. The ETag depends on the id and the
+        last update of the customers of the page and on the count and links of the page, so it doesn't need other
+        queries than the page itself (e.g. an aggregate of all the filtered customers)
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+
+        values_serializer = self.get_list_values_serializer()
+        if values_serializer is not None:
+            # Only the columns of the fields, the ordering (for the cursor) and the validators are read, without model
+            # instances
+            ordering = [field.lstrip('-') for field in KeysetPagination.get_ordering(queryset)]
+            extra_fields = ['id', 'updated_at'] + (['is_deleted'] if self.include_deleted() else [])
+            queryset = queryset.values(*dict.fromkeys(values_serializer.sources + ordering + extra_fields))
+
+        page = self.paginate_queryset(queryset)
+        rows = list(queryset) if page is None else page
+
+        not_modified = self.check_not_modified(request, etag_values=[
+            self.paginator.get_page_validators() if page is not None else None,
+            [[self._get_row_value(row, 'id'), self._get_row_value(row, 'updated_at')] for row in rows],
+        ])
+        if not_modified is not None:
+            return not_modified
+
+        if page is not None:
+            return self.get_paginated_response(self.serialize_list(page))
+
+        return Response(self.serialize_list(rows))
+
+    def get_list_values_serializer(self):
+        if self.list_values_serializer is None:
+            return None
+        return self.list_values_serializer.restrict(self.get_sparse_field_names(CustomerSerializer))
+
+    def serialize_list(self, rows):
+        values_serializer = self.get_list_values_serializer()
+        if values_serializer is not None:
+            data = values_serializer.to_representation(rows)
+        else:
+            data = self.get_serializer(rows, many=True).data
+
+        if self.include_deleted():
+            # The deleted customers are tombstones with the id, and all the customers have 'is_deleted'
+            data = [
+                self.get_tombstone(row) if self._get_row_value(row, 'is_deleted') else dict(item, is_deleted=False)
+                for row, item in zip(rows, data)
+            ]
+        return data
+
+    def get_tombstone(self, row):
+        return {'id': self._get_row_value(row, 'id'), 'is_deleted': True}
+
+    @staticmethod
+    def _get_row_value(row, name):
+        """ The rows are dicts (from 'values()') or customers """
+        return row[name] if isinstance(row, dict) else getattr(row, name)
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        The customer is answered with 304 if it hasn't been updated since the version of the client.
+        With the parameter 'as_of' (ISO 8601 date or datetime), the customer is rebuilt as it was at that date from its
+        snapshots and logs (see customers.snapshots). A date without time is the end of that day. A deleted customer is
+        only found with 'as_of' before its deletion.
+        """
+        instance = self.get_object()
+
+        as_of = None
+        if self.as_of_query_param in request.query_params:
+            as_of = self.get_as_of(request.query_params[self.as_of_query_param])
+            if as_of is None:
+                return Response(
+                    {self.as_of_query_param: ['Invalid date. Use ISO 8601, e.g. 2020-01-31 or 2020-01-31T10:00:00Z.']},
+                    status=status.HTTP_400_BAD_REQUEST)
+
+        # The ETag of the current customer has its version, so it can be used to update it (If-Match)
+        not_modified = self.check_not_modified(
+            request, etag_values=[instance.pk, instance.updated_at, as_of],
+            last_modified=instance.updated_at if as_of is None else None,
+            version=instance.version if as_of is None else None)
+        if not_modified is not None:
+            return not_modified
+
+        if as_of is not None and (instance.updated_at is None or as_of < instance.updated_at):
+            instance = get_customer_as_of(instance, as_of)
+            if instance is None:
+                raise Http404('The customer did not exist at that date.')
+        elif as_of is not None and instance.is_deleted:
+            raise Http404('The customer had been deleted at that date.')
+
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
+
+    @staticmethod
+    def get_as_of(value):
+        """
+        :param value: ISO 8601 date or datetime
+        :return: aware datetime or None if it isn't valid
+        """
+        try:
+            as_of = parse_datetime(value)
+            if as_of is None:
+                as_of_date = parse_date(value)
+                if as_of_date is None:
+                    return None
+                as_of = datetime.datetime.combine(as_of_date, datetime.time.max)
+        except ValueError:
+            return None
+
+        if timezone.is_naive(as_of):
+            as_of = timezone.make_aware(as_of)
+        return as_of
+
     def perform_create(self, serializer):
         """ This method is override to set created_by and updated_by in Customer and add creation log """
         # The current user is the creator and the last user that has updated it
@@ -45,27 +244,91 @@ class CustomerViewSet(viewsets.ModelViewSet):
         CustomerLogManager.add_creation_log(
             user=self.request.user, customer=instance, new_data=serializer.validated_data)
 
+    def update(self, request, *args, **kwargs):
+        """
+        Optimistic concurrency control: with If-Match (the ETag of the customer), the customer is only updated if it
+        hasn't changed since the client read it, else the answer is 412. The version is checked in the UPDATE ('WHERE
+        version = ...'), so the row isn't locked between the read and the write.
+        Without If-Match, the update is applied to the last version: if other request changes the customer between
+        the read and the write, it's read again, so the log has the right changes.
+        """
+        partial = kwargs.pop('partial', False)
+        for _ in range(self.write_attempts):
+            instance = self.get_object()
+            precondition_failed = self.check_version_precondition(request, instance.version)
+            if precondition_failed is not None:
+                return precondition_failed
+
+            serializer = self.get_serializer(instance, data=request.data, partial=partial)
+            serializer.is_valid(raise_exception=True)
+            try:
+                self.perform_update(serializer)
+            except VersionConflict:
+                if 'HTTP_IF_MATCH' in request.META:
+                    return self.get_precondition_failed_response()
+                continue
+
+            self.conditional_headers = {
+                'ETag': self.get_etag(request, [instance.pk, instance.updated_at, None], instance.version)
+            }
+            return Response(serializer.data)
+
+        return self.get_write_conflict_response()
+
     def perform_update(self, serializer):
-        """ This method is override to set updated_by in Customer and add edition log """
+        """
+        This method is override to set updated_by in Customer and add edition log. The customer has already been read
+        by 'update' (serializer.instance), and only the changed columns are written. If nothing has changed, the
+        customer isn't updated and there isn't log.
+        """
+        instance = serializer.instance
+
         # Get changed fields in instance
-        updated_customer = self.get_object()
-        changed_fields = Customer.get_changed_fields(new_data=serializer.validated_data, instance=updated_customer)
+        changed_fields = Customer.get_changed_fields(new_data=serializer.validated_data, instance=instance)
+        if not changed_fields:
+            return
+
+        changed_field_names = [field_data['name'] for field_data in changed_fields]
+        for name in changed_field_names:
+            setattr(instance, name, serializer.validated_data[name])
 
         # The current user is the last user that has updated it
-        instance = serializer.save(updated_by=self.request.user)
+        instance.updated_by = self.request.user
+        instance.save(update_fields=changed_field_names + ['updated_by', 'updated_at'])
 
         # Add log
         CustomerLogManager.add_edition_log(user=self.request.user, customer=instance, changed_fields=changed_fields)
 
     def destroy(self, request, *args, **kwargs):
-        """ Destroy method is override to apply to add deletion log """
-        instance = self.get_object()
-        self.perform_destroy(instance)
+        """
+        Destroy method is override to apply to add deletion log. With If-Match, the customer is only deleted if it
+        hasn't changed since the client read it (see update).
+        """
+        for _ in range(self.write_attempts):
+            instance = self.get_object()
+            precondition_failed = self.check_version_precondition(request, instance.version)
+            if precondition_failed is not None:
+                return precondition_failed
 
-        # Add log
-        CustomerLogManager.add_deletion_log(user=request.user, customer=instance)
+            try:
+                self.perform_destroy(instance)
+            except VersionConflict:
+                if 'HTTP_IF_MATCH' in request.META:
+                    return self.get_precondition_failed_response()
+                continue
+
+            # Add log
+            CustomerLogManager.add_deletion_log(user=request.user, customer=instance)
+
+            return Response(status=status.HTTP_204_NO_CONTENT)
 
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return self.get_write_conflict_response()
+
+    @staticmethod
+    def get_write_conflict_response():
+        return Response(
+            {'detail': 'The customer is being modified by other requests. Retry later.'},
+            status=status.HTTP_409_CONFLICT)
 
     @action(methods=['GET'], detail=True, url_path='logs')
     def customer_logs(self, request, pk):
@@ -77,11 +340,266 @@ class CustomerViewSet(viewsets.ModelViewSet):
         """
         customer = get_object_or_404(Customer.objects_not_deleted.all(), id=pk)
 
-        queryset = customer.customerlog_set.all()
+        # The old logs are in the archive. Only the segments with logs of this customer are read
+        log_archive = CustomerLogArchive.from_settings()
+        archive_blocks = log_archive.get_blocks(customer.pk)
+
+        # The logs are only added (or archived), so the number of logs and the last log identify the version of the list
+        validators = customer.customerlog_set.aggregate(
+            count=Count('id'), last_id=Max('id'), last_created_at=Max('created_at'))
+        not_modified = self.check_not_modified(
+            request, etag_values=[
+                customer.pk, validators['count'], validators['last_id'], [block.pk for block in archive_blocks]],
+            last_modified=validators['last_created_at'] or max(
+                (block.last_created_at for block in archive_blocks), default=None)
+        )
+        if not_modified is not None:
+            return not_modified
+
+        queryset = self.select_serializer_fields(
+            customer.customerlog_set.all(), CustomerLogSerializer, required_fields=['created_at'])  # Cursor key
+        if archive_blocks:
+            queryset = MergedRows(queryset, log_archive.get_logs(archive_blocks))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.prune_serializer(CustomerLogSerializer(page, many=True))
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.prune_serializer(CustomerLogSerializer(queryset, many=True))
+        return Response(serializer.data)
+
+    @action(methods=['GET'], detail=False, url_path='logs/fields')
+    def log_fields(self, request):
+        """
+        Function that defines the endpoint to get the changed fields of the logs of all the customers, e.g. who has
+        changed the email of any customer last week. The changes are filtered by field name ('field'), user id ('user')
+        and date ('since' and 'until'), see CustomerLogFieldFilter. The field or the user is required.
+        The changes of the deleted customers aren't returned, as in the other endpoints (their customer is joined by
+        its primary key). The changed fields are deleted with their logs when they are archived, so only the changes
+        after the last archived log are returned (a partial archive doesn't leave only some of the older changes).
+        :param request:
+        :return: Paginated changed fields, from the newest
+        """
+        if not any(request.query_params.get(param) for param in self.log_fields_filter_params):
+            return Response(
+                {'field': ['A filter by {} is required.'.format(' or '.join(self.log_fields_filter_params))]},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = CustomerLogField.objects.filter(customer__is_deleted=False)
+        archived_until = CustomerLogArchive.get_last_archived_date()
+        if archived_until is not None:
+            queryset = queryset.filter(created_at__gt=archived_until)
+
+        filterset = CustomerLogFieldFilter(request.query_params, queryset=queryset, request=request)
+        if not filterset.is_valid():
+            return Response(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.select_serializer_fields(
+            filterset.qs, CustomerLogFieldSerializer, required_fields=['created_at'])  # Cursor key
         page = self.paginate_queryset(queryset)
         if page is not None:
-            serializer = CustomerLogSerializer(page, many=True)
+            serializer = self.prune_serializer(CustomerLogFieldSerializer(page, many=True))
             return self.get_paginated_response(serializer.data)
 
-        serializer = CustomerLogSerializer(queryset, many=True)
+        serializer = self.prune_serializer(CustomerLogFieldSerializer(queryset, many=True))
         return Response(serializer.data)
+
+    @action(methods=['GET'], detail=False, url_path='changes')
+    def changes(self, request):
+        """
+        Function that defines the endpoint to get the changes of the customers since a position (the parameter
+        'cursor' of the previous response), for sync clients. The customers are returned with their current data, or
+        as tombstones (without data) if they have been deleted. A customer with several changes is returned once.
+        Parameters:
+        - 'cursor': Position of the client. Without cursor, the changes are read from the beginning, and with
+        'latest=true' the response only has the cursor of the last change.
+        - 'wait': Seconds to wait for changes if there aren't new changes (long polling), up to
+        CUSTOMER_CHANGES_MAX_WAIT.
+        - 'page_size': Max number of changes read ('has_more' is true if there are more).
+        If some changes after the cursor have been archived, the answer is 410 with 'resync': the client has to read
+        all the customers again (e.g. with the list) and continue from 'latest=true'. The feed is only available with
+        SQLite (501 with other databases), because its cursor relies on the log ids being assigned in order of commit.
+        :param request:
+        :return: dict with 'changes', 'cursor' and 'has_more'
+        """
+        change_feed = get_change_feed()
+        if not change_feed.is_supported():
+            # The cursor is the id of the logs, which is only in order of commit in SQLite (see CustomerChangeFeed)
+            return Response(
+                {'detail': 'The change feed is not available with this database.'},
+                status=status.HTTP_501_NOT_IMPLEMENTED)
+
+        if request.query_params.get('latest', '').lower() == 'true':
+            cursor = self.encode_changes_cursor(change_feed.get_last_id())
+            return Response({'changes': [], 'cursor': cursor, 'has_more': False})
+
+        after_id = self.decode_changes_cursor(request.query_params.get('cursor'))
+        try:
+            timeout = float(request.query_params.get('wait', 0))
+        except ValueError:
+            timeout = None
+        if timeout is None or not math.isfinite(timeout):
+            return Response({'wait': ['A number of seconds is required.']}, status=status.HTTP_400_BAD_REQUEST)
+        timeout = min(max(timeout, 0), settings.CUSTOMER_CHANGES_MAX_WAIT)
+
+        if change_feed.is_position_archived(after_id):
+            # Some changes after the cursor aren't in the feed, so the client must read all the customers again
+            return Response(
+                {'detail': 'Some changes after this cursor have been archived. Sync all the customers again.',
+                 'resync': True},
+                status=status.HTTP_410_GONE)
+
+        limit = self.paginator.get_page_size(request)
+        logs, has_more = change_feed.wait_for_changes(after_id, limit, timeout)
+
+        # The last change of each customer, in order of change
+        last_logs = OrderedDict()
+        created_ids = set()
+        for log in logs:
+            last_logs.pop(log['customer_id'], None)
+            last_logs[log['customer_id']] = log
+            if log['log_type'] == customer_choices.LOG_CREATION_TYPE:
+                created_ids.add(log['customer_id'])
+
+        customers = self.select_serializer_fields(
+            Customer.objects.filter(id__in=list(last_logs)), FullCustomerSerializer, required_fields=['is_deleted'])
+        customers = {customer.id: customer for customer in customers}
+        serializer = self.get_serializer()  # Fields of the customers (all or the selected ones with 'fields')
+
+        changes = []
+        for customer_id, log in last_logs.items():
+            customer = customers.get(customer_id)
+            if customer is None or customer.is_deleted:
+                change_type, data = self.change_type_deleted, None
+            else:
+                change_type = self.change_type_created if customer_id in created_ids else self.change_type_updated
+                data = serializer.to_representation(customer)
+            changes.append({'id': customer_id, 'type': change_type, 'changed_at': log['created_at'], 'customer': data})
+
+        return Response({
+            'changes': changes,
+            'cursor': self.encode_changes_cursor(logs[-1]['id'] if logs else after_id),
+            'has_more': has_more,
+        })
+
+    @staticmethod
+    def encode_changes_cursor(log_id):
+        encoded = base64.urlsafe_b64encode(json.dumps({'l': log_id}, separators=(',', ':')).encode('ascii'))
+        return encoded.decode('ascii').rstrip('=')
+
+    @staticmethod
+    def decode_changes_cursor(encoded):
+        """
+        :param encoded: Cursor of the change feed (an url-safe base64 of a JSON with the id of the last log)
+        :return: id of the last log read by the client (0 without cursor)
+        """
+        if not encoded:
+            return 0
+        try:
+            log_id = json.loads(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)).decode('ascii'))['l']
+        except (TypeError, ValueError, KeyError, binascii.Error, UnicodeDecodeError):
+            raise NotFound('Invalid cursor')
+        # bool is a subclass of int, so true would be the id 1
+        if not isinstance(log_id, int) or isinstance(log_id, bool):
+            raise NotFound('Invalid cursor')
+        return log_id
+
+    @action(methods=['POST'], detail=False, url_path='import', parser_classes=[MultiPartParser])
+    def import_customers(self, request):
+        """
+        Function that defines the endpoint to import customers from a file ('file' field). The format ('format' field)
+        can be 'csv' or 'jsonl'. If it isn't sent, it's taken from the file extension.
+        :param request:
+        :return: Number of created customers and errors of invalid rows
+        """
+        uploaded_file = request.FILES.get('file')
+        if not uploaded_file:
+            return Response({'file': ['This field is required.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        file_format = request.data.get('format') or os.path.splitext(uploaded_file.name)[1].lstrip('.').lower()
+        if file_format not in IMPORT_FORMATS:
+            return Response(
+                {'format': ['Valid formats are: {}.'.format(', '.join(IMPORT_FORMATS))]},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        result = CustomerImporter(user=request.user, file_format=file_format).run(uploaded_file)
+        return Response(result)
+
+    @action(methods=['PATCH', 'DELETE'], detail=False, url_path='bulk')
+    def bulk(self, request):
+        """
+        Function that defines the endpoint to update (PATCH) or delete (DELETE) several customers at once.
+        The customers are selected with a list of ids ('ids' field) or with the list filters in the query string
+        (search, phone or email). In PATCH, the new values are sent in the field 'data'.
+        :param request:
+        :return: Number of updated or deleted customers
+        """
+        queryset, errors = self._get_bulk_queryset(request)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        if request.method == 'DELETE':
+            deleted = bulk_delete_customers(queryset, user=request.user)
+            return Response({'deleted': deleted})
+
+        data = request.data.get('data')
+        if not isinstance(data, dict) or not data:
+            return Response({'data': ['This field is required.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = dict(data)
+        data.pop('photo', None)  # Files can't be updated in bulk
+        serializer = FullCustomerSerializer(data=data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        if not serializer.validated_data:
+            return Response({'data': ['There are no fields to update.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        updated = bulk_update_customers(queryset, user=request.user, new_data=serializer.validated_data)
+        return Response({'updated': updated})
+
+    def _get_bulk_queryset(self, request):
+        """
+        :param request:
+        :return: tuple (queryset, errors)
+        """
+        queryset = Customer.objects_not_deleted.all()
+        ids = request.data.get('ids')
+
+        if ids is not None:
+            if not isinstance(ids, list) or not all(isinstance(pk, int) for pk in ids):
+                return None, {'ids': ['It must be a list of customer ids.']}
+            if len(ids) > self.bulk_max_ids:
+                return None, {'ids': ['The max number of ids is {}.'.format(self.bulk_max_ids)]}
+            return queryset.filter(id__in=ids), None
+
+        # At least one filter is required, to avoid changing all customers by mistake
+        if not any(request.query_params.get(param) for param in self.bulk_filter_params):
+            return None, {'ids': ['A list of ids or a filter ({}) is required.'.format(
+                ', '.join(self.bulk_filter_params))]}
+
+        return self.filter_queryset(queryset), None
+
+    @action(methods=['GET'], detail=False, url_path='export')
+    def export(self, request):
+        """
+        Function that defines the endpoint to export customers (or their logs with 'type=logs') as a stream.
+        The customers are filtered with the same parameters that list endpoint (including 'updated_since',
+        'created_since' and 'include_deleted'), and the fields have the same names as in the API.
+        Parameters: 'export_format' ('csv' or 'ndjson') and 'fields' (comma separated).
+        :param request:
+        :return: CSV or NDJSON file
+        """
+        exporter_class = CustomerLogExporter if request.query_params.get('type') == 'logs' else CustomerExporter
+        file_format = request.query_params.get('export_format', EXPORT_FORMAT_CSV)
+        fields = [field.strip() for field in request.query_params.get('fields', '').split(',') if field.strip()]
+
+        try:
+            exporter = exporter_class(file_format=file_format, fields=fields, include_deleted=self.include_deleted())
+        except ValueError as error:
+            return Response({'detail': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.filter_queryset(
+            Customer.objects.all() if self.include_deleted() else Customer.objects_not_deleted.all())
+        response = StreamingHttpResponse(exporter.export(queryset), content_type=exporter.content_type)
+        response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(
+            'customer_logs' if exporter_class is CustomerLogExporter else 'customers', file_format)
+        return response
@@ -0,0 +1,73 @@
+import hashlib
+import threading
+
+from django.http import HttpResponse
+from django.urls import get_resolver
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from drf_yasg.renderers import OpenAPIRenderer, SwaggerJSONRenderer, SwaggerYAMLRenderer
+from drf_yasg.views import get_schema_view
+
+SPEC_RENDERERS = (OpenAPIRenderer, SwaggerJSONRenderer, SwaggerYAMLRenderer)
+
+
+def get_cached_schema_view(info, **kwargs):
+    """
+    Function to create a drf_yasg schema view that generates the schema (JSON or YAML) once per process. The
+    introspection of all the views and serializers is slow, so the rendered schema is kept in memory and it's served
+    with an ETag. It's generated again when the URL conf changes (e.g. 'clear_url_caches').
+
+    The host of the API is the 'url' parameter or the setting SWAGGER_SETTINGS['DEFAULT_API_URL']. Without them, the
+    schema doesn't have host, so the clients use the host that served it. The Host header of the request isn't used,
+    because it's chosen by the client: it would generate and keep a schema for each host.
+
+    The schema must be public, because it's the same for all the users. The UI views (swagger and redoc) only render
+    a template with the url of the schema, so they aren't cached.
+    :param info: openapi.Info of the API
+    :param kwargs: Parameters of drf_yasg.views.get_schema_view
+    :return: SchemaView class
+    """
+    schema_view = get_schema_view(info, **kwargs)
+
+    class SchemaGenerator(schema_view.generator_class):
+
+        def get_schema(self, request=None, public=False):
+            schema = super(SchemaGenerator, self).get_schema(request, public)
+            if schema is not None and not self.url:
+                # The host and the scheme of the request
+                schema.pop('host', None)
+                schema.pop('schemes', None)
+            return schema
+
+    class CachedSchemaView(schema_view):
+        generator_class = SchemaGenerator
+
+        _schemas = {}  # (format, version) -> (resolver, content, etag)
+        _schemas_lock = threading.Lock()
+
+        def get(self, request, version='', format=None):
+            renderer = request.accepted_renderer
+            if not self.public or not isinstance(renderer, SPEC_RENDERERS):
+                return super(CachedSchemaView, self).get(request, version, format)
+
+            key = (renderer.format, request.version or version or '')
+            resolver = get_resolver()
+
+            entry = self._schemas.get(key)
+            if entry is None or entry[0] is not resolver:
+                schema = super(CachedSchemaView, self).get(request, version, format).data
+                content = renderer.render(schema, request.accepted_media_type, self.get_renderer_context())
+                entry = (resolver, content, '"{}"'.format(hashlib.md5(content).hexdigest()))
+                with self._schemas_lock:
+                    self._schemas[key] = entry
+
+            _, content, etag = entry
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                content_type = '{}; charset={}'.format(renderer.media_type, renderer.charset)
+                response = HttpResponse(content, content_type=content_type)
+            response['ETag'] = etag
+            patch_cache_control(response, no_cache=True)  # The clients must revalidate it with the ETag
+            return response
+
+    return CachedSchemaView
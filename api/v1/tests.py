@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import override_settings
+from django.urls import clear_url_caches
+
+from drf_yasg.generators import OpenAPISchemaGenerator
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+
+class ApiV1SchemaTest(APITestCase):
+
+    def setUp(self):
+        # The counters are kept in a temporary store, so the real one of the host isn't touched
+        store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_dir)
+        throttle_settings = override_settings(THROTTLE_STORE_PATH=os.path.join(store_dir, 'throttle.sqlite3'))
+        throttle_settings.enable()
+        self.addCleanup(throttle_settings.disable)
+
+    def test_schema_is_generated_once_and_served_with_etag(self):
+        """ The schema is generated in the first request and it's generated again only when the urls change """
+        url = '/api/v1/swagger.json'
+        get_schema = OpenAPISchemaGenerator.get_schema
+        with mock.patch.object(OpenAPISchemaGenerator, 'get_schema', autospec=True, side_effect=get_schema) as mocked:
+            clear_url_caches()
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn('/customers/', response.json()['paths'])
+            etag = response['ETag']
+
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['ETag'], etag)
+
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(mocked.call_count, 1)
+
+            # The schema doesn't depend on the Host header of the client
+            response = self.client.get(url, HTTP_HOST='other.example.com')
+            self.assertEqual(response['ETag'], etag)
+            self.assertNotIn('host', response.json())
+            self.assertEqual(mocked.call_count, 1)
+
+            clear_url_caches()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(mocked.call_count, 2)
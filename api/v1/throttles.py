@@ -1,5 +1,170 @@
+import os
+import sqlite3
+import threading
+
+from django.conf import settings
+
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.throttling import UserRateThrottle
 
+ACTION_TYPE_READ = 'read'
+ACTION_TYPE_WRITE = 'write'
+ACTION_TYPE_BULK = 'bulk'
+
+_rate_limit_stores = {}
+_rate_limit_stores_lock = threading.Lock()
+
+
+def get_rate_limit_store():
+    """
+    Function to get the rate limit store of THROTTLE_STORE_PATH. There is one instance per process.
+    :return: RateLimitStore instance
+    """
+    path = settings.THROTTLE_STORE_PATH
+    with _rate_limit_stores_lock:
+        if path not in _rate_limit_stores:
+            _rate_limit_stores[path] = RateLimitStore(path)
+        return _rate_limit_stores[path]
+
+
+class RateLimitStore:
+    """
+    Sliding window counters stored in a SQLite file, so they are shared by all the workers of the host.
+
+    Each key has one row with the number of requests of the current fixed window and of the previous one. The number
+    of requests of the last 'duration' seconds is estimated weighting the previous window by the part of it that is
+    still in the sliding window. So, each check reads and writes one row by its primary key (constant time and size),
+    in a write transaction to be atomic between processes.
+    """
+    busy_timeout = 5000  # Milliseconds
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def hit(self, key, limit, duration, now):
+        """
+        It counts a request of the key if it's allowed.
+        :param key:
+        :param limit: Number of allowed requests in 'duration' seconds
+        :param duration: Seconds of the window
+        :param now: Timestamp of the request
+        :return: Tuple (allowed, seconds to wait until the next request is allowed)
+        """
+        if limit <= 0:
+            # No request is allowed (e.g. a rate '0/min'), so there isn't a time to wait for room
+            return False, duration
+
+        window = int(now // duration)
+        elapsed = (now % duration) / duration
+
+        connection = self._get_connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT window, current_count, previous_count FROM rate_limits WHERE key = ?', (key, )).fetchone()
+            current_count, previous_count = self._get_counts(row, window)
+
+            allowed = previous_count * (1 - elapsed) + current_count + 1 <= limit
+            if allowed:
+                current_count += 1
+                connection.execute(
+                    'INSERT OR REPLACE INTO rate_limits (key, window, current_count, previous_count) '
+                    'VALUES (?, ?, ?, ?)',
+                    (key, window, current_count, previous_count)
+                )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+        wait = None if allowed else self._get_wait(limit, duration, elapsed, current_count, previous_count)
+        return allowed, wait
+
+    def clear(self):
+        connection = self._get_connection()
+        connection.execute('DELETE FROM rate_limits')
+
+    @staticmethod
+    def _get_counts(row, window):
+        if row is None:
+            return 0, 0
+        row_window, current_count, previous_count = row
+        if row_window == window:
+            return current_count, previous_count
+        if row_window == window - 1:
+            return 0, current_count
+        return 0, 0
+
+    @staticmethod
+    def _get_wait(limit, duration, elapsed, current_count, previous_count):
+        if current_count + 1 > limit:
+            # The current window is full, so it must be the previous window and its weight must leave room for one
+            # request
+            needed_elapsed = 1 - (limit - 1) / current_count
+            return duration * (1 - elapsed) + duration * max(needed_elapsed, 0)
+        # Time until the weight of the previous window leaves room for one request
+        needed_elapsed = 1 - (limit - current_count - 1) / previous_count
+        return max((needed_elapsed - elapsed) * duration, 0)
+
+    def _get_connection(self):
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            # The connections mustn't be shared between threads or with forked processes
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout / 1000, isolation_level=None)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS rate_limits ('
+                'key TEXT PRIMARY KEY, window INTEGER NOT NULL, current_count INTEGER NOT NULL, '
+                'previous_count INTEGER NOT NULL) WITHOUT ROWID'
+            )
+            self._local.connection = connection
+            self._local.pid = pid
+        return self._local.connection
+
 
 class BurstRateThrottle(UserRateThrottle):
+    """
+    Throttle by user (or IP for anonymous requests) with the counters in RateLimitStore, so the limit is shared by all
+    the workers.
+
+    The requests are classified as reads (safe methods), writes or bulk (the actions of 'throttle_bulk_actions' in the
+    view), and each type has its own limit with the rates 'burst_read', 'burst_write' and 'burst_bulk'. If the rate of
+    a type isn't configured, the rate 'burst' is used (a limit shared by all the types without rate).
+    """
     scope = 'burst'
+
+    def allow_request(self, request, view):
+        self.scope = self.get_scope(request, view)
+        self.rate = self.THROTTLE_RATES[self.scope]
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        self._wait = None
+
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        allowed, self._wait = get_rate_limit_store().hit(self.key, self.num_requests, self.duration, self.timer())
+        return allowed
+
+    def get_scope(self, request, view):
+        scope = '{}_{}'.format(type(self).scope, self.get_action_type(request, view))
+        return scope if scope in self.THROTTLE_RATES else type(self).scope
+
+    @staticmethod
+    def get_action_type(request, view):
+        if getattr(view, 'action', None) in getattr(view, 'throttle_bulk_actions', ()):
+            return ACTION_TYPE_BULK
+        if request.method in SAFE_METHODS:
+            return ACTION_TYPE_READ
+        return ACTION_TYPE_WRITE
+
+    def wait(self):
+        return self._wait
@@ -1,14 +1,23 @@
+import os
+
 import jsonfield
 
 from django.conf import settings
 from django.contrib.auth.models import Permission
-from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.uploadedfile import UploadedFile
 from django.db import models
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from django.utils import timezone
 
 from rest_framework.authtoken.models import Token
 
+from crm_example.uploads import get_file_hash
+
+
+class VersionConflict(Exception):
+    """ The object has been updated by another request since it was read (see BaseModel.save) """
+
 
 # Here we will declare abstract classes that they will be used through this project
 class BaseModel(models.Model):
@@ -16,10 +25,44 @@ class BaseModel(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, null=True)
     updated_at = models.DateTimeField(auto_now=True, null=True)
     is_deleted = models.BooleanField(default=False, null=False)  # Soft delete
+    version = models.PositiveIntegerField(default=1, editable=False)  # It's incremented in each update
 
     class Meta:
         abstract = True
 
+    def save(self, *args, **kwargs):
+        """
+        Optimistic concurrency control: each update increments the version, and the UPDATE is only applied if the row
+        has still the version that was read ('WHERE version = ...'). So, the changes saved by other request after the
+        object was read aren't overwritten, and VersionConflict is raised instead. The row isn't locked.
+        """
+        if self._state.adding or kwargs.get('force_insert'):
+            return super(BaseModel, self).save(*args, **kwargs)
+
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'version'}
+
+        self._read_version = self.version
+        self.version += 1
+        try:
+            super(BaseModel, self).save(*args, **kwargs)
+        except Exception:
+            self.version = self._read_version
+            raise
+        finally:
+            self._read_version = None
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        read_version = getattr(self, '_read_version', None)
+        if read_version is None:
+            return super(BaseModel, self)._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+
+        updated = super(BaseModel, self)._do_update(
+            base_qs.filter(version=read_version), using, pk_val, values, update_fields, forced_update)
+        if not updated and base_qs.filter(pk=pk_val).exists():
+            raise VersionConflict('{} {} has been updated by other request'.format(self._meta.object_name, pk_val))
+        return updated
+
     @classmethod
     def get_changed_fields(cls, new_data, instance=None):
         """
@@ -32,8 +75,10 @@ class BaseModel(models.Model):
 
         for field_name in new_data:
 
-            if isinstance(new_data.get(field_name), InMemoryUploadedFile):
+            if isinstance(new_data.get(field_name), UploadedFile):
                 # If the field is an image we can't get its value. Only want to know that the image is new
+                if instance and cls._is_same_file(getattr(instance, field_name), new_data.get(field_name)):
+                    continue
                 field_data = {'name': field_name, 'new_value': '-'}
                 changed_fields.append(field_data)
                 continue
@@ -56,6 +101,30 @@ class BaseModel(models.Model):
 
         return changed_fields
 
+    @staticmethod
+    def _is_same_file(field_file, uploaded_file):
+        """
+        Function to know if an uploaded file has the same content as the current file of a field. The files that are
+        named by their hash are compared by name, the others by size and hash.
+        :param field_file: FieldFile of the instance
+        :param uploaded_file: New file (in memory or in a temporary file)
+        :return: True if the content is the same
+        """
+        if not field_file:
+            return False
+
+        content_hash = get_file_hash(uploaded_file)
+        if content_hash in os.path.basename(field_file.name):
+            return True
+
+        try:
+            if field_file.size != uploaded_file.size:
+                return False
+            with field_file.open('rb'):
+                return get_file_hash(field_file) == content_hash
+        except OSError:
+            return False  # The current file doesn't exist
+
 
 class BaseModelLog(models.Model):
     """
@@ -72,7 +141,7 @@ class BaseModelLog(models.Model):
             something = models.ForeignKey(...)
 
     """
-    created_at = models.DateTimeField(auto_now_add=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now, null=True)  # Not auto_now_add to write logs later
     fields_changed = jsonfield.JSONField(null=True)
     user = models.ForeignKey('auth.User', null=True, on_delete=models.SET_NULL)
 
@@ -1,11 +1,36 @@
-from django.db import models
+from django.db import NotSupportedError, models, transaction
+from django.db.transaction import TransactionManagementError
+from django.utils import timezone
 
 
-class SoftDeleteQuerySet(models.query.QuerySet):
+class BulkCreateQuerySet(models.query.QuerySet):
+
+    def bulk_create_with_pks(self, objs, batch_size=None):
+        """
+        Same as 'bulk_create', but the objects have always their primary key. SQLite doesn't return the ids of the
+        inserted rows. In that case, they are the last ids of the table, because the transaction has the write lock
+        since the first insert. So, it must be called inside a transaction. Other databases must return the ids (e.g.
+        PostgreSQL), because concurrent transactions could insert rows between ours (e.g. MySQL).
+        """
+        connection = transaction.get_connection(self.db)
+        if not connection.in_atomic_block:
+            raise TransactionManagementError('bulk_create_with_pks must be called inside a transaction')
+        if not connection.features.can_return_rows_from_bulk_insert and connection.vendor != 'sqlite':
+            raise NotSupportedError('bulk_create_with_pks needs a database that returns the ids of the inserted rows')
+
+        objs = self.bulk_create(objs, batch_size=batch_size)
+        if objs and objs[0].pk is None:
+            pks = list(self.model._base_manager.order_by('-pk').values_list('pk', flat=True)[:len(objs)])
+            for obj, pk in zip(objs, reversed(pks)):
+                obj.pk = pk
+        return objs
+
+
+class SoftDeleteQuerySet(BulkCreateQuerySet):
 
     def delete(self):
-        try:
-            self.update(is_deleted=True)
-        except Exception:
-            # TODO: we should log this error with error monitoring tool
-            pass
+        """
+        Soft delete in one query. The update date and the version are changed as well, so the deletions are found by
+        the date filters and the instances that were read before can't be saved. It returns the number of deleted rows
+        """
+        return self.update(is_deleted=True, updated_at=timezone.now(), version=models.F('version') + 1)
@@ -125,23 +125,98 @@ STATICFILES_DIRS = [
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# The uploaded files are hashed while they are received. The files bigger than FILE_UPLOAD_MAX_MEMORY_SIZE are written
+# to a temporary file in chunks
+FILE_UPLOAD_HANDLERS = [
+    'crm_example.uploads.HashingMemoryFileUploadHandler',
+    'crm_example.uploads.HashingTemporaryFileUploadHandler',
+]
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5 MB
+
 # Rest Framework configuration
 REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': ('django_filters.rest_framework.DjangoFilterBackend', ),
     'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.BasicAuthentication',
+        'api.v1.auth_crm.authentication.CachedBasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'api.v1.auth_crm.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_THROTTLE_CLASSES': [
         'api.v1.throttles.BurstRateThrottle'
     ],
     'DEFAULT_THROTTLE_RATES': {
         'burst': '60/min',
+        'burst_read': '120/min',
+        'burst_write': '60/min',
+        'burst_bulk': '10/min',  # Import, bulk update/delete and export
     }
 }
 
+# Info of the schema generated with 'python manage.py generate_swagger'
+SWAGGER_SETTINGS = {
+    'DEFAULT_INFO': 'api.v1.urls.api_info',
+}
+
+# SQLite file with the counters of BurstRateThrottle. It's shared by all the workers of the host
+THROTTLE_STORE_PATH = os.path.join(BASE_DIR, 'var', 'throttle.sqlite3')
+
+# Cache of tokens in CachedTokenAuthentication. With CACHE_ALIAS (a shared cache, e.g. Redis or Memcached), the
+# tokens are shared between workers and the revoked tokens are invalidated in all of them. Without it, the invalidation
+# only reaches the current worker, so the entries only live LOCAL_TTL seconds
+TOKEN_AUTH_CACHE = {
+    'TTL': 300,  # Seconds
+    'LOCAL_TTL': 5,  # Seconds without CACHE_ALIAS
+    'MAX_SIZE': 10000,
+    'CACHE_ALIAS': None,
+}
+
+# Cache of verified credentials in CachedBasicAuthentication. It avoids hashing the password in each request
+BASIC_AUTH_CACHE = {
+    'TTL': 60,  # Seconds
+    'LOCAL_TTL': 5,  # Seconds without CACHE_ALIAS
+    'MAX_SIZE': 10000,
+    'CACHE_ALIAS': None,
+}
+
+# Backend to search customers in API and admin. FullTextSearchBackend uses a SQLite FTS5 index
+CUSTOMER_SEARCH_BACKEND = 'customers.search.FullTextSearchBackend'
+
+# Renditions of the customer photos (name: max width and height), generated by CUSTOMER_PHOTO_THUMBNAIL_WORKERS threads
+# (0 to generate them in the request)
+CUSTOMER_PHOTO_THUMBNAIL_SIZES = {
+    'small': (80, 80),  # 40px avatars in HiDPI screens
+    'medium': (400, 400),
+}
+CUSTOMER_PHOTO_THUMBNAIL_QUALITY = 80  # JPEG quality
+CUSTOMER_PHOTO_THUMBNAIL_WORKERS = 2
+
+# Customer logs are written in the request by default. With CUSTOMER_LOG_ASYNC = True, they are written in a journal
+# file and inserted in batches (of CUSTOMER_LOG_BATCH_SIZE logs or each CUSTOMER_LOG_FLUSH_INTERVAL seconds)
+CUSTOMER_LOG_ASYNC = False
+CUSTOMER_LOG_BATCH_SIZE = 500
+CUSTOMER_LOG_FLUSH_INTERVAL = 1.0  # Seconds
+CUSTOMER_LOG_JOURNAL_DIR = os.path.join(BASE_DIR, 'var', 'customer_logs')
+
+# The customer logs older than CUSTOMER_LOG_RETENTION_DAYS are moved to compressed segment files with the command
+# 'archive_customer_logs' (e.g. daily in a cron job). They are still returned by the customer logs endpoint
+CUSTOMER_LOG_RETENTION_DAYS = 365
+CUSTOMER_LOG_ARCHIVE_DIR = os.path.join(BASE_DIR, 'var', 'customer_log_archive')
+CUSTOMER_LOG_ARCHIVE_SEGMENT_SIZE = 50000  # Max number of logs in a segment file
+
+# The command 'snapshot_customers' stores the state of the customers with CUSTOMER_SNAPSHOT_INTERVAL logs since their
+# last snapshot, so a customer is rebuilt at a past date ('as_of') replaying only a few logs
+CUSTOMER_SNAPSHOT_INTERVAL = 20
+
+# The requests to the change feed ('/customers/changes/?wait=') wait up to CUSTOMER_CHANGES_MAX_WAIT seconds for new
+# changes. They are woken up by the changes of the process, and they check the changes of other processes each
+# CUSTOMER_CHANGES_POLL_INTERVAL seconds. A waiting request holds a worker (thread) and queries the database each
+# interval, so only CUSTOMER_CHANGES_MAX_WAITERS requests wait at the same time in each process (the others return at
+# once). It should be lower than the number of threads of the worker
+CUSTOMER_CHANGES_MAX_WAIT = 25
+CUSTOMER_CHANGES_POLL_INTERVAL = 1.0
+CUSTOMER_CHANGES_MAX_WAITERS = 4
+
 # ==========================================================================================
 # Parameters to authenticate users with a third party provider
 # https://django-allauth.readthedocs.io/en/latest/
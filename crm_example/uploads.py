@@ -0,0 +1,60 @@
+import hashlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+CHUNK_SIZE = 64 * 1024
+
+
+def get_file_hash(file):
+    """
+    Function to get the SHA-256 of a file. The uploaded files have it already (see the upload handlers of this
+    module), otherwise the file is read in chunks.
+    :param file: File or uploaded file
+    :return: Hexadecimal hash
+    """
+    content_hash = getattr(file, 'content_hash', None)
+    if content_hash:
+        return content_hash
+
+    hasher = hashlib.sha256()
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    for chunk in file.chunks(CHUNK_SIZE):
+        hasher.update(chunk)
+    if hasattr(file, 'seek'):
+        file.seek(0)
+
+    file.content_hash = hasher.hexdigest()
+    return file.content_hash
+
+
+class ContentHashUploadHandlerMixin:
+    """
+    Mixin for upload handlers to calculate the SHA-256 of the uploaded file while its chunks are received, so the
+    file isn't read again to get its hash. The hash is in the attribute 'content_hash' of the uploaded file.
+    """
+
+    def new_file(self, *args, **kwargs):
+        self.content_hasher = hashlib.sha256()  # Before super, because it can raise StopFutureHandlers
+        super(ContentHashUploadHandlerMixin, self).new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        remaining_data = super(ContentHashUploadHandlerMixin, self).receive_data_chunk(raw_data, start)
+        if remaining_data is None:
+            # The chunk has been stored by this handler (and not passed to the next one)
+            self.content_hasher.update(raw_data)
+        return remaining_data
+
+    def file_complete(self, file_size):
+        uploaded_file = super(ContentHashUploadHandlerMixin, self).file_complete(file_size)
+        if uploaded_file is not None:
+            uploaded_file.content_hash = self.content_hasher.hexdigest()
+        return uploaded_file
+
+
+class HashingMemoryFileUploadHandler(ContentHashUploadHandlerMixin, MemoryFileUploadHandler):
+    """ Small files (up to FILE_UPLOAD_MAX_MEMORY_SIZE) are kept in memory """
+
+
+class HashingTemporaryFileUploadHandler(ContentHashUploadHandlerMixin, TemporaryFileUploadHandler):
+    """ Big files are written to a temporary file in chunks, so the memory doesn't depend on the file size """
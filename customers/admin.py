@@ -1,6 +1,7 @@
 from django.contrib import admin
 
 from customers.models import Customer
+from customers.search import get_search_backend
 
 
 # Register the models that will be shown in Admin
@@ -10,5 +11,13 @@ class CustomerAdmin(admin.ModelAdmin):
     list_filter = ('is_deleted', )
     search_fields = ('first_name', 'last_name', 'email', 'phone')
 
+    def get_search_results(self, request, queryset, search_term):
+        """ The search uses the customer search backend (full text index) """
+        search_terms = search_term.split()
+        if not search_terms:
+            return queryset, False
+
+        return get_search_backend().search(queryset, search_terms), False
+
 
 admin.site.register(Customer, CustomerAdmin)
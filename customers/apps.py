@@ -1,5 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def prune_customer_search_index(sender, **kwargs):
+    """ The search index isn't a model table, so it's cleaned when the database is migrated or flushed """
+    from customers.search import get_search_backend
+    get_search_backend().prune()
 
 
 class CustomersConfig(AppConfig):
     name = 'customers'
+
+    def ready(self):
+        post_migrate.connect(prune_customer_search_index, sender=self)
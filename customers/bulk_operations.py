@@ -0,0 +1,91 @@
+import operator
+from functools import reduce
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from customers.log_manager import CustomerLogManager
+from customers.models import Customer, normalize_email, normalize_phone
+from customers.search import CUSTOMER_SEARCH_FIELDS, get_search_backend
+
+CHUNK_SIZE = 1000
+
+
+def _get_chunks(iterable, chunk_size=CHUNK_SIZE):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def bulk_update_customers(queryset, user, new_data):
+    """
+    Function to update the same fields of several customers. The customers that have already the new values aren't
+    updated. For each chunk of customers, the old values are read in one query, the edition logs are inserted with
+    'bulk_create' and the customers are updated in one UPDATE.
+    :param queryset: Customers to update
+    :param user: User that updates the customers
+    :param new_data: dict with the new values (validated)
+    :return: Number of updated customers
+    """
+    field_names = list(new_data)
+    update_search_index = any(name in CUSTOMER_SEARCH_FIELDS for name in field_names)
+    read_field_names = sorted(set(field_names) | set(CUSTOMER_SEARCH_FIELDS)) if update_search_index else field_names
+
+    updated_values = dict(new_data, updated_by=user, version=F('version') + 1)
+    if 'phone' in new_data:
+        updated_values['phone_normalized'] = normalize_phone(new_data['phone'])
+    if 'email' in new_data:
+        updated_values['email_normalized'] = normalize_email(new_data['email'])
+
+    with transaction.atomic():
+        # Only the customers with some different value are updated. The ids are read before the updates, because
+        # the filter could depend on the updated fields (e.g. a search)
+        queryset = queryset.exclude(reduce(operator.and_, [Q(**{name: value}) for name, value in new_data.items()]))
+        customer_ids = list(queryset.order_by('id').values_list('id', flat=True))
+
+        for chunk_ids in _get_chunks(customer_ids):
+            rows = Customer.objects.filter(id__in=chunk_ids).values('id', *read_field_names)
+
+            changes = []
+            customers = []
+            for row in rows:
+                changed_fields = [
+                    {'name': name, 'new_value': value, 'old_value': row[name]}
+                    for name, value in new_data.items() if row[name] != value
+                ]
+                changes.append((row['id'], changed_fields))
+                customers.append(Customer(**dict(row, **new_data)))
+
+            # The update date is taken when the chunk is written, not when the operation starts, so the chunks don't
+            # get a date older than the edits committed while the customers were read (see 'updated_since')
+            Customer.objects.filter(id__in=chunk_ids).update(updated_at=timezone.now(), **updated_values)
+            CustomerLogManager.add_edition_logs(user, changes)
+            if update_search_index:
+                get_search_backend().update_many(customers)
+
+    return len(customer_ids)
+
+
+def bulk_delete_customers(queryset, user):
+    """
+    Function to apply a soft delete to several customers. For each chunk of customers, the deletion logs are inserted
+    with 'bulk_create' and the customers are deleted in one UPDATE.
+    :param queryset: Customers to delete
+    :param user: User that deletes the customers
+    :return: Number of deleted customers
+    """
+    with transaction.atomic():
+        customer_ids = list(queryset.filter(is_deleted=False).order_by('id').values_list('id', flat=True))
+
+        for chunk_ids in _get_chunks(customer_ids):
+            Customer.objects.filter(id__in=chunk_ids).delete()  # Soft delete (SoftDeleteQuerySet)
+            CustomerLogManager.add_deletion_logs(user, chunk_ids)
+            get_search_backend().remove_many(chunk_ids)
+
+    return len(customer_ids)
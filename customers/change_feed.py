@@ -0,0 +1,133 @@
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Max
+
+from customers.models import CustomerLog, CustomerLogArchiveBlock
+
+_change_feed = None
+_change_feed_lock = threading.Lock()
+
+
+def get_change_feed():
+    """
+    Function to get the change feed of the process.
+    :return: CustomerChangeFeed instance
+    """
+    global _change_feed
+    with _change_feed_lock:
+        if _change_feed is None:
+            _change_feed = CustomerChangeFeed(
+                poll_interval=getattr(settings, 'CUSTOMER_CHANGES_POLL_INTERVAL', 1.0),
+                max_waiters=getattr(settings, 'CUSTOMER_CHANGES_MAX_WAITERS', 4))
+        return _change_feed
+
+
+class CustomerChangeFeed:
+    """
+    Feed of the changes of the customers (creations, editions and deletions), read from the customer logs in order of
+    id. The id of the last read log is the position of a client, so each read is a range of the primary key and its
+    cost depends on the number of new changes, not on the number of customers or logs.
+
+    The log ids are in order of commit in SQLite, because the writes are serialized (a transaction has the write lock
+    since its first insert). So, a log with a lower id can't be committed after a client has read a higher id. In
+    other databases (e.g. PostgreSQL or MySQL) a transaction can commit a lower id after a higher one, and a client
+    would skip that change, so the feed is only supported in SQLite (see is_supported).
+
+    A client can wait for new changes (long polling). The waiting requests of the process are woken up when logs are
+    committed in the process (see CustomerLogManager.save_logs), and they check the database each 'poll_interval'
+    seconds to see the logs of other processes. A waiting request holds a worker (thread) of the server, so only
+    'max_waiters' requests of the process wait at the same time, and the rest return at once (the client polls again).
+    """
+
+    def __init__(self, poll_interval=1.0, max_waiters=4):
+        self.poll_interval = poll_interval
+        self.max_waiters = max_waiters
+        self._condition = threading.Condition()
+        self._waiters = threading.BoundedSemaphore(max_waiters) if max_waiters > 0 else None
+
+    @staticmethod
+    def is_supported():
+        """ :return: True if the ids of the logs are assigned in order of commit (only in SQLite) """
+        return connection.vendor == 'sqlite'
+
+    def notify(self):
+        """ It wakes up the requests that are waiting for changes """
+        with self._condition:
+            self._condition.notify_all()
+
+    @staticmethod
+    def get_last_id():
+        """ :return: id of the last log (the position of a client that only wants the new changes) """
+        return CustomerLog.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+    @staticmethod
+    def get_last_archived_id():
+        """
+        :return: tuple (id of the last archived log (see CustomerLogArchive) or None if no log has been archived,
+        True if some blocks don't have the id of their last log)
+        """
+        # The count of a column doesn't count its NULL values
+        result = CustomerLogArchiveBlock.objects.aggregate(
+            last_log_id=Max('last_log_id'), blocks=Count('id'), known_blocks=Count('last_log_id'))
+        return result['last_log_id'], result['known_blocks'] < result['blocks']
+
+    def is_position_archived(self, after_id):
+        """
+        The archived logs aren't in the feed, so a client with a position before the last archived log would skip
+        some changes. It has to resync. The blocks without the id of their last log (not backfilled by the migration,
+        e.g. because their segment wasn't found) could have any log, so every position is archived until the index is
+        rebuilt ('archive_customer_logs --reindex').
+        :param after_id: id of the last log read by the client
+        :return: True if some logs after the position of the client have been archived
+        """
+        last_archived_id, unknown = self.get_last_archived_id()
+        return unknown or (last_archived_id is not None and after_id < last_archived_id)
+
+    @staticmethod
+    def get_changes(after_id, limit):
+        """
+        :param after_id: id of the last log read by the client
+        :param limit: Max number of logs
+        :return: tuple (list of dicts with 'id', 'customer_id', 'log_type' and 'created_at' of the logs, has_more)
+        """
+        logs = list(
+            CustomerLog.objects.filter(id__gt=after_id).order_by('id')
+            .values('id', 'customer_id', 'log_type', 'created_at')[:limit + 1]
+        )
+        return logs[:limit], len(logs) > limit
+
+    def wait_for_changes(self, after_id, limit, timeout):
+        """
+        It returns the changes after 'after_id' as soon as there are some, or no changes after 'timeout' seconds.
+        If 'max_waiters' requests are already waiting, it doesn't wait.
+        :param after_id:
+        :param limit:
+        :param timeout: Max seconds to wait (a finite number)
+        :return: Same as get_changes
+        """
+        if not math.isfinite(timeout):
+            raise ValueError('The timeout must be a finite number of seconds')
+
+        logs, has_more = self.get_changes(after_id, limit)
+        if logs or not timeout > 0 or self._waiters is None or not self._waiters.acquire(blocking=False):
+            return logs, has_more
+
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if not remaining > 0:
+                    return logs, has_more
+
+                with self._condition:
+                    self._condition.wait(min(self.poll_interval, remaining))
+
+                logs, has_more = self.get_changes(after_id, limit)
+                if logs:
+                    return logs, has_more
+        finally:
+            self._waiters.release()
@@ -0,0 +1,322 @@
+import datetime
+import json
+import logging
+import os
+import struct
+import uuid
+import zlib
+from itertools import groupby
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from customers.models import CustomerLog, CustomerLogArchiveBlock
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_MAGIC = b'CLOGSEG1'
+SEGMENT_FOOTER = struct.Struct('>Q8s')  # Length of the index and magic
+
+ARCHIVED_FIELDS = ('id', 'customer_id', 'user_id', 'log_type', 'fields_changed', 'created_at')
+
+
+class CustomerLogArchive:
+    """
+    Archive of old customer logs in compressed segment files.
+
+    A segment is an append-only file, it isn't modified after it's written. Its logs are grouped by customer, and
+    each group is a block of JSON lines compressed with zlib. At the end of the segment there is an index with the
+    offset, length and number of logs of the block of each customer, so the logs of a customer are read without
+    decompressing the rest. The index is also stored in CustomerLogArchiveBlock to find the segments of a customer.
+
+    Format: magic | blocks | index (JSON) | length of the index (8 bytes) | magic
+    """
+    segment_extension = '.seg'
+
+    def __init__(self, archive_dir, segment_size=50000):
+        self.archive_dir = archive_dir
+        self.segment_size = segment_size  # Max number of logs in a segment
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            archive_dir=settings.CUSTOMER_LOG_ARCHIVE_DIR,
+            segment_size=getattr(settings, 'CUSTOMER_LOG_ARCHIVE_SEGMENT_SIZE', 50000),
+        )
+
+    def archive(self, older_than=None):
+        """
+        It moves the logs created before 'older_than' to new segments. Each segment is written (and renamed to its
+        final name) before its logs are deleted from the table in the same transaction that adds its blocks. So, if it
+        fails, the logs stay in the table and the segment file is removed. If the process dies before removing it, the
+        segment is ignored by 'reindex', because its logs are still in the table.
+        :param older_than: datetime (CUSTOMER_LOG_RETENTION_DAYS ago by default)
+        :return: Number of archived logs
+        """
+        if older_than is None:
+            older_than = timezone.now() - datetime.timedelta(days=settings.CUSTOMER_LOG_RETENTION_DAYS)
+
+        archived = 0
+        while True:
+            segment_name = None
+            try:
+                with transaction.atomic():
+                    rows = list(
+                        CustomerLog.objects.filter(created_at__lt=older_than)
+                        .order_by('customer_id', '-created_at', '-id')
+                        .values(*ARCHIVED_FIELDS)[:self.segment_size]
+                    )
+                    if not rows:
+                        break
+
+                    segment_name, index = self.write_segment(rows)
+                    CustomerLogArchiveBlock.objects.bulk_create(self._get_blocks(segment_name, index))
+
+                    log_ids = [row['id'] for row in rows]
+                    for start in range(0, len(log_ids), 500):
+                        CustomerLog.objects.filter(id__in=log_ids[start:start + 500]).delete()
+            except Exception:
+                if segment_name is not None:
+                    os.remove(os.path.join(self.archive_dir, segment_name))
+                raise
+
+            archived += len(rows)
+
+        return archived
+
+    def write_segment(self, rows):
+        """
+        :param rows: Logs (dicts with ARCHIVED_FIELDS) ordered by customer
+        :return: tuple (name of the segment, index)
+        """
+        os.makedirs(self.archive_dir, exist_ok=True)
+        segment_name = 'segment-{}-{}{}'.format(
+            timezone.now().strftime('%Y%m%d%H%M%S'), uuid.uuid4().hex[:8], self.segment_extension)
+        path = os.path.join(self.archive_dir, segment_name)
+        temporary_path = path + '.tmp'
+
+        index = {}
+        with open(temporary_path, 'wb') as segment_file:
+            segment_file.write(SEGMENT_MAGIC)
+            for customer_id, customer_rows in groupby(rows, key=lambda row: row['customer_id']):
+                customer_rows = list(customer_rows)
+                lines = '\n'.join(json.dumps(row, cls=DjangoJSONEncoder) for row in customer_rows)
+                block = zlib.compress(lines.encode('utf-8'))
+
+                created_at = [row['created_at'] for row in customer_rows]
+                index[str(customer_id)] = {
+                    'offset': segment_file.tell(),
+                    'length': len(block),
+                    'log_count': len(customer_rows),
+                    'first_created_at': min(created_at).isoformat(),
+                    'last_created_at': max(created_at).isoformat(),
+                    'last_log_id': max(row['id'] for row in customer_rows),
+                }
+                segment_file.write(block)
+
+            index_data = json.dumps(index).encode('utf-8')
+            segment_file.write(index_data)
+            segment_file.write(SEGMENT_FOOTER.pack(len(index_data), SEGMENT_MAGIC))
+            segment_file.flush()
+            os.fsync(segment_file.fileno())
+
+        os.rename(temporary_path, path)
+        return segment_name, index
+
+    def read_segment_index(self, segment_name):
+        """ It reads the index at the end of a segment (e.g. to rebuild CustomerLogArchiveBlock) """
+        with open(os.path.join(self.archive_dir, segment_name), 'rb') as segment_file:
+            segment_file.seek(-SEGMENT_FOOTER.size, os.SEEK_END)
+            index_length, magic = SEGMENT_FOOTER.unpack(segment_file.read(SEGMENT_FOOTER.size))
+            if magic != SEGMENT_MAGIC:
+                raise ValueError('Invalid segment: {}'.format(segment_name))
+            segment_file.seek(-SEGMENT_FOOTER.size - index_length, os.SEEK_END)
+            return json.loads(segment_file.read(index_length).decode('utf-8'))
+
+    def reindex(self):
+        """
+        It rebuilds CustomerLogArchiveBlock from the indexes of the segments. The segments whose logs are still in the
+        table weren't committed (the archive failed after writing them), so they are skipped.
+        :return: Number of indexed segments
+        """
+        segment_names = sorted(
+            name for name in os.listdir(self.archive_dir) if name.endswith(self.segment_extension)
+        ) if os.path.isdir(self.archive_dir) else []
+
+        indexed = 0
+        with transaction.atomic():
+            CustomerLogArchiveBlock.objects.all().delete()
+            for segment_name in segment_names:
+                blocks = self._get_blocks(segment_name, self.read_segment_index(segment_name))
+                for block in blocks:
+                    if block.last_log_id is None:
+                        block.last_log_id = self.read_last_log_id(block)
+
+                # The logs of a segment are deleted in one transaction, so it's enough to check one of them
+                if blocks and CustomerLog.objects.filter(id=blocks[0].last_log_id).exists():
+                    logger.warning('Segment %s is skipped, because its logs are still in the table', segment_name)
+                    continue
+
+                CustomerLogArchiveBlock.objects.bulk_create(blocks, batch_size=1000)
+                indexed += 1
+
+        return indexed
+
+    @staticmethod
+    def get_blocks(customer_id):
+        return list(CustomerLogArchiveBlock.objects.filter(customer_id=customer_id))
+
+    @staticmethod
+    def get_last_archived_date():
+        """ :return: Date of the last archived log or None if no log has been archived """
+        return CustomerLogArchiveBlock.objects.aggregate(
+            last_created_at=Max('last_created_at'))['last_created_at']
+
+    def read_logs(self, blocks):
+        """
+        It reads the archived logs of some blocks, only decompressing those blocks.
+        :param blocks: CustomerLogArchiveBlock list (e.g. the blocks of a customer)
+        :return: list of CustomerLog instances (not saved), with their users
+        """
+        logs = []
+        for block in blocks:
+            for row in self._read_rows(block):
+                row['created_at'] = parse_datetime(row['created_at'])
+                logs.append(CustomerLog(**row))
+
+        user_ids = {log.user_id for log in logs if log.user_id is not None}
+        users = User.objects.in_bulk(user_ids) if user_ids else {}
+        for log in logs:
+            log.user = users.get(log.user_id)  # The user could have been deleted (SET_NULL)
+        return logs
+
+    def read_last_log_id(self, block):
+        """
+        The segments written before 'last_log_id' was added to the index don't have it, so it's read from the block.
+        :param block: CustomerLogArchiveBlock
+        :return: Max id of the logs of the block
+        """
+        return max(row['id'] for row in self._read_rows(block))
+
+    def get_logs(self, blocks):
+        """
+        :param blocks: CustomerLogArchiveBlock list (e.g. the blocks of a customer)
+        :return: ArchivedLogs of the blocks (they are only read when their logs are needed)
+        """
+        return ArchivedLogs(self, blocks)
+
+    def _read_rows(self, block):
+        with open(os.path.join(self.archive_dir, block.segment), 'rb') as segment_file:
+            segment_file.seek(block.offset)
+            lines = zlib.decompress(segment_file.read(block.length)).decode('utf-8').split('\n')
+        return [json.loads(line) for line in lines]
+
+    @staticmethod
+    def _get_blocks(segment_name, index):
+        return [
+            CustomerLogArchiveBlock(
+                customer_id=int(customer_id),
+                segment=segment_name,
+                offset=block['offset'],
+                length=block['length'],
+                log_count=block['log_count'],
+                first_created_at=parse_datetime(block['first_created_at']),
+                last_created_at=parse_datetime(block['last_created_at']),
+                last_log_id=block.get('last_log_id'),
+            )
+            for customer_id, block in index.items()
+        ]
+
+
+class ArchivedLogs:
+    """
+    Archived logs of some blocks in the order of the logs of a customer (newest first: '-created_at', '-id'). The
+    blocks are grouped in runs of blocks with overlapping dates, so the runs are in order and a run only has to be
+    read when the requested logs are in its dates. So, a page of logs only decompresses the blocks of that page.
+    It's the source of the archived logs of api.v1.base.MergedRows.
+    """
+    ordering = ('-created_at', '-id')
+
+    def __init__(self, archive, blocks):
+        self.archive = archive
+        self.runs = self._get_runs(blocks)
+
+    def count(self):
+        return sum(run['log_count'] for run in self.runs)
+
+    def is_older_than(self, created_at):
+        """ :return: True if all the logs have been created before 'created_at' """
+        return not self.runs or self.runs[0]['last_created_at'] < created_at
+
+    def get_rows(self, position=None, reverse=False, limit=None):
+        """
+        :param position: tuple (created_at, id) of the last log read or None to start from the beginning
+        :param reverse: If it's False, the logs after the position (older) from the newest. Else, the logs before the
+        position (newer) from the oldest
+        :param limit: Max number of logs
+        :return: list of CustomerLog instances
+        """
+        position = tuple(position) if position is not None else None
+        runs = reversed(self.runs) if reverse else self.runs
+        logs = []
+        for run in runs:
+            if limit is not None and len(logs) >= limit:
+                break  # The next runs are after the logs that we have
+            if position is not None and (
+                    run['last_created_at'] < position[0] if reverse else run['first_created_at'] > position[0]):
+                continue  # All the logs of the run are before the position
+
+            run_logs = self._read_run(run)
+            if position is not None:
+                run_logs = [
+                    log for log in run_logs
+                    if ((log.created_at, log.id) > position if reverse else (log.created_at, log.id) < position)
+                ]
+            logs.extend(reversed(run_logs) if reverse else run_logs)
+
+        return logs if limit is None else logs[:limit]
+
+    def get_slice(self, start, stop=None):
+        """
+        :param start: Offset of the first log (from the newest)
+        :param stop: Offset after the last log or None
+        :return: list of CustomerLog instances. Only the runs of that range are read
+        """
+        logs = []
+        offset = 0  # Offset of the first log of the run
+        for run in self.runs:
+            if stop is not None and offset >= stop:
+                break
+            if offset + run['log_count'] > start:
+                run_logs = self._read_run(run)
+                logs.extend(run_logs[max(start - offset, 0):None if stop is None else stop - offset])
+            offset += run['log_count']
+        return logs
+
+    def _read_run(self, run):
+        return sorted(
+            self.archive.read_logs(run['blocks']), key=lambda log: (log.created_at, log.id), reverse=True)
+
+    @staticmethod
+    def _get_runs(blocks):
+        runs = []
+        for block in sorted(blocks, key=lambda block: (block.last_created_at, block.first_created_at), reverse=True):
+            run = runs[-1] if runs else None
+            # The logs with the same date are sorted by id, so blocks with the same date overlap as well
+            if run is not None and block.last_created_at >= run['first_created_at']:
+                run['blocks'].append(block)
+                run['first_created_at'] = min(run['first_created_at'], block.first_created_at)
+                run['log_count'] += block.log_count
+            else:
+                runs.append({
+                    'blocks': [block],
+                    'first_created_at': block.first_created_at,
+                    'last_created_at': block.last_created_at,
+                    'log_count': block.log_count,
+                })
+        return runs
@@ -1,17 +1,45 @@
+from django.db import transaction
+
 from customers import choices as customer_choices
-from customers.models import CustomerLog, Customer
+from customers.change_feed import get_change_feed
+from customers.log_writer import get_log_writer
+from customers.models import CustomerLog, CustomerLogField, Customer
 
 
 class CustomerLogManager:
     
     @staticmethod
     def _create_customer_log(user, customer, log_type, fields_changed=None):
-        CustomerLog.objects.create(
+        # In write-behind mode, the log is queued and it'll be inserted in a batch
+        log_writer = get_log_writer()
+        if log_writer:
+            log_writer.add(user=user, customer=customer, log_type=log_type, fields_changed=fields_changed)
+            return
+
+        CustomerLogManager.save_logs([CustomerLog(
             user=user,
             customer=customer,
             log_type=log_type,
             fields_changed=fields_changed
-        )
+        )])
+
+    @staticmethod
+    def save_logs(logs, batch_size=1000):
+        """
+        Function to insert logs with their changed fields (see CustomerLogField). All the logs must be inserted with
+        it, so the changed fields can be filtered in the database and the clients of the change feed are notified.
+        :param logs: list of CustomerLog instances (not saved)
+        :param batch_size:
+        :return: list of saved logs
+        """
+        with transaction.atomic():
+            logs = CustomerLog.objects.bulk_create_with_pks(logs, batch_size=batch_size)
+            CustomerLogField.objects.bulk_create(
+                [changed_field for log in logs for changed_field in CustomerLogField.from_log(log)],
+                batch_size=batch_size
+            )
+            transaction.on_commit(get_change_feed().notify)
+        return logs
 
     @classmethod
     def add_creation_log(cls, user, customer, new_data):
@@ -28,3 +56,27 @@ class CustomerLogManager:
     def add_deletion_log(cls, user, customer):
         log_type = customer_choices.LOG_DELETION_TYPE
         cls._create_customer_log(user, customer, log_type)
+
+    @staticmethod
+    def add_edition_logs(user, changes, batch_size=1000):
+        """
+        Function to add the edition logs of a bulk update in batches
+        :param user: User that has updated the customers
+        :param changes: iterable of tuples (customer_id, changed_fields)
+        :param batch_size:
+        :return:
+        """
+        CustomerLogManager.save_logs([
+            CustomerLog(
+                user=user, customer_id=customer_id, log_type=customer_choices.LOG_EDITION_TYPE,
+                fields_changed=changed_fields
+            )
+            for customer_id, changed_fields in changes
+        ], batch_size=batch_size)
+
+    @staticmethod
+    def add_deletion_logs(user, customer_ids, batch_size=1000):
+        CustomerLogManager.save_logs([
+            CustomerLog(user=user, customer_id=customer_id, log_type=customer_choices.LOG_DELETION_TYPE)
+            for customer_id in customer_ids
+        ], batch_size=batch_size)
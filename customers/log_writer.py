@@ -0,0 +1,255 @@
+import atexit
+import functools
+import glob
+import json
+import logging
+import os
+import re
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DataError, IntegrityError, close_old_connections, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+_log_writer = None
+_log_writer_lock = threading.Lock()
+
+
+def get_log_writer():
+    """
+    Function to get the log writer of the process when write-behind mode is enabled (CUSTOMER_LOG_ASYNC).
+    :return: CustomerLogWriter instance or None if the logs are written synchronously
+    """
+    global _log_writer
+    if not getattr(settings, 'CUSTOMER_LOG_ASYNC', False):
+        return None
+
+    with _log_writer_lock:
+        if _log_writer is None:
+            _log_writer = CustomerLogWriter(
+                journal_dir=settings.CUSTOMER_LOG_JOURNAL_DIR,
+                batch_size=getattr(settings, 'CUSTOMER_LOG_BATCH_SIZE', 500),
+                flush_interval=getattr(settings, 'CUSTOMER_LOG_FLUSH_INTERVAL', 1.0),
+            )
+            _log_writer.start()
+            atexit.register(_log_writer.close)
+    return _log_writer
+
+
+class CustomerLogWriter:
+    """
+    Write-behind writer of customer logs. The logs are queued in memory and they are inserted with 'bulk_create' by a
+    background thread when there are 'batch_size' logs or after 'flush_interval' seconds.
+
+    Each log is appended to a journal file of the process when the transaction of the change is committed (a change
+    that is rolled back doesn't have a log), and it's synced to disk (fsync) before it's queued, so it isn't lost if the
+    worker or the host dies. The fsync costs a disk write per log, but the insert is still done in batches.
+    When a batch is flushed, the journal is renamed to a batch file that is removed after the insert. The journals and
+    batch files that are left by dead processes are inserted with the command 'flush_customer_logs' (when the server
+    starts and periodically). A log could be inserted twice if the process dies between the insert and the removal of
+    the file, but it's never lost. A batch that the database rejects (e.g. a log of a customer that has been removed) is
+    renamed to a '.failed' file, so it doesn't block the next batches.
+    """
+    journal_name = 'customer-logs-{pid}.journal'
+    batch_name = 'customer-logs-{pid}-{number:010d}.batch'
+    file_regex = re.compile(r'^customer-logs-(?P<pid>\d+)(-\d+\.batch|\.journal)$')
+    failed_extension = '.failed'
+
+    def __init__(self, journal_dir, batch_size=500, flush_interval=1.0):
+        self.journal_dir = journal_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._pending = 0
+        self._journal = None
+        self._batch_number = 0
+        self._pid = None
+        self._thread = None
+        self._closed = False
+
+    def start(self):
+        """
+        It starts the thread that flushes the logs. The logs left by dead processes aren't recovered here, because it
+        would delay the first request of the worker: they are recovered with 'flush_customer_logs' (see recover).
+        """
+        self._start_thread()
+
+    def close(self):
+        """ It stops the thread and flushes the pending logs """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+        if self._thread and self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout=max(self.flush_interval * 5, 5))
+
+        self.flush()
+
+    def add(self, user, customer, log_type, fields_changed=None):
+        entry = {
+            'user_id': user.pk if user else None,
+            'customer_id': customer.pk,
+            'log_type': log_type,
+            'fields_changed': fields_changed,
+            'created_at': timezone.now(),
+        }
+        # Outside a transaction, it's written at once
+        transaction.on_commit(functools.partial(self._write_entry, json.dumps(entry, cls=DjangoJSONEncoder)))
+
+    def flush(self):
+        """ It inserts the queued logs and the batch files that couldn't be inserted before """
+        with self._flush_lock:
+            with self._condition:
+                if self._pending and self._pid == os.getpid():
+                    self._pending = 0
+                    self._rotate_journal()
+
+            for batch_path in self._get_own_batch_paths():
+                try:
+                    self._write_batch_file(batch_path)
+                except (IntegrityError, DataError, KeyError, TypeError, ValueError):
+                    # The batch will never be inserted (e.g. its customer has been removed), so it's moved aside to
+                    # be inspected, and the next batches are inserted
+                    logger.exception('Customer logs of %s are invalid, they are kept in a failed file', batch_path)
+                    os.rename(batch_path, os.path.splitext(batch_path)[0] + self.failed_extension)
+                except Exception:
+                    # The batch file is kept and it'll be inserted in the next flush (e.g. the database is down)
+                    logger.exception('Customer logs of %s could not be inserted', batch_path)
+                    break
+
+    def recover(self):
+        """ It claims the journals and batch files of dead processes and inserts them """
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, 'customer-logs-*'))):
+            match = self.file_regex.match(os.path.basename(path))
+            if not match or self._is_process_alive(int(match.group('pid'))):
+                continue
+
+            with self._condition:
+                try:
+                    # The rename is atomic, so only one process claims the file
+                    os.rename(path, self._get_next_batch_path())
+                except OSError:
+                    continue
+
+        self.flush()
+
+    def _start_thread(self):
+        self._thread = threading.Thread(target=self._run, name='customer-log-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._closed and self._pending < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+                closed = self._closed
+
+            close_old_connections()
+            self.flush()
+            if closed:
+                break
+
+        connection.close()
+
+    def _write_entry(self, line):
+        with self._condition:
+            self._open_journal()
+            self._journal.write(line + '\n')
+            # The log is on disk before it's queued, so it's safe if the process or the host dies
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._pending += 1
+
+            if self._pending >= self.batch_size:
+                self._condition.notify()
+
+    def _open_journal(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            # The process has been forked, so the journal and queue of the parent aren't ours
+            self._pid = pid
+            self._pending = 0
+            self._journal = None
+            os.makedirs(self.journal_dir, exist_ok=True)
+            if self._thread is not None and not self._thread.is_alive():
+                self._start_thread()
+
+        if self._journal is None:
+            journal_path = self._get_journal_path()
+            is_new = not os.path.exists(journal_path)
+            self._journal = open(journal_path, 'a', encoding='utf-8')
+            if is_new:
+                self._fsync_directory()  # The new file is in the directory after a crash
+
+    def _fsync_directory(self):
+        directory = os.open(self.journal_dir, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def _rotate_journal(self):
+        self._journal.close()
+        self._journal = None
+        os.rename(self._get_journal_path(), self._get_next_batch_path())
+
+    def _get_journal_path(self):
+        return os.path.join(self.journal_dir, self.journal_name.format(pid=os.getpid()))
+
+    def _get_next_batch_path(self):
+        """ The batch files of a previous process with the same pid mustn't be overwritten """
+        while True:
+            self._batch_number += 1
+            path = os.path.join(
+                self.journal_dir, self.batch_name.format(pid=os.getpid(), number=self._batch_number))
+            if not os.path.exists(path):
+                return path
+
+    def _get_own_batch_paths(self):
+        pattern = os.path.join(self.journal_dir, 'customer-logs-{}-*.batch'.format(os.getpid()))
+        return sorted(glob.glob(pattern))
+
+    def _write_batch_file(self, batch_path):
+        from customers.log_manager import CustomerLogManager
+        from customers.models import CustomerLog
+
+        logs = []
+        with open(batch_path, encoding='utf-8') as batch_file:
+            for line in batch_file:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The last line could be incomplete if the process died while it was writing
+                    logger.warning('Invalid customer log in %s: %s', batch_path, line)
+                    continue
+
+                logs.append(CustomerLog(
+                    user_id=entry['user_id'],
+                    customer_id=entry['customer_id'],
+                    log_type=entry['log_type'],
+                    fields_changed=entry['fields_changed'],
+                    created_at=parse_datetime(entry['created_at']),
+                ))
+
+        CustomerLogManager.save_logs(logs, batch_size=self.batch_size)
+        os.remove(batch_path)
+
+    @staticmethod
+    def _is_process_alive(pid):
+        if pid == os.getpid():
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
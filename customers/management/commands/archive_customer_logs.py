@@ -0,0 +1,31 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from customers.log_archive import CustomerLogArchive
+
+
+class Command(BaseCommand):
+    help = 'Move the old customer logs to compressed segment files (CUSTOMER_LOG_ARCHIVE_DIR)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.CUSTOMER_LOG_RETENTION_DAYS,
+            help='The logs older than these days are archived'
+        )
+        parser.add_argument(
+            '--reindex', action='store_true', help='Rebuild the index of archived logs from the segment files'
+        )
+
+    def handle(self, *args, **options):
+        archive = CustomerLogArchive.from_settings()
+
+        if options['reindex']:
+            segments = archive.reindex()
+            self.stdout.write(self.style.SUCCESS('{} segments have been indexed'.format(segments)))
+            return
+
+        archived = archive.archive(older_than=timezone.now() - datetime.timedelta(days=options['days']))
+        self.stdout.write(self.style.SUCCESS('{} customer logs have been archived'.format(archived)))
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from customers.log_writer import CustomerLogWriter
+
+
+class Command(BaseCommand):
+    help = 'Insert the customer logs left in journal files by workers that have finished (write-behind mode)'
+
+    def handle(self, *args, **options):
+        log_writer = CustomerLogWriter(journal_dir=settings.CUSTOMER_LOG_JOURNAL_DIR)
+        log_writer.recover()
+
+        self.stdout.write(self.style.SUCCESS('The pending customer logs have been inserted'))
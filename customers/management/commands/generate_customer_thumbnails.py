@@ -0,0 +1,46 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+
+from customers.models import Customer
+from customers.thumbnails import generate_thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Generate the thumbnails of the customer photos in parallel (only the missing ones by default)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Number of photos processed at the same time')
+        parser.add_argument('--force', action='store_true', help='Generate again the existing thumbnails')
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'], 1)
+        photo_names = (
+            Customer.objects.exclude(photo='').exclude(photo__isnull=True)
+            .order_by('id').values_list('photo', flat=True).iterator()
+        )
+
+        generated = 0
+        errors = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            for photo_name in photo_names:
+                # The number of pending photos is limited, so the memory doesn't depend on the number of customers
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    generated, errors = self._count(done, generated, errors)
+                pending.add(executor.submit(generate_thumbnails, photo_name, overwrite=options['force']))
+
+            generated, errors = self._count(wait(pending).done, generated, errors)
+
+        self.stdout.write(self.style.SUCCESS(
+            '{} thumbnails have been generated ({} photos with errors)'.format(generated, errors)))
+
+    def _count(self, futures, generated, errors):
+        for future in futures:
+            try:
+                generated += len(future.result())
+            except Exception as error:
+                errors += 1
+                self.stderr.write('Thumbnails could not be generated: {}'.format(error))
+        return generated, errors
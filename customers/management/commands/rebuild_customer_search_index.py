@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from customers.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Fill the customer search index again from the customer table'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            get_search_backend().rebuild()
+
+        self.stdout.write(self.style.SUCCESS('The customer search index has been rebuilt'))
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from customers.snapshots import take_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Store a snapshot of the customers with new logs since their last snapshot (run it periodically)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=int, default=settings.CUSTOMER_SNAPSHOT_INTERVAL,
+            help='Number of new logs of a customer to take a snapshot'
+        )
+
+    def handle(self, *args, **options):
+        snapshots = take_snapshots(interval=max(options['interval'], 1))
+        self.stdout.write(self.style.SUCCESS('{} customer snapshots have been taken'.format(snapshots)))
@@ -0,0 +1,34 @@
+from django.db import migrations
+
+from customers.search import FullTextSearchBackend
+
+
+def create_search_index(apps, schema_editor):
+    """ The full text index is only created in SQLite. In other databases the search uses the customer table """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    schema_editor.execute(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5('
+        'first_name, last_name, phone, phone_digits, email, '
+        'tokenize="unicode61 remove_diacritics 2")'.format(FullTextSearchBackend.table_name)
+    )
+    FullTextSearchBackend().rebuild(customer_model=apps.get_model('customers', 'Customer'))
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    schema_editor.execute('DROP TABLE IF EXISTS {}'.format(FullTextSearchBackend.table_name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
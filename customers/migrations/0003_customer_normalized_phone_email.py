@@ -0,0 +1,41 @@
+# Generated by Django 3.0.5 on 2026-10-18 19:41
+
+from django.db import migrations, models
+
+import customers.models
+
+
+def fill_normalized_fields(apps, schema_editor):
+    Customer = apps.get_model('customers', 'Customer')
+
+    customers_to_update = []
+    for customer in Customer.objects.only('id', 'phone', 'email').iterator(chunk_size=2000):
+        customer.phone_normalized = customers.models.normalize_phone(customer.phone)
+        customer.email_normalized = customers.models.normalize_email(customer.email)
+        customers_to_update.append(customer)
+        if len(customers_to_update) >= 2000:
+            Customer.objects.bulk_update(customers_to_update, ['phone_normalized', 'email_normalized'])
+            customers_to_update = []
+
+    Customer.objects.bulk_update(customers_to_update, ['phone_normalized', 'email_normalized'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0002_customer_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='email_normalized',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=150),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='phone_normalized',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=15),
+        ),
+        migrations.RunPython(fill_normalized_fields, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.0.5 on 2026-10-18 19:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0003_customer_normalized_phone_email'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(condition=models.Q(is_deleted=False), fields=['-id'], name='customer_not_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customerlog',
+            index=models.Index(fields=['customer', '-created_at', '-id'], name='customerlog_customer_date_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.0.5 on 2026-10-18 19:43
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0004_customer_indexes'),
+    ]
+
+    # The default value is set by Django, so the table doesn't change
+    operations = [
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='customerlog',
+                name='created_at',
+                field=models.DateTimeField(default=django.utils.timezone.now, null=True),
+            ),
+        ]),
+    ]
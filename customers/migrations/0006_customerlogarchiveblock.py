@@ -0,0 +1,30 @@
+# Generated by Django 3.0.5 on 2026-10-18 20:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0005_customerlog_created_at_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerLogArchiveBlock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('segment', models.CharField(max_length=100)),
+                ('offset', models.BigIntegerField()),
+                ('length', models.IntegerField()),
+                ('log_count', models.IntegerField()),
+                ('first_created_at', models.DateTimeField()),
+                ('last_created_at', models.DateTimeField()),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='customers.Customer')),
+            ],
+            options={
+                'ordering': ['customer_id', 'id'],
+            },
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 3.0.5 on 2026-10-18 20:08
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+import customers.models
+
+
+def fill_customer_log_fields(apps, schema_editor):
+    CustomerLog = apps.get_model('customers', 'CustomerLog')
+    CustomerLogField = apps.get_model('customers', 'CustomerLogField')
+
+    logs = CustomerLog.objects.exclude(fields_changed=None).order_by('id').only(
+        'id', 'customer_id', 'user_id', 'created_at', 'fields_changed')
+
+    changed_fields = []
+    for log in logs.iterator(chunk_size=2000):
+        for field_data in log.fields_changed or []:
+            if not isinstance(field_data, dict) or not field_data.get('name'):
+                continue
+            changed_fields.append(CustomerLogField(
+                log_id=log.id,
+                customer_id=log.customer_id,
+                user_id=log.user_id,
+                created_at=log.created_at,
+                name=field_data['name'],
+                old_value=customers.models.get_log_value_text(field_data.get('old_value')),
+                new_value=customers.models.get_log_value_text(field_data.get('new_value')),
+            ))
+        if len(changed_fields) >= 2000:
+            CustomerLogField.objects.bulk_create(changed_fields)
+            changed_fields = []
+
+    CustomerLogField.objects.bulk_create(changed_fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('customers', '0006_customerlogarchiveblock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerLogField',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(null=True)),
+                ('name', models.CharField(max_length=50)),
+                ('old_value', models.TextField(null=True)),
+                ('new_value', models.TextField(null=True)),
+                ('customer', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='customers.Customer')),
+                ('log', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changed_fields', to='customers.CustomerLog')),
+                ('user', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at', '-id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='customerlogfield',
+            index=models.Index(fields=['name', '-created_at', '-id'], name='customerlogfield_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customerlogfield',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='customerlogfield_user_idx'),
+        ),
+        migrations.RunPython(fill_customer_log_fields, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.0.5 on 2026-10-18 20:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0007_customerlogfield'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField()),
+                ('data', jsonfield.fields.JSONField(default=dict)),
+                ('customer', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='snapshots', to='customers.Customer')),
+            ],
+            options={
+                'ordering': ['customer_id', '-taken_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='customersnapshot',
+            index=models.Index(fields=['customer', '-taken_at'], name='customersnapshot_customer_idx'),
+        ),
+    ]
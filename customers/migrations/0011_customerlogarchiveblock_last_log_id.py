@@ -0,0 +1,22 @@
+# Generated by Django 3.0.5 on 2026-10-18 20:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0010_customer_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customerlogarchiveblock',
+            name='last_log_id',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='customerlogarchiveblock',
+            index=models.Index(fields=['last_log_id'], name='customerlogblock_last_log_idx'),
+        ),
+    ]
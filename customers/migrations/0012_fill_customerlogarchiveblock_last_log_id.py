@@ -0,0 +1,37 @@
+# Generated by Django 3.0.5 on 2026-10-18 21:40
+
+import os
+
+from django.conf import settings
+from django.db import migrations
+
+from customers.log_archive import CustomerLogArchive
+
+
+def fill_last_log_id(apps, schema_editor):
+    """ The blocks archived before 'last_log_id' was added get the max id of their logs from their segment """
+    CustomerLogArchiveBlock = apps.get_model('customers', 'CustomerLogArchiveBlock')
+
+    archive = CustomerLogArchive(archive_dir=settings.CUSTOMER_LOG_ARCHIVE_DIR)
+    blocks_to_update = []
+    for block in CustomerLogArchiveBlock.objects.filter(last_log_id__isnull=True).iterator(chunk_size=2000):
+        if not os.path.exists(os.path.join(archive.archive_dir, block.segment)):
+            continue  # Without its segment, the block stays unknown (see CustomerChangeFeed.is_position_archived)
+        block.last_log_id = archive.read_last_log_id(block)
+        blocks_to_update.append(block)
+        if len(blocks_to_update) >= 2000:
+            CustomerLogArchiveBlock.objects.bulk_update(blocks_to_update, ['last_log_id'])
+            blocks_to_update = []
+
+    CustomerLogArchiveBlock.objects.bulk_update(blocks_to_update, ['last_log_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0011_customerlogarchiveblock_last_log_id'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_last_log_id, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.5 on 2026-10-18 21:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0012_fill_customerlogarchiveblock_last_log_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customerlogarchiveblock',
+            index=models.Index(fields=['last_created_at'], name='customerlogblock_last_date_idx'),
+        ),
+    ]
@@ -1,15 +1,17 @@
 from django.db import models
 
-from crm_example.querysets import SoftDeleteQuerySet
+from crm_example.querysets import BulkCreateQuerySet, SoftDeleteQuerySet
 
 
-class BaseCustomers(models.Manager):
-
-    def get_queryset(self):
-        return SoftDeleteQuerySet(self.model, using=self._db)
+class BaseCustomers(models.Manager.from_queryset(SoftDeleteQuerySet)):
+    """ The methods of SoftDeleteQuerySet (e.g. bulk_create_with_pks) are available in the manager """
 
 
 class NotDeletedCustomers(models.Manager):
 
     def get_queryset(self):
         return super(NotDeletedCustomers, self).get_queryset().filter(is_deleted=False)
+
+
+class CustomerLogs(models.Manager.from_queryset(BulkCreateQuerySet)):
+    """ The logs are inserted with 'bulk_create_with_pks', so their changed fields can reference them """
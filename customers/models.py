@@ -1,30 +1,57 @@
-import datetime
+import functools
+import json
 import os
+import re
 
-from django.db import models
+import jsonfield
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 
 from customers import model_managers as customer_managers
 from customers import choices as customer_choices
+from customers.search import get_search_backend
+from customers.thumbnails import get_thumbnail_pool
 from crm_example.models import BaseModel, BaseModelLog
+from crm_example.uploads import get_file_hash
 
 
 def get_customer_photo_upload_to(instance, filename):
     """
-    Function to generate file names for uploaded images
+    Function to generate file names for uploaded images. The name is the hash of the content, so the same image has
+    always the same name and it's stored once.
     :param instance:
     :param filename:
     :return:
     """
     path = customer_choices.PATH_TO_UPLOAD_CUSTOMER_PHOTOS
     filename_without_extension, extension = os.path.splitext(filename)  # Extension has already the dot
-    upload_datetime_str = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
 
-    full_path = '{path}customer-{upload_datetime}{extension}'.format(
-        path=path, upload_datetime=upload_datetime_str, extension=extension)
+    full_path = '{path}customer-{content_hash}{extension}'.format(
+        path=path, content_hash=get_file_hash(instance.photo.file), extension=extension.lower())
     return full_path
 
 
+def normalize_phone(phone):
+    """
+    Function to get the phone in a comparable format: only digits and without the international prefix '00',
+    e.g. '+34 600-123-456' and '0034 600123456' are '34600123456'
+    :param phone:
+    :return: normalized phone
+    """
+    digits = re.sub(r'\D', '', phone or '')
+    if digits.startswith('00'):
+        digits = digits[2:]
+    return digits
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
 class Customer(BaseModel):
     """
     Model Customer
@@ -37,6 +64,10 @@ class Customer(BaseModel):
     phone = models.CharField(max_length=15, default='', verbose_name=_("Phone"))
     email = models.EmailField(max_length=150, default='', verbose_name=_("Email"))
 
+    # Normalized values of phone and email to look up customers by exact match. They are set automatically on save
+    phone_normalized = models.CharField(max_length=15, default='', editable=False, db_index=True)
+    email_normalized = models.CharField(max_length=150, default='', editable=False, db_index=True)
+
     country = models.CharField(max_length=50, default='', verbose_name=_("Country"))
     postal_code = models.CharField(max_length=15, default='', verbose_name=_("Postal Code"))
     region = models.CharField(max_length=100, default='', verbose_name=_("Region"))
@@ -53,6 +84,14 @@ class Customer(BaseModel):
 
     class Meta:
         ordering = ['-id']
+        indexes = [
+            # The customers are read through 'objects_not_deleted' ordered by '-id'
+            models.Index(fields=['-id'], condition=models.Q(is_deleted=False), name='customer_not_deleted_idx'),
+            # Delta filters ('updated_since' and 'created_since'), ordered by date and id. They include the deleted
+            # customers, so the clients can get the deletions
+            models.Index(fields=['updated_at', 'id'], name='customer_updated_at_idx'),
+            models.Index(fields=['created_at', 'id'], name='customer_created_at_idx'),
+        ]
 
     def __str__(self):
         """
@@ -61,19 +100,74 @@ class Customer(BaseModel):
         :return: the full_name of the instance
         """
         return self.full_name
-    
+
+    def save(self, *args, **kwargs):
+        """
+        We override this method to keep the normalized fields updated and to generate the thumbnails of a new photo
+        (in background, after the commit)
+        """
+        self.set_normalized_fields()
+        photo_uploaded = bool(self.photo) and not self.photo._committed
+        photo_reused = photo_uploaded and self.reuse_stored_photo()
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            if 'phone' in update_fields:
+                update_fields.add('phone_normalized')
+            if 'email' in update_fields:
+                update_fields.add('email_normalized')
+            kwargs['update_fields'] = update_fields
+
+        super(Customer, self).save(*args, **kwargs)
+
+        if photo_uploaded:
+            # The thumbnails of a reused photo are only generated if they are missing
+            transaction.on_commit(
+                functools.partial(get_thumbnail_pool().submit, self.photo.name, overwrite=not photo_reused))
+
+    def reuse_stored_photo(self):
+        """
+        If the new photo is already stored (the same content, so the same name), the stored file is used instead of
+        saving it again.
+        :return: True if the photo is already stored
+        """
+        field = self._meta.get_field('photo')
+        name = field.generate_filename(self, self.photo.name)
+        if not self.photo.storage.exists(name):
+            return False
+
+        self.photo.name = name
+        self.photo._committed = True  # It won't be saved in the storage
+        return True
+
+    def set_normalized_fields(self):
+        """ It has to be called before 'bulk_create' or 'bulk_update', because they don't call 'save' """
+        self.phone_normalized = normalize_phone(self.phone)
+        self.email_normalized = normalize_email(self.email)
+
     def delete(self, using=None, keep_parents=False):
         """
         We override this method to force the soft delete of this model, when this method is used through the code.
+        The update date is changed, so the deletion is found by the date filters ('updated_since').
         """
         self.is_deleted = True
-        self.save(update_fields=['is_deleted'])
+        self.save(update_fields=['is_deleted', 'updated_at'])
 
     @property
     def full_name(self):
         return "{} {}".format(self.first_name, self.last_name)
 
 
+@receiver(post_save, sender=Customer)
+def update_customer_search_index(sender, instance=None, **kwargs):
+    """
+    This function keeps the search index updated when a customer is saved. The soft deleted customers are removed
+    from the index.
+    """
+    get_search_backend().update(instance)
+
+
 class CustomerLog(BaseModelLog):
 
     LOG_TYPE_CHOICES = (
@@ -85,5 +179,110 @@ class CustomerLog(BaseModelLog):
     log_type = models.CharField(choices=LOG_TYPE_CHOICES, max_length=50)
     customer = models.ForeignKey('customers.Customer', on_delete=models.PROTECT)
 
+    # Model Managers
+    objects = customer_managers.CustomerLogs()
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # The logs are read by customer ordered by '-created_at' (and '-id' in cursor pagination)
+            models.Index(fields=['customer', '-created_at', '-id'], name='customerlog_customer_date_idx'),
+        ]
+
+
+def get_log_value_text(value):
+    """
+    Function to store the values of the changed fields as text, e.g. 'mail@nomail.com' or '10'
+    :param value: Value of 'fields_changed' (None if it doesn't exist)
+    :return: str or None
+    """
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, cls=DjangoJSONEncoder)
+
+
+class CustomerLogField(models.Model):
+    """
+    Changed field of a customer log. The same information is in 'fields_changed' of the log (that is rendered in the
+    logs), but a JSON blob can't be filtered in the database. With this table, the changes are looked up by field name
+    in an index, e.g. who changed the email of any customer last week. The customer, date and user of the log are
+    copied, so the changes are filtered and listed without reading the logs.
+    The changed fields are deleted with their log when it's archived (see customers.log_archive), so they only cover
+    the logs of the table.
+    """
+    log = models.ForeignKey('customers.CustomerLog', on_delete=models.CASCADE, related_name='changed_fields')
+    customer = models.ForeignKey('customers.Customer', on_delete=models.PROTECT, db_index=False, related_name='+')
+    user = models.ForeignKey('auth.User', null=True, on_delete=models.SET_NULL, db_index=False, related_name='+')
+    created_at = models.DateTimeField(null=True)
+    name = models.CharField(max_length=50)
+    old_value = models.TextField(null=True)  # None if the log doesn't have the old value (e.g. creation)
+    new_value = models.TextField(null=True)
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['name', '-created_at', '-id'], name='customerlogfield_name_idx'),
+            # It's used by the filter by user and when a user is deleted (SET_NULL)
+            models.Index(fields=['user', '-created_at', '-id'], name='customerlogfield_user_idx'),
+        ]
+
+    @classmethod
+    def from_log(cls, log):
+        """
+        :param log: CustomerLog instance (saved)
+        :return: list of CustomerLogField instances (not saved) with the changed fields of the log
+        """
+        return [
+            cls(
+                log_id=log.pk,
+                customer_id=log.customer_id,
+                user_id=log.user_id,
+                created_at=log.created_at,
+                name=field_data['name'],
+                old_value=get_log_value_text(field_data.get('old_value')),
+                new_value=get_log_value_text(field_data.get('new_value')),
+            )
+            for field_data in log.fields_changed or [] if isinstance(field_data, dict) and field_data.get('name')
+        ]
+
+
+class CustomerSnapshot(models.Model):
+    """
+    Full state of a customer at a date (the values of its columns), so a customer is rebuilt at a past date replaying
+    only the logs after the last snapshot (see customers.snapshots).
+    """
+    customer = models.ForeignKey(
+        'customers.Customer', on_delete=models.PROTECT, db_index=False, related_name='snapshots')
+    taken_at = models.DateTimeField()
+    data = jsonfield.JSONField(encoder_class=DjangoJSONEncoder)  # The dates are ISO 8601 strings
+
+    class Meta:
+        ordering = ['customer_id', '-taken_at']
+        indexes = [
+            # The last snapshot of a customer before a date
+            models.Index(fields=['customer', '-taken_at'], name='customersnapshot_customer_idx'),
+        ]
+
+
+class CustomerLogArchiveBlock(models.Model):
+    """
+    Block of archived logs of a customer in a segment file (see customers.log_archive). It's the same information as
+    the index of the segment, so the segments of a customer are found without reading all the segments.
+    """
+    customer = models.ForeignKey('customers.Customer', on_delete=models.PROTECT)
+    segment = models.CharField(max_length=100)  # Name of the segment file
+    offset = models.BigIntegerField()
+    length = models.IntegerField()
+    log_count = models.IntegerField()
+    first_created_at = models.DateTimeField()
+    last_created_at = models.DateTimeField()
+    last_log_id = models.BigIntegerField(null=True)  # Max id of the logs of the block (None in older segments)
+
+    class Meta:
+        ordering = ['customer_id', 'id']  # Order of the index of the foreign key
+        indexes = [
+            # The last archived log is the oldest position of the change feed (see CustomerChangeFeed)
+            models.Index(fields=['last_log_id'], name='customerlogblock_last_log_idx'),
+            # The date of the last archived log is the oldest date of the changed fields (see CustomerLogField)
+            models.Index(fields=['last_created_at'], name='customerlogblock_last_date_idx'),
+        ]
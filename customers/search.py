@@ -0,0 +1,201 @@
+import operator
+import re
+from functools import reduce
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+CUSTOMER_SEARCH_FIELDS = ('first_name', 'last_name', 'phone', 'email')
+
+_search_backend = None
+
+
+def get_search_backend():
+    """
+    Function to get the search backend declared in settings (CUSTOMER_SEARCH_BACKEND). The instance is shared
+    through the process.
+    :return: Search backend instance
+    """
+    global _search_backend
+    if _search_backend is None:
+        backend_path = getattr(settings, 'CUSTOMER_SEARCH_BACKEND', 'customers.search.FullTextSearchBackend')
+        _search_backend = import_string(backend_path)()
+    return _search_backend
+
+
+class DatabaseSearchBackend:
+    """
+    Basic backend. It filters with 'icontains' in each search field, like SearchFilter does. It doesn't need an index,
+    so the index methods do nothing.
+    """
+
+    def search(self, queryset, search_terms, ranked=False):
+        """
+        Function to filter a customer queryset. All the terms have to match in any of the search fields.
+        :param queryset: Customer queryset
+        :param search_terms: list of terms
+        :param ranked: If it's True, the results are ordered by relevance (when the backend supports it)
+        :return: Filtered queryset
+        """
+        for term in search_terms:
+            conditions = [Q(**{'{}__icontains'.format(field): term}) for field in CUSTOMER_SEARCH_FIELDS]
+            queryset = queryset.filter(reduce(operator.or_, conditions))
+        return queryset
+
+    def update(self, customer):
+        pass
+
+    def update_many(self, customers):
+        pass
+
+    def remove(self, customer_id):
+        pass
+
+    def remove_many(self, customer_ids):
+        pass
+
+    def rebuild(self, customer_model=None, chunk_size=2000):
+        pass
+
+    def prune(self):
+        pass
+
+
+class FullTextSearchBackend(DatabaseSearchBackend):
+    """
+    Backend that keeps an inverted index of customers in a SQLite FTS5 table (created in migrations), so a search is an
+    index lookup instead of a scan of the customer table. The terms are matched by prefix, so the results are
+    updated while the user is typing. The index has also the phone with only digits, so '600123' matches '600 123 456'.
+
+    If the database isn't SQLite, it works as DatabaseSearchBackend.
+    """
+    table_name = 'customers_customer_fts'
+    customer_table_name = 'customers_customer'
+
+    @property
+    def is_enabled(self):
+        return connection.vendor == 'sqlite'
+
+    def search(self, queryset, search_terms, ranked=False):
+        if not self.is_enabled:
+            return super(FullTextSearchBackend, self).search(queryset, search_terms, ranked)
+
+        match_expression = self.get_match_expression(search_terms)
+        if not match_expression:
+            return queryset
+
+        queryset = queryset.filter(id__in=RawSQL(
+            'SELECT rowid FROM {table} WHERE {table} MATCH %s'.format(table=self.table_name), [match_expression]))
+
+        if ranked:
+            # FTS5 rank is lower when the result is more relevant
+            queryset = queryset.annotate(search_rank=RawSQL(
+                'SELECT rank FROM {table} WHERE {table} MATCH %s AND rowid = {customer_table}.id'.format(
+                    table=self.table_name, customer_table=self.customer_table_name),
+                [match_expression])
+            ).order_by('search_rank', '-id')
+
+        return queryset
+
+    @staticmethod
+    def get_match_expression(search_terms):
+        """
+        Each term is a prefix phrase (escaped) and all of them have to match. The terms without letters or numbers
+        are ignored, because the index doesn't store them.
+        :param search_terms: list of terms
+        :return: FTS5 query
+        """
+        phrases = [
+            '"{}"*'.format(term.replace('"', '""'))
+            for term in search_terms if re.search(r'\w', term)
+        ]
+        return ' AND '.join(phrases)
+
+    def update(self, customer):
+        """ The index only has customers that aren't deleted """
+        if customer.is_deleted:
+            self.remove(customer.id)
+            return
+
+        if not self.is_enabled:
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(self.table_name), [customer.id])
+            self._insert_rows(cursor, [[
+                customer.id, customer.first_name, customer.last_name, customer.phone,
+                re.sub(r'\D', '', customer.phone or ''), customer.email
+            ]])
+
+    def update_many(self, customers):
+        """ Function to update the index after bulk operations, that don't send 'post_save' signal """
+        if not self.is_enabled:
+            return
+
+        customers = list(customers)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'DELETE FROM {} WHERE rowid = %s'.format(self.table_name), [[customer.id] for customer in customers])
+            self._insert_rows(cursor, [
+                [customer.id, customer.first_name, customer.last_name, customer.phone,
+                 re.sub(r'\D', '', customer.phone or ''), customer.email]
+                for customer in customers if not customer.is_deleted
+            ])
+
+    def remove(self, customer_id):
+        if not self.is_enabled:
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(self.table_name), [customer_id])
+
+    def remove_many(self, customer_ids):
+        if not self.is_enabled:
+            return
+
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'DELETE FROM {} WHERE rowid = %s'.format(self.table_name), [[pk] for pk in customer_ids])
+
+    def rebuild(self, customer_model=None, chunk_size=2000):
+        """ Function to fill the index again from customer table. It's useful after bulk operations """
+        if not self.is_enabled:
+            return
+
+        customer_model = customer_model or apps.get_model('customers', 'Customer')
+        rows = customer_model.objects.filter(is_deleted=False).values_list(
+            'id', 'first_name', 'last_name', 'phone', 'email').iterator(chunk_size=chunk_size)
+
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {}'.format(self.table_name))
+            chunk = []
+            for customer_id, first_name, last_name, phone, email in rows:
+                chunk.append([customer_id, first_name, last_name, phone, re.sub(r'\D', '', phone or ''), email])
+                if len(chunk) >= chunk_size:
+                    self._insert_rows(cursor, chunk)
+                    chunk = []
+            if chunk:
+                self._insert_rows(cursor, chunk)
+
+    def prune(self):
+        """ Function to remove from the index the customers that don't exist (e.g. after flushing the database) """
+        if not self.is_enabled or self.table_name not in connection.introspection.table_names():
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM {table} WHERE rowid NOT IN '
+                '(SELECT id FROM {customer_table} WHERE is_deleted = 0)'.format(
+                    table=self.table_name, customer_table=self.customer_table_name)
+            )
+
+    def _insert_rows(self, cursor, rows):
+        cursor.executemany(
+            'INSERT INTO {} (rowid, first_name, last_name, phone, phone_digits, email) '
+            'VALUES (%s, %s, %s, %s, %s, %s)'.format(self.table_name),
+            rows
+        )
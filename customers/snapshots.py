@@ -0,0 +1,134 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import models
+from django.db.models import Count, F, OuterRef, Q, Subquery
+
+from customers.log_archive import CustomerLogArchive
+from customers.models import Customer, CustomerLogArchiveBlock, CustomerSnapshot
+
+CHUNK_SIZE = 1000
+
+# Value of the files in the logs, because their name isn't known when the log is created
+UNKNOWN_FILE_VALUE = '-'
+
+
+def get_snapshot_fields():
+    """ :return: Customer fields stored in the snapshots (all the columns except the primary key) """
+    return [field for field in Customer._meta.concrete_fields if not field.primary_key]
+
+
+def get_snapshot_data(customer):
+    """
+    :param customer: Customer instance
+    :return: dict with the value of each column (by attname, e.g. 'created_by_id')
+    """
+    data = {}
+    for field in get_snapshot_fields():
+        value = field.value_from_object(customer)
+        data[field.attname] = getattr(value, 'name', value)  # The name of the files
+    return data
+
+
+def take_snapshots(interval=None, chunk_size=CHUNK_SIZE):
+    """
+    Function to take a snapshot of the customers with at least 'interval' logs since their last snapshot, so a
+    rebuild of a customer doesn't replay more than 'interval' logs after a snapshot (see get_customer_as_of). It's
+    incremental: the customers without new changes aren't snapshotted again.
+    :param interval: Number of logs between snapshots (CUSTOMER_SNAPSHOT_INTERVAL by default)
+    :param chunk_size: Number of customers checked in each query
+    :return: Number of snapshots
+    """
+    interval = interval or settings.CUSTOMER_SNAPSHOT_INTERVAL
+    last_snapshot_at = CustomerSnapshot.objects.filter(customer=OuterRef('pk')).order_by('-taken_at')[:1]
+    customers = Customer.objects_not_deleted.annotate(
+        last_snapshot_at=Subquery(last_snapshot_at.values('taken_at'))
+    ).annotate(
+        new_logs=Count(
+            'customerlog', filter=Q(last_snapshot_at=None) | Q(customerlog__created_at__gt=F('last_snapshot_at')))
+    ).filter(new_logs__gte=interval).order_by('id')
+
+    snapshots = 0
+    last_id = 0
+    while True:
+        chunk = list(customers.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            break
+
+        # The row is the state of the customer since its last update, so the snapshot is taken at 'updated_at'
+        CustomerSnapshot.objects.bulk_create([
+            CustomerSnapshot(customer=customer, taken_at=customer.updated_at, data=get_snapshot_data(customer))
+            for customer in chunk
+        ])
+        snapshots += len(chunk)
+        last_id = chunk[-1].id
+
+    return snapshots
+
+
+def get_customer_as_of(customer, as_of):
+    """
+    Function to rebuild a customer as it was at a date. The rebuild starts from the last snapshot before the date
+    (or from the creation) and it replays the changed fields of the later logs until the date, including the archived
+    logs. The new files of the logs are unknown, so a photo changed after the snapshot is None.
+    :param customer: Customer instance (current state)
+    :param as_of: datetime (aware)
+    :return: Customer instance (not saved) or None if the customer didn't exist at that date
+    """
+    if customer.created_at and customer.created_at > as_of:
+        return None
+
+    fields = {field.attname: field for field in get_snapshot_fields()}
+
+    snapshot = customer.snapshots.filter(taken_at__lte=as_of).first()
+    if snapshot is not None:
+        data = dict(snapshot.data)
+        since = snapshot.taken_at
+    else:
+        # The creation log has the initial values, and the fields that weren't sent have their default value
+        data = {name: field.get_default() for name, field in fields.items()}
+        data.update(
+            created_at=customer.created_at, updated_at=customer.created_at, created_by_id=customer.created_by_id)
+        since = None
+
+    for log in _get_logs(customer, since, as_of):
+        for field_data in log.fields_changed or []:
+            name = field_data.get('name') if isinstance(field_data, dict) else None
+            if name not in fields:
+                continue
+            value = field_data.get('new_value')
+            if isinstance(fields[name], models.FileField) and value == UNKNOWN_FILE_VALUE:
+                value = None
+            data[name] = value
+        if log.user_id is not None:
+            data['updated_by_id'] = log.user_id
+        data['updated_at'] = log.created_at
+
+    historical_customer = Customer(id=customer.id, **{
+        name: field.to_python(data.get(name, field.get_default())) for name, field in fields.items()
+    })
+
+    users = User.objects.in_bulk({historical_customer.created_by_id, historical_customer.updated_by_id} - {None})
+    historical_customer.created_by = users.get(historical_customer.created_by_id)
+    historical_customer.updated_by = users.get(historical_customer.updated_by_id)
+    return historical_customer
+
+
+def _get_logs(customer, since, until):
+    """
+    :return: Logs of the customer created after 'since' (if it isn't None) and until 'until', from the oldest. The
+    archived logs are only read if some block of the customer has logs in that range
+    """
+    logs = customer.customerlog_set.filter(created_at__lte=until).only('created_at', 'user_id', 'fields_changed')
+    blocks = CustomerLogArchiveBlock.objects.filter(customer=customer, first_created_at__lte=until)
+    if since is not None:
+        logs = logs.filter(created_at__gt=since)
+        blocks = blocks.filter(last_created_at__gt=since)
+
+    logs = list(logs)
+    blocks = list(blocks)
+    if blocks:
+        logs.extend(
+            log for log in CustomerLogArchive.from_settings().read_logs(blocks)
+            if (since is None or log.created_at > since) and log.created_at <= until
+        )
+    return sorted(logs, key=lambda log: (log.created_at, log.id))
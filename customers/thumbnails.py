@@ -0,0 +1,200 @@
+import io
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_EXTENSION = '.jpg'
+
+_thumbnail_pool = None
+_thumbnail_pool_lock = threading.Lock()
+
+
+def get_thumbnail_sizes():
+    """ :return: dict with the name and the max (width, height) of each rendition, e.g. {'small': (80, 80)} """
+    return getattr(settings, 'CUSTOMER_PHOTO_THUMBNAIL_SIZES', {})
+
+
+def get_thumbnail_name(photo_name, size_name):
+    """
+    The renditions are stored next to the original photo, with the name of the size before the extension,
+    e.g. 'customers/photo/customer-20200101.png' -> 'customers/photo/customer-20200101.small.jpg'
+    :param photo_name: Name of the photo in the storage
+    :param size_name: Name of the size in CUSTOMER_PHOTO_THUMBNAIL_SIZES
+    :return: Name of the rendition in the storage
+    """
+    return '{}.{}{}'.format(os.path.splitext(photo_name)[0], size_name, THUMBNAIL_EXTENSION)
+
+
+def get_thumbnail_urls(photo_name):
+    """
+    The urls are built from the name of the photo, without reading the storage, so they don't change when the
+    renditions are generated in background (and the ETag of the customer is still valid). A rendition can take a moment
+    to be available after the upload.
+    :param photo_name: Name of the photo in the storage
+    :return: dict with the url of each rendition or None if there isn't photo
+    """
+    if not photo_name:
+        return None
+
+    return {
+        size_name: default_storage.url(get_thumbnail_name(photo_name, size_name))
+        for size_name in get_thumbnail_sizes()
+    }
+
+
+def generate_thumbnails(photo_name, storage=None, overwrite=True):
+    """
+    Function to generate the renditions of a photo. The image is reduced to each size keeping its aspect ratio, and it
+    is encoded again as an optimized JPEG.
+    :param photo_name: Name of the photo in the storage
+    :param storage: Storage of the photo (default_storage by default)
+    :param overwrite: If it's False, the existing renditions aren't generated again
+    :return: list with the names of the generated renditions
+    """
+    storage = storage or default_storage
+    sizes = {
+        size_name: size for size_name, size in get_thumbnail_sizes().items()
+        if overwrite or not storage.exists(get_thumbnail_name(photo_name, size_name))
+    }
+    if not sizes:
+        return []
+
+    quality = getattr(settings, 'CUSTOMER_PHOTO_THUMBNAIL_QUALITY', 80)
+    with storage.open(photo_name, 'rb') as photo_file:
+        original = Image.open(photo_file)
+        # JPEG images can be decoded at a reduced scale, which is much faster for big photos
+        original.draft('RGB', max(sizes.values()))
+        original = ImageOps.exif_transpose(original)
+        original.load()
+
+    if original.mode in ('RGBA', 'LA', 'P'):
+        # JPEG doesn't have transparency, so the transparent pixels are white
+        original = original.convert('RGBA')
+        background = Image.new('RGB', original.size, (255, 255, 255))
+        background.paste(original, mask=original.getchannel('A'))
+        original = background
+    elif original.mode != 'RGB':
+        original = original.convert('RGB')
+
+    thumbnail_names = []
+    for size_name, size in sizes.items():
+        image = original.copy()
+        image.thumbnail(size, Image.LANCZOS)
+
+        content = io.BytesIO()
+        image.save(content, format='JPEG', quality=quality, optimize=True, progressive=True)
+
+        thumbnail_names.append(_replace_file(storage, get_thumbnail_name(photo_name, size_name), content.getvalue()))
+
+    return thumbnail_names
+
+
+def _replace_file(storage, name, content):
+    """
+    Function to write a file with a fixed name. In a local storage, it's written to a temporary file that replaces
+    the old one (os.replace is atomic), so the old file can be read until the new one is complete. Other storages
+    can't rename files, so the old file is deleted before saving the new one.
+    :return: Name of the file
+    """
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        if storage.exists(name):
+            storage.delete(name)
+        return storage.save(name, ContentFile(content))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex[:8])
+    try:
+        with open(temporary_path, 'wb') as temporary_file:
+            temporary_file.write(content)
+        permissions_mode = getattr(storage, 'file_permissions_mode', None)
+        if permissions_mode is not None:
+            os.chmod(temporary_path, permissions_mode)
+        os.replace(temporary_path, path)
+    except Exception:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    return name
+
+
+def get_thumbnail_pool():
+    """
+    Function to get the pool that generates the renditions of the process.
+    :return: ThumbnailPool instance
+    """
+    global _thumbnail_pool
+    with _thumbnail_pool_lock:
+        if _thumbnail_pool is None:
+            _thumbnail_pool = ThumbnailPool(max_workers=getattr(settings, 'CUSTOMER_PHOTO_THUMBNAIL_WORKERS', 2))
+        return _thumbnail_pool
+
+
+class ThumbnailPool:
+    """
+    Pool of threads that generate the renditions of the uploaded photos, so the request doesn't wait for them.
+    Pillow releases the GIL while it decodes, resizes and encodes the images, so the threads run in parallel.
+    With 'max_workers' = 0, the renditions are generated in the calling thread.
+    """
+
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+
+        self._executor = None
+        self._pid = None
+        self._futures = set()
+        self._lock = threading.Lock()
+
+    def submit(self, photo_name, overwrite=True):
+        """
+        :param photo_name: Name of the photo in the storage
+        :param overwrite: If it's False, the existing renditions aren't generated again
+        :return: Future of the generation or None if it has been done in the calling thread
+        """
+        if not self.max_workers:
+            self._generate(photo_name, overwrite)
+            return None
+
+        with self._lock:
+            if self._pid != os.getpid():
+                # The process has been forked, so the threads of the parent aren't ours
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='customer-thumbnails')
+                self._futures = set()
+
+            future = self._executor.submit(self._generate, photo_name, overwrite)
+            self._futures.add(future)
+        future.add_done_callback(self._discard_future)
+        return future
+
+    def join(self):
+        """ It waits until the submitted renditions are generated """
+        with self._lock:
+            futures = list(self._futures)
+        wait(futures)
+
+    def _discard_future(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    @staticmethod
+    def _generate(photo_name, overwrite):
+        try:
+            return generate_thumbnails(photo_name, overwrite=overwrite)
+        except Exception:
+            # A broken image mustn't break the upload. The renditions can be generated again with the command
+            # 'generate_customer_thumbnails'
+            logger.exception('Thumbnails of %s could not be generated', photo_name)
+            return []